@@ -8,11 +8,11 @@ load_dotenv()  # read .env
 BASE_DIR = Path(__file__).resolve().parents[1]
 DATA_DIR = BASE_DIR / "data"
 
-# Load YAML config
-CFG_FILE = BASE_DIR / "config.yaml"
+# Load YAML config: config.yml, or config.yaml if that is what exists
+CFG_FILE = next((p for p in (BASE_DIR / "config.yml", BASE_DIR / "config.yaml") if p.exists()), BASE_DIR / "config.yml")
 if CFG_FILE.exists():
-    with open(CFG_FILE, "r") as fh:
-        _cfg = yaml.safe_load(fh)
+    with open(CFG_FILE, "r", encoding="utf-8") as fh:
+        _cfg = yaml.safe_load(fh) or {}
 else:
     _cfg = {}
 
@@ -21,19 +21,42 @@ BACKGROUND_DIR = Path(os.getenv("BACKGROUND_DIR", str(DATA_DIR / "backgrounds"))
 HOOKS_DIR = Path(os.getenv("HOOKS_DIR", str(DATA_DIR / "hooks")))
 COMPOSED_DIR = Path(os.getenv("COMPOSED_DIR", str(DATA_DIR / "composed")))
 PRODUCTS_DIR = Path(os.getenv("PRODUCTS_DIR", str(DATA_DIR / "products")))
+CACHE_DIR = Path(os.getenv("CACHE_DIR", str(DATA_DIR / "cache")))
 
 # Ensure directories exist
-for p in (BACKGROUND_DIR, HOOKS_DIR, COMPOSED_DIR, PRODUCTS_DIR, DATA_DIR / "reports"):
+for p in (BACKGROUND_DIR, HOOKS_DIR, COMPOSED_DIR, PRODUCTS_DIR, CACHE_DIR, DATA_DIR / "reports"):
     p.mkdir(parents=True, exist_ok=True)
 
 # API keys
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
+# API base URLs (override to point at a proxy or a local stub server)
+OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta")
 BUFFER_ACCESS_TOKEN = os.getenv("BUFFER_ACCESS_TOKEN", "")
 UNSPLASH_ACCESS_KEY = os.getenv("UNSPLASH_ACCESS_KEY", "")
 
 # Scheduler
 SCHEDULE_CRON = os.getenv("SCHEDULE_CRON", "0 * * * *")  # hourly by default
+
+# Pipeline (pipeline.run_pipeline)
+PIPELINE_CFG = _cfg.get("pipeline", {})
+# Per-run checkpoint manifests: RUNS_DIR/<run-id>/manifest.json
+RUNS_DIR = Path(os.getenv("RUNS_DIR", str(DATA_DIR / "runs")))
+# The scheduler resumes the newest incomplete run if it is this recent and has been tried fewer times
+RUNS_RESUME_WINDOW = int(PIPELINE_CFG.get("resume_window", 6 * 3600))
+RUNS_MAX_ATTEMPTS = int(PIPELINE_CFG.get("max_attempts", 3))
+# "streaming": overlapped stages connected by bounded queues; "sequential": one stage after another
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", PIPELINE_CFG.get("mode", "streaming"))
+# Items buffered between two stages (and hooks in the compose pool) before the upstream stage blocks
+PIPELINE_QUEUE_SIZE = int(PIPELINE_CFG.get("queue_size", 8))
+# Compose worker processes in the streaming pipeline (0 = image.compose_workers)
+PIPELINE_COMPOSE_WORKERS = int(PIPELINE_CFG.get("compose_workers", 0))
+# Assemble posts (and enqueue them into the outbox), then post them by draining the outbox
+PIPELINE_ASSEMBLE = bool(PIPELINE_CFG.get("assemble", False))
+PIPELINE_POST = bool(PIPELINE_CFG.get("post", False))
+# Assembled posts per outbox drain in the post stage
+PIPELINE_POST_BATCH = int(PIPELINE_CFG.get("post_batch", 1))
 POSTS_PER_DAY = int(os.getenv("DEFAULT_POSTS_PER_DAY", _cfg.get("posts", {}).get("posts_per_day", 10)))
 
 # image compose defaults
@@ -45,3 +68,124 @@ FONT_PATH = IMAGE_CFG.get("default_font", "/usr/share/fonts/opentype/noto/NotoSa
 FONT_SIZE = IMAGE_CFG.get("font_size", 56)
 COMPOSED_WIDTH = IMAGE_CFG.get("composed_width", 1200)
 COMPOSED_HEIGHT = IMAGE_CFG.get("composed_height", 1200)
+# Parallel composition: 0 = one worker per CPU, 1 = compose serially in-process
+COMPOSE_WORKERS = int(os.getenv("COMPOSE_WORKERS", IMAGE_CFG.get("compose_workers", 0)))
+COMPOSE_CHUNKSIZE = int(IMAGE_CFG.get("compose_chunksize", 4))
+# Composed image encoder: png | jpeg | webp, plus per-format settings
+IMAGE_OUTPUT_CFG = IMAGE_CFG.get("output", {})
+OUTPUT_FORMAT = os.getenv("COMPOSED_FORMAT", IMAGE_OUTPUT_CFG.get("format", "png")).lower()
+
+# background collection
+COLLECTOR_CFG = _cfg.get("collector", {})
+# Max Hamming distance (of 64 dHash bits) at which two backgrounds count as near-duplicates; -1 disables
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", COLLECTOR_CFG.get("phash_max_distance", 6)))
+COLLECTOR_SOURCES = COLLECTOR_CFG.get("sources", ["pinterest"])  # pinterest, unsplash
+COLLECTOR_MAX_CONNECTIONS = int(COLLECTOR_CFG.get("max_connections", 10))
+COLLECTOR_MAX_PER_HOST = int(COLLECTOR_CFG.get("max_connections_per_host", 5))
+COLLECTOR_DOWNLOAD_WORKERS = int(COLLECTOR_CFG.get("download_workers", 4))
+COLLECTOR_MAX_PINTEREST_IMAGES = int(COLLECTOR_CFG.get("max_pinterest_images", 20))
+# Downloads smaller than this (parsed from the image header) are aborted early
+COLLECTOR_MIN_WIDTH = int(COLLECTOR_CFG.get("min_width", 500))
+COLLECTOR_MIN_HEIGHT = int(COLLECTOR_CFG.get("min_height", 500))
+# Download shaping: bytes/second across all downloads (0 = unlimited) and bytes in flight at once
+COLLECTOR_MAX_BYTES_PER_SEC = int(os.getenv("COLLECTOR_MAX_BYTES_PER_SEC", COLLECTOR_CFG.get("max_bytes_per_sec", 0)))
+COLLECTOR_MAX_INFLIGHT_BYTES = int(COLLECTOR_CFG.get("max_inflight_bytes", 64 * 1024 * 1024))
+# Backgrounds kept in the content-addressed store; the least recently fetched are evicted beyond this (0 = keep all)
+COLLECTOR_MAX_STORED = int(COLLECTOR_CFG.get("max_stored", 300))
+
+# Shared HTTP client (kjc_cli.http_client)
+HTTP_CFG = _cfg.get("http", {})
+HTTP_POOL_CONNECTIONS = int(HTTP_CFG.get("pool_connections", 10))
+HTTP_POOL_MAXSIZE = int(HTTP_CFG.get("pool_maxsize", 20))
+HTTP_CONNECT_TIMEOUT = float(HTTP_CFG.get("connect_timeout", 10))
+HTTP_READ_TIMEOUT = float(HTTP_CFG.get("read_timeout", 60))
+HTTP_RETRIES = int(HTTP_CFG.get("retries", 3))
+
+# Buffer posting engine
+BUFFER_CFG = _cfg.get("buffer", {})
+BUFFER_CONCURRENCY = int(BUFFER_CFG.get("concurrency", 4))
+BUFFER_MAX_ATTEMPTS = int(BUFFER_CFG.get("max_attempts", 5))
+# Reuse a media ID for identical image bytes for this long (seconds); 0 disables the cache
+BUFFER_MEDIA_CACHE_TTL = int(BUFFER_CFG.get("media_cache_ttl", 7 * 24 * 3600))
+# endpoint -> {rate: requests/second, burst: bucket size}
+BUFFER_RATE_LIMITS = {
+    "upload": {"rate": 0.5, "burst": 2},
+    "create": {"rate": 1.0, "burst": 3},
+    **BUFFER_CFG.get("rate_limits", {}),
+}
+
+# Zapier fan-out (zapier_poster.run_fan_out)
+ZAPIER_CFG = _cfg.get("zapier", {})
+ZAPIER_MAX_CONCURRENCY = int(ZAPIER_CFG.get("max_concurrency", 8))
+# Per-webhook pacing: posts/second and burst (0.2/s = the old 5 s gap between posts)
+ZAPIER_WEBHOOK_RATE = float(ZAPIER_CFG.get("webhook_rate", 0.2))
+ZAPIER_WEBHOOK_BURST = float(ZAPIER_CFG.get("webhook_burst", 1))
+
+# Durable posting outbox (kjc_cli.outbox)
+OUTBOX_CFG = _cfg.get("outbox", {})
+OUTBOX_DB = Path(os.getenv("OUTBOX_DB", str(DATA_DIR / "outbox.sqlite3")))
+# Channels content_assembler enqueues into: "buffer" and/or "zapier:<THREADS_ID>"
+OUTBOX_CHANNELS = OUTBOX_CFG.get("channels", ["buffer"])
+OUTBOX_BATCH_SIZE = int(OUTBOX_CFG.get("batch_size", 20))
+OUTBOX_MAX_ATTEMPTS = int(OUTBOX_CFG.get("max_attempts", 5))
+# Seconds an inflight item stays claimed before another drain may take it over (its drain presumably crashed)
+OUTBOX_LEASE_SECONDS = float(OUTBOX_CFG.get("lease_seconds", 600))
+
+# Product feed import (product_importer)
+PRODUCTS_CFG = _cfg.get("products", {})
+PRODUCTS_CHUNKSIZE = int(PRODUCTS_CFG.get("chunksize", 50000))
+# Cache parsed feeds as Parquet in CACHE_DIR/products (needs pyarrow; skipped without it)
+PRODUCTS_COLUMNAR_CACHE = bool(PRODUCTS_CFG.get("columnar_cache", True))
+# Per-feed link -> row hash index used to import only added/changed/removed products
+PRODUCTS_INDEX_DB = Path(os.getenv("PRODUCTS_INDEX_DB", str(PRODUCTS_DIR / "product_index.sqlite3")))
+
+# Content assembly (content_assembler)
+ASSEMBLER_CFG = _cfg.get("assembler", {})
+# "jsonl": stream posts to data/posts_payload.jsonl only; "json": also write data/posts_payload.json
+ASSEMBLER_PAYLOAD_FORMAT = ASSEMBLER_CFG.get("payload_format", "jsonl")
+# fsync policy for the JSONL payload: always | batch | never
+ASSEMBLER_FSYNC = ASSEMBLER_CFG.get("fsync", "batch")
+ASSEMBLER_FSYNC_EVERY = int(ASSEMBLER_CFG.get("fsync_every", 50))
+# Previous payload files kept as posts_payload.<timestamp>.jsonl
+ASSEMBLER_KEEP_ROTATED = int(ASSEMBLER_CFG.get("keep_rotated", 5))
+
+# Product catalog (product_catalog): category -> title keywords, also matched against hooks
+CATALOG_CFG = _cfg.get("catalog", {})
+CATALOG_CATEGORIES = CATALOG_CFG.get("categories", {
+    "outerwear": ["アウター", "ジャケット", "コート", "ブルゾン"],
+    "knitwear": ["ニット", "セーター", "カーディガン"],
+    "sweats": ["スウェット", "パーカー", "フーディー", "トレーナー"],
+    "shirts": ["シャツ", "ロンT", "Tシャツ"],
+    "pants": ["パンツ", "デニム", "スラックス"],
+    "sneakers": ["スニーカー", "シューズ"],
+    "bags": ["バッグ", "カバン", "鞄"],
+    "watches": ["時計"],
+    "fragrance": ["香水", "香り"],
+})
+# Products updated (per the product index) within this many seconds are preferred by pick(); 0 = no preference
+CATALOG_FRESH_WITHIN = int(CATALOG_CFG.get("fresh_within", 7 * 24 * 3600))
+
+# Hook generation (hook_generator)
+HOOKS_CFG = _cfg.get("hooks", {})
+# LLM providers tried in order for each batch; those without an API key are skipped
+HOOKS_PROVIDERS = HOOKS_CFG.get("providers", ["gemini", "openai"])
+HOOKS_GEMINI_MODEL = HOOKS_CFG.get("gemini_model", "gemini-2.5-flash")
+HOOKS_OPENAI_MODEL = HOOKS_CFG.get("openai_model", "gpt-4o-mini")
+HOOKS_BATCH_SIZE = int(HOOKS_CFG.get("batch_size", 10))
+HOOKS_MAX_PARALLEL = int(HOOKS_CFG.get("max_parallel", 4))
+HOOKS_TEMPERATURE = float(HOOKS_CFG.get("temperature", 0.9))
+HOOKS_MAX_CHARS = int(HOOKS_CFG.get("max_chars", 80))
+HOOKS_CACHE_TTL = int(HOOKS_CFG.get("cache_ttl", 24 * 3600))
+# Product categories the prompt batches are spread across (empty = generic fashion prompt)
+HOOKS_CATEGORIES = HOOKS_CFG.get("categories", [])
+# Append-only store of every generated hook (hook_store)
+HOOKS_DB = Path(os.getenv("HOOKS_DB", str(DATA_DIR / "hooks.sqlite3")))
+# Also write each run's hooks to HOOKS_DIR/hooks_<timestamp>.json (legacy format)
+HOOKS_WRITE_JSON = bool(HOOKS_CFG.get("write_json", False))
+HOOKS_NOVELTY_CFG = HOOKS_CFG.get("novelty", {})
+HOOKS_NOVELTY_ENABLED = bool(HOOKS_NOVELTY_CFG.get("enabled", True))
+# Candidates whose estimated Jaccard similarity (character n-grams) to any earlier hook reaches this are rejected
+HOOKS_NOVELTY_THRESHOLD = float(HOOKS_NOVELTY_CFG.get("threshold", 0.6))
+HOOKS_NOVELTY_NGRAM = int(HOOKS_NOVELTY_CFG.get("ngram", 3))
+# Extra LLM rounds asked for replacements when candidates are rejected
+HOOKS_NOVELTY_MAX_ROUNDS = int(HOOKS_NOVELTY_CFG.get("max_rounds", 2))
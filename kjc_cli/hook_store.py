@@ -0,0 +1,132 @@
+"""
+Append-only store of every generated hook, backed by SQLite.
+
+run_generate appends each run's hooks in one transaction (cost is
+O(new hooks), not O(history)), tagged with their source ("gemini",
+"openai", "template", ...) and model. Indexes on created_at, model and
+(source, model) keep "most recent N" and "by model" queries cheap
+however long the history grows. Legacy per-run hooks_*.json files in
+HOOKS_DIR are imported once.
+"""
+
+import json
+import sqlite3
+import time
+from contextlib import closing
+from datetime import datetime, timezone
+from kjc_cli import config
+from kjc_cli.logger import get_logger
+
+logger = get_logger("hook_store")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hooks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    text TEXT NOT NULL,
+    source TEXT NOT NULL,
+    model TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_hooks_created_at ON hooks (created_at);
+CREATE INDEX IF NOT EXISTS idx_hooks_source_model ON hooks (source, model, created_at);
+CREATE INDEX IF NOT EXISTS idx_hooks_model ON hooks (model, created_at);
+CREATE INDEX IF NOT EXISTS idx_hooks_text ON hooks (text, created_at);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+def _connect(db_path=None):
+    db_path = db_path or config.HOOKS_DB
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+def _row(row):
+    return {"id": row[0], "text": row[1], "source": row[2], "model": row[3], "created_at": row[4]}
+
+def append(records, created_at=None, db_path=None):
+    """Append (text, source, model) records in one transaction. Returns the number written."""
+    now = created_at or time.time()
+    rows = [(text, source, model, now) for text, source, model in records]
+    if not rows:
+        return 0
+    with closing(_connect(db_path)) as conn, conn:
+        conn.executemany("INSERT INTO hooks (text, source, model, created_at) VALUES (?, ?, ?, ?)", rows)
+    return len(rows)
+
+def recent(n=100, db_path=None):
+    """The n most recently stored hooks, newest first"""
+    with closing(_connect(db_path)) as conn:
+        rows = conn.execute(
+            "SELECT id, text, source, model, created_at FROM hooks ORDER BY created_at DESC, id DESC LIMIT ?", (n,)
+        ).fetchall()
+    return [_row(r) for r in rows]
+
+def by_model(model, source=None, limit=None, db_path=None):
+    """Hooks generated by a model (optionally only from one source), newest first"""
+    query = "SELECT id, text, source, model, created_at FROM hooks WHERE "
+    if source:
+        query += "source = ? AND model = ?"
+        params = [source, model]
+    else:
+        query += "model = ?"
+        params = [model]
+    query += " ORDER BY created_at DESC, id DESC"
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
+    with closing(_connect(db_path)) as conn:
+        rows = conn.execute(query, params).fetchall()
+    return [_row(r) for r in rows]
+
+def last_used(texts, db_path=None):
+    """text -> when it was last stored, for those of texts stored at all"""
+    texts = list(texts)
+    if not texts:
+        return {}
+    with closing(_connect(db_path)) as conn:
+        rows = conn.execute(
+            f"SELECT text, MAX(created_at) FROM hooks WHERE text IN ({','.join('?' * len(texts))}) GROUP BY text", texts
+        ).fetchall()
+    return dict(rows)
+
+def iter_texts(batch_size=1000, db_path=None):
+    """Every stored hook text, oldest first, fetched in batches"""
+    with closing(_connect(db_path)) as conn:
+        cursor = conn.execute("SELECT text FROM hooks ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for (text,) in rows:
+                yield text
+
+def count(db_path=None):
+    with closing(_connect(db_path)) as conn:
+        return conn.execute("SELECT COUNT(*) FROM hooks").fetchone()[0]
+
+def migrate_json_files(hooks_dir=None, db_path=None):
+    """Import legacy hooks_<timestamp>.json files once; later calls are a single meta lookup"""
+    hooks_dir = hooks_dir or config.HOOKS_DIR
+    with closing(_connect(db_path)) as conn:
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'json_imported'").fetchone():
+            return 0
+        rows = []
+        for p in sorted(hooks_dir.glob("hooks_*.json")):
+            try:
+                hooks = json.loads(p.read_text(encoding="utf-8"))
+                created_at = datetime.strptime(p.stem[len("hooks_"):], "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc).timestamp()
+            except Exception as e:
+                logger.debug(f"Skipping {p}: {e}")
+                continue
+            rows.extend((h, "legacy", None, created_at) for h in hooks if isinstance(h, str) and h.strip())
+        with conn:
+            conn.executemany("INSERT INTO hooks (text, source, model, created_at) VALUES (?, ?, ?, ?)", rows)
+            conn.execute("INSERT INTO meta (key, value) VALUES ('json_imported', ?)", (str(time.time()),))
+    logger.info(f"Imported {len(rows)} hooks from legacy JSON files in {hooks_dir}")
+    return len(rows)
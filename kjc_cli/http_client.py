@@ -0,0 +1,119 @@
+"""
+Shared, connection-pooled HTTP client.
+
+One keep-alive requests.Session per host (with a retrying adapter and
+default timeouts), so repeated posts and API calls reuse warm TCP/TLS
+connections. Every request's latency is recorded in a per-host histogram,
+available from latency_stats().
+"""
+
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from kjc_cli import config
+from kjc_cli.logger import get_logger
+
+logger = get_logger("http_client")
+
+DEFAULT_TIMEOUT = (config.HTTP_CONNECT_TIMEOUT, config.HTTP_READ_TIMEOUT)
+# Upper bounds (ms) of the latency histogram buckets; the last one catches everything slower
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, float("inf"))
+
+_sessions = {}
+_latency = {}
+_lock = threading.Lock()
+
+def _new_session():
+    retry = Retry(
+        total=config.HTTP_RETRIES,
+        connect=config.HTTP_RETRIES,
+        read=config.HTTP_RETRIES,
+        status=config.HTTP_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=(502, 503, 504),
+        # POSTs are only retried on connection errors (nothing was sent); read/status retries are for idempotent methods
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=config.HTTP_POOL_CONNECTIONS,
+        pool_maxsize=config.HTTP_POOL_MAXSIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def get_session(url):
+    """Keep-alive session for the URL's host (created on first use)"""
+    host = urlsplit(url).netloc
+    session = _sessions.get(host)
+    if session is None:
+        with _lock:
+            session = _sessions.get(host)
+            if session is None:
+                session = _sessions[host] = _new_session()
+    return session
+
+def _record(host, elapsed_ms):
+    with _lock:
+        stats = _latency.get(host)
+        if stats is None:
+            stats = _latency[host] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "buckets": [0] * len(LATENCY_BUCKETS_MS)}
+        stats["count"] += 1
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if elapsed_ms <= bound:
+                stats["buckets"][i] += 1
+                break
+
+def request(method, url, timeout=None, **kwargs):
+    """requests.request() through the pooled session, with a default timeout and latency tracking"""
+    host = urlsplit(url).netloc
+    start = time.perf_counter()
+    try:
+        return get_session(url).request(method, url, timeout=timeout or DEFAULT_TIMEOUT, **kwargs)
+    finally:
+        _record(host, (time.perf_counter() - start) * 1000)
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+def _percentile(stats, q):
+    """Upper bound of the histogram bucket containing the q-quantile"""
+    target = q * stats["count"]
+    seen = 0
+    for bound, n in zip(LATENCY_BUCKETS_MS, stats["buckets"]):
+        seen += n
+        if seen >= target:
+            return bound if bound != float("inf") else stats["max_ms"]
+    return stats["max_ms"]
+
+def latency_stats():
+    """Per-host request count, mean/max latency, p50/p95 bucket bounds and the raw histogram"""
+    with _lock:
+        out = {}
+        for host, stats in _latency.items():
+            out[host] = {
+                "count": stats["count"],
+                "mean_ms": round(stats["total_ms"] / stats["count"], 1),
+                "max_ms": round(stats["max_ms"], 1),
+                "p50_ms": _percentile(stats, 0.5),
+                "p95_ms": _percentile(stats, 0.95),
+                "buckets": dict(zip([str(b) for b in LATENCY_BUCKETS_MS], stats["buckets"])),
+            }
+        return out
+
+def log_latency_stats(hosts=None):
+    for host, stats in latency_stats().items():
+        if hosts is None or host in hosts:
+            logger.info(f"HTTP {host}: {stats['count']} requests, mean {stats['mean_ms']} ms, p95 <= {stats['p95_ms']} ms, max {stats['max_ms']} ms")
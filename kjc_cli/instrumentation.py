@@ -0,0 +1,248 @@
+"""
+Run instrumentation: per-stage and per-function timing, counts and bytes.
+
+stage(name) spans wrap pipeline stages; @timed(name) wraps hot functions.
+Both record calls, errors, wall time, CPU time (of the calling thread, so
+concurrent stages do not count each other's work), items and bytes in/out.
+write_report() dumps everything, plus process-wide CPU and peak RSS (this
+process and, separately, its compose pool children), to
+data/reports/run_<run-id>-<attempt>.json.
+
+With profiling enabled (main.py run-all --profile), every stage thread runs
+under its own cProfile profiler and write_profile() merges them into one
+.prof file (pstats / snakeviz compatible).
+"""
+
+import asyncio
+import cProfile
+import functools
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from kjc_cli import config
+from kjc_cli.logger import get_logger
+from kjc_cli.utils import save_json_atomic
+
+logger = get_logger("instrumentation")
+
+# Optional: not available on Windows
+try:
+    import resource
+except Exception:
+    resource = None
+
+REPORTS_DIR = config.DATA_DIR / "reports"
+
+_lock = threading.Lock()
+_STATS = {}
+_started = {"wall": time.time(), "perf": time.perf_counter()}
+_profiling = {"enabled": False, "profiles": []}
+_local = threading.local()
+
+def _entry(name):
+    entry = _STATS.get(name)
+    if entry is None:
+        entry = _STATS[name] = {
+            "calls": 0, "errors": 0, "wall_s": 0.0, "max_wall_s": 0.0, "cpu_s": 0.0,
+            "items": 0, "bytes_in": 0, "bytes_out": 0,
+        }
+    return entry
+
+def record(name, wall_s=0.0, cpu_s=0.0, calls=1, errors=0, items=0, bytes_in=0, bytes_out=0):
+    with _lock:
+        e = _entry(name)
+        e["calls"] += calls
+        e["errors"] += errors
+        e["wall_s"] += wall_s
+        e["max_wall_s"] = max(e["max_wall_s"], wall_s)
+        e["cpu_s"] += cpu_s
+        e["items"] += items
+        e["bytes_in"] += bytes_in
+        e["bytes_out"] += bytes_out
+
+def add(name, items=0, bytes_in=0, bytes_out=0):
+    """Count items/bytes against a stage or function without timing anything"""
+    record(name, calls=0, items=items, bytes_in=bytes_in, bytes_out=bytes_out)
+
+def reset():
+    with _lock:
+        _STATS.clear()
+        _started.update(wall=time.time(), perf=time.perf_counter())
+        _profiling["profiles"] = []
+
+def drain(*names):
+    """Remove and return the stats of the given names (pool workers send these back to the parent)"""
+    with _lock:
+        return {k: _STATS.pop(k) for k in names if k in _STATS}
+
+def merge(snapshot):
+    """Fold stats drained in another process into this one"""
+    for name, s in (snapshot or {}).items():
+        with _lock:
+            e = _entry(name)
+            for k, v in s.items():
+                e[k] = max(e.get(k, 0.0), v) if k == "max_wall_s" else e.get(k, 0) + v
+
+def _measured(measure, result, args, kwargs):
+    if measure is None:
+        return {}
+    try:
+        return measure(result, args, kwargs) or {}
+    except Exception:
+        return {}
+
+def timed(name=None, measure=None):
+    """
+    Decorator recording calls, errors, wall and CPU time for a function.
+    measure(result, args, kwargs) may return {"items", "bytes_in", "bytes_out"}
+    for the call (items default to 1 per call). For coroutine functions only
+    wall time is recorded: CPU time of a thread running an event loop belongs
+    to every coroutine on it.
+    """
+    def decorator(fn):
+        label = name or fn.__name__
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    result = await fn(*args, **kwargs)
+                except BaseException:
+                    record(label, wall_s=time.perf_counter() - start, errors=1)
+                    raise
+                m = _measured(measure, result, args, kwargs)
+                record(label, wall_s=time.perf_counter() - start, items=m.get("items", 1),
+                       bytes_in=m.get("bytes_in", 0), bytes_out=m.get("bytes_out", 0))
+                return result
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start, cpu = time.perf_counter(), time.thread_time()
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException:
+                record(label, wall_s=time.perf_counter() - start, cpu_s=time.thread_time() - cpu, errors=1)
+                raise
+            m = _measured(measure, result, args, kwargs)
+            record(label, wall_s=time.perf_counter() - start, cpu_s=time.thread_time() - cpu, items=m.get("items", 1),
+                   bytes_in=m.get("bytes_in", 0), bytes_out=m.get("bytes_out", 0))
+            return result
+        return wrapper
+    return decorator
+
+def file_size(path):
+    try:
+        return os.path.getsize(path) if path else 0
+    except OSError:
+        return 0
+
+@contextmanager
+def profiled():
+    """Run the block under a cProfile profiler when profiling is enabled and none is active in this thread"""
+    if not _profiling["enabled"] or getattr(_local, "profiling", False):
+        yield
+        return
+    profile = cProfile.Profile()
+    _local.profiling = True
+    try:
+        profile.enable()
+        yield
+    finally:
+        profile.disable()
+        _local.profiling = False
+        with _lock:
+            _profiling["profiles"].append(profile)
+
+@contextmanager
+def stage(name):
+    """
+    Time a pipeline stage (wall + this thread's CPU). Yields a dict the stage
+    fills with its "items" / "bytes_in" / "bytes_out"; peak RSS is sampled at exit.
+    """
+    label = f"stage:{name}"
+    span = {"items": 0, "bytes_in": 0, "bytes_out": 0}
+    start, cpu = time.perf_counter(), time.thread_time()
+    errors = 0
+    try:
+        with profiled():
+            yield span
+    except BaseException:
+        errors = 1
+        raise
+    finally:
+        record(label, wall_s=time.perf_counter() - start, cpu_s=time.thread_time() - cpu, errors=errors, **span)
+        with _lock:
+            _entry(label)["peak_rss_mb"] = _peak_rss_mb()
+
+def _peak_rss_mb(who=None):
+    if resource is None:
+        return None
+    who = resource.RUSAGE_SELF if who is None else who
+    maxrss = resource.getrusage(who).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def _process_usage():
+    usage = {"wall_s": round(time.perf_counter() - _started["perf"], 3)}
+    if resource is None:
+        return usage
+    me, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    usage.update(
+        cpu_user_s=round(me.ru_utime, 3),
+        cpu_system_s=round(me.ru_stime, 3),
+        children_cpu_user_s=round(children.ru_utime, 3),
+        children_cpu_system_s=round(children.ru_stime, 3),
+        peak_rss_mb=_peak_rss_mb(resource.RUSAGE_SELF),
+        children_peak_rss_mb=_peak_rss_mb(resource.RUSAGE_CHILDREN),
+    )
+    return usage
+
+def report(**extra):
+    with _lock:
+        stats = {k: dict(v) for k, v in _STATS.items()}
+    for s in stats.values():
+        for k in ("wall_s", "max_wall_s", "cpu_s"):
+            s[k] = round(s[k], 4)
+    return {
+        **extra,
+        "started_at": datetime.utcfromtimestamp(_started["wall"]).isoformat() + "Z",
+        "process": _process_usage(),
+        "stages": {k.split(":", 1)[1]: v for k, v in stats.items() if k.startswith("stage:")},
+        "functions": {k: v for k, v in stats.items() if not k.startswith("stage:")},
+    }
+
+def write_report(run_id, attempt=1, **extra):
+    """Write the report for one attempt of a run to data/reports/run_<run_id>-<attempt>.json and return its path"""
+    path = REPORTS_DIR / f"run_{run_id}-{attempt}.json"
+    try:
+        save_json_atomic(path, report(run_id=run_id, attempt=attempt, **extra), fsync=False)
+        logger.info(f"Wrote run report {path}")
+    except Exception as e:
+        logger.warning(f"Could not write run report {path}: {e}")
+    return path
+
+def enable_profiling():
+    _profiling["enabled"] = True
+
+def write_profile(path=None, top=25):
+    """Merge every stage/thread profile into one .prof file and log the top functions by cumulative time"""
+    with _lock:
+        profiles = list(_profiling["profiles"])
+    if not profiles:
+        return None
+    path = path or REPORTS_DIR / f"profile_{datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}.prof"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    out = io.StringIO()
+    stats = pstats.Stats(profiles[0], stream=out)
+    for p in profiles[1:]:
+        stats.add(p)
+    stats.dump_stats(str(path))
+    stats.sort_stats("cumulative").print_stats(top)
+    logger.info(f"Wrote profile {path}\n{out.getvalue()}")
+    return path
@@ -1,16 +1,48 @@
 import asyncio
 import aiohttp
+import hashlib
+import json
 import os
 import random
+from datetime import datetime
 from pathlib import Path
 from tenacity import retry, wait_exponential, stop_after_attempt
 from bs4 import BeautifulSoup
-from kjc_cli import config
+from kjc_cli import config, instrumentation
 from kjc_cli.logger import get_logger
+from kjc_cli.modules import image_composer, image_dedupe, image_probe
+from kjc_cli.ratelimit import AsyncTokenBucket, AsyncWeightedSemaphore
+from kjc_cli.utils import file_sha256, save_json_atomic
 
 logger = get_logger("background_collector")
 IMAGES_LIST_FILE = Path("images.txt")
 DEFAULT_DIR = config.BACKGROUND_DIR
+# URL -> {digest, file, etag, last_modified, fetched_at} for the content-addressed store
+INDEX_FILE = config.CACHE_DIR / "background_index.json"
+# In-flight downloads live here until their digest (and final name) is known;
+# interrupted ones stay as <sha1(url)>.part (+ .json validators) and are resumed with Range
+PARTIAL_DIRNAME = ".partial"
+CHUNK_SIZE = 64 * 1024
+# Bytes reserved against max_inflight_bytes when the server sends no Content-Length
+DEFAULT_RESERVE_BYTES = 4 * 1024 * 1024
+
+# Counters for the current/last collection run (see _collect)
+DOWNLOAD_STATS = {}
+
+def _reset_stats():
+    DOWNLOAD_STATS.clear()
+    DOWNLOAD_STATS.update({
+        "bytes_downloaded": 0,      # body bytes received over the network
+        "bytes_saved_by_resume": 0, # bytes not re-downloaded thanks to Range requests
+        "resumed_downloads": 0,
+        "not_modified": 0,
+        "duplicates": 0,
+        "near_duplicates": 0,
+        "rejected": 0,
+        "stored": 0,
+    })
+
+_reset_stats()
 
 # Multiple Pinterest boards — add as many as you want
 PINTEREST_URLS = [
@@ -25,38 +57,215 @@ KEYWORDS = [
     "store interior professional photography"
 ]
 
+def _load_index():
+    try:
+        with open(INDEX_FILE, "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable background index {INDEX_FILE}: {e}")
+        return {}
+
+def _conditional_headers(entry, dest_dir: Path):
+    """If-None-Match / If-Modified-Since for a URL we already hold the bytes of"""
+    headers = {}
+    if entry and (dest_dir / entry["file"]).exists():
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+class _DownloadContext:
+    """State shared by every download of one collection run"""
+
+    def __init__(self, dest_dir: Path):
+        self.dest_dir = dest_dir
+        self.partial_dir = dest_dir / PARTIAL_DIRNAME
+        self.index = _load_index()
+        self.phash_index = image_dedupe.PHashIndex()
+        self.bandwidth = AsyncTokenBucket(config.COLLECTOR_MAX_BYTES_PER_SEC, capacity=max(CHUNK_SIZE, config.COLLECTOR_MAX_BYTES_PER_SEC))
+        self.inflight = AsyncWeightedSemaphore(config.COLLECTOR_MAX_INFLIGHT_BYTES)
+
+def _load_part_meta(meta_path: Path):
+    try:
+        with open(meta_path, "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except Exception:
+        return None
+
+def _discard_part(part_path: Path, meta_path: Path):
+    for p in (part_path, meta_path):
+        if p.exists():
+            p.unlink()
+
+def _range_headers(part_path: Path, meta):
+    """Range/If-Range to continue an interrupted download; empty if there is nothing to resume"""
+    if not meta or not part_path.exists():
+        return {}
+    offset = part_path.stat().st_size
+    validator = meta.get("etag") or meta.get("last_modified")
+    if not offset or not validator:
+        return {}
+    return {"Range": f"bytes={offset}-", "If-Range": validator}
+
+# Outside @retry: one call per URL however many attempts it takes; bytes_in is counted as chunks arrive
+@instrumentation.timed("_fetch", measure=lambda path, args, kwargs: {"items": int(path is not None)})
 @retry(wait=wait_exponential(min=2, max=30), stop=stop_after_attempt(5))
-async def _fetch(session, url, dest_path: Path):
-    """Download and save image."""
-    timeout = aiohttp.ClientTimeout(total=60)
-    async with session.get(url, timeout=timeout) as resp:
-        if resp.status != 200:
+async def _fetch(session, url, ctx: _DownloadContext):
+    """
+    Download an image into the content-addressed store and return its path.
+    Files are named by the sha256 of their bytes, so identical images from
+    different URLs are stored once; URLs already in the index are revalidated
+    with a conditional GET instead of being downloaded again. The stream is
+    validated as it arrives (magic bytes, header dimensions) and aborted early
+    if it is not an image or is too small; only complete, validated files are
+    renamed into the store. A transfer that fails midway keeps its .part file
+    and the retry resumes it with an HTTP Range request. New content that is
+    perceptually near an existing background is dropped in favour of it.
+    Returns None if the download was rejected.
+    """
+    dest_dir = ctx.dest_dir
+    entry = ctx.index.get(url)
+    ctx.partial_dir.mkdir(parents=True, exist_ok=True)
+    key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    part_path = ctx.partial_dir / f"{key}.part"
+    meta_path = ctx.partial_dir / f"{key}.json"
+    
+    headers = _range_headers(part_path, _load_part_meta(meta_path)) or _conditional_headers(entry, dest_dir)
+    # No total timeout: throttled large downloads may legitimately take long, stalls are caught by sock_read
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=15, sock_read=60)
+    async with session.get(url, timeout=timeout, headers=headers) as resp:
+        if resp.status == 304:
+            DOWNLOAD_STATS["not_modified"] += 1
+            logger.info(f"Not modified: {url} -> {entry['file']}")
+            return dest_dir / entry["file"]
+        if resp.status == 416:
+            # Our partial no longer matches what the server has; start over on the retry
+            _discard_part(part_path, meta_path)
+            raise Exception(f"Range not satisfiable for {url}, restarting download")
+        if resp.status not in (200, 206):
             raise Exception(f"Failed to fetch {url}, status {resp.status}")
-        with open(dest_path, 'wb') as f:
-            async for chunk in resp.content.iter_chunked(8192):
-                f.write(chunk)
-        logger.info(f"Saved {url} -> {dest_path}")
-
-async def _run_download(urls, dest_dir):
-    """Download all collected image URLs."""
-    dest_dir.mkdir(parents=True, exist_ok=True)
-    connector = aiohttp.TCPConnector(limit=10, limit_per_host=5, ttl_dns_cache=300)
-    timeout = aiohttp.ClientTimeout(total=60)
+        if not image_probe.content_type_ok(resp.headers.get("Content-Type")):
+            DOWNLOAD_STATS["rejected"] += 1
+            _discard_part(part_path, meta_path)
+            logger.warning(f"Rejected {url}: Content-Type {resp.headers.get('Content-Type')}")
+            return None
+        
+        probe = image_probe.StreamProbe(config.COLLECTOR_MIN_WIDTH, config.COLLECTOR_MIN_HEIGHT)
+        h = hashlib.sha256()
+        offset = 0
+        received = 0
+        reserved = 0
+        try:
+            if resp.status == 206:
+                # Re-hash and re-probe the bytes we already have, then append
+                offset = part_path.stat().st_size
+                with open(part_path, "rb") as f:
+                    for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                        probe.feed(chunk)
+                        h.update(chunk)
+                DOWNLOAD_STATS["resumed_downloads"] += 1
+                DOWNLOAD_STATS["bytes_saved_by_resume"] += offset
+                logger.info(f"Resuming {url} at byte {offset}")
+            else:
+                with open(meta_path, "w", encoding="utf-8") as f:
+                    json.dump({"url": url, "etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified")}, f)
+            
+            expected = resp.content_length
+            reserved = await ctx.inflight.acquire(expected or DEFAULT_RESERVE_BYTES)
+            with open(part_path, 'ab' if offset else 'wb') as f:
+                async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                    # Counted before probing, so a rejection reports the bytes actually read
+                    received += len(chunk)
+                    DOWNLOAD_STATS["bytes_downloaded"] += len(chunk)
+                    probe.feed(chunk)
+                    await ctx.bandwidth.acquire(len(chunk))
+                    h.update(chunk)
+                    f.write(chunk)
+            probe.finish()
+            if expected is not None and received != expected:
+                # Keep the .part file: the retry continues from here
+                raise Exception(f"Truncated transfer for {url}: {received}/{expected} bytes")
+        except image_probe.InvalidImage as e:
+            DOWNLOAD_STATS["rejected"] += 1
+            _discard_part(part_path, meta_path)
+            logger.warning(f"Rejected {url} after {offset + received} bytes: {e}")
+            return None
+        finally:
+            instrumentation.add("_fetch", bytes_in=received)
+            await ctx.inflight.release(reserved)
+        
+        try:
+            digest = h.hexdigest()
+            dest_path = dest_dir / f"{digest}{probe.extension}"
+            if dest_path.exists():
+                DOWNLOAD_STATS["duplicates"] += 1
+                logger.info(f"Duplicate content {url} -> {dest_path.name}")
+            else:
+                try:
+                    phash = await asyncio.to_thread(image_dedupe.dhash, part_path)
+                except Exception as e:
+                    DOWNLOAD_STATS["rejected"] += 1
+                    logger.warning(f"Discarding {url}: not a decodable image ({e})")
+                    return None
+                near = ctx.phash_index.find_near(phash)
+                if near and (dest_dir / near[1]).exists():
+                    DOWNLOAD_STATS["near_duplicates"] += 1
+                    dest_path = dest_dir / near[1]
+                    logger.info(f"Near-duplicate {url} (distance {near[0]}) -> {dest_path.name}")
+                else:
+                    os.replace(part_path, dest_path)
+                    ctx.phash_index.add(phash, dest_path.name)
+                    DOWNLOAD_STATS["stored"] += 1
+                    logger.info(f"Saved {url} -> {dest_path} ({probe.size[0]}x{probe.size[1]})")
+        finally:
+            _discard_part(part_path, meta_path)
+        
+        ctx.index[url] = {
+            "digest": dest_path.stem,
+            "file": dest_path.name,
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+            "fetched_at": datetime.utcnow().isoformat() + "Z",
+        }
+        return dest_path
 
-    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
-        semaphore = asyncio.Semaphore(4)
-        async def _bounded_fetch(url, dest):
-            async with semaphore:
-                return await _fetch(session, url, dest)
+def _stored_backgrounds(dest_dir: Path):
+    # The same suffixes the composer picks backgrounds by, so every usable background is also evictable
+    return [p for p in dest_dir.glob("*") if p.is_file() and p.suffix.lower() in image_composer.BACKGROUND_SUFFIXES]
 
-        tasks = []
-        for i, u in enumerate(urls):
-            name = f"background_{i+1}.jpg"
-            dest = dest_dir / name
-            tasks.append(_bounded_fetch(u.strip(), dest))
-        await asyncio.gather(*tasks, return_exceptions=True)
+def _evict(dest_dir: Path, ctx: _DownloadContext, keep, max_stored=None):
+    """
+    Trim the store to max_stored backgrounds, removing the least recently
+    fetched first (a file's mtime is refreshed whenever a run fetches it).
+    Backgrounds of the current run (keep) are never removed. The composer's
+    normalized copies of an evicted background (any target size) go with it.
+    """
+    max_stored = config.COLLECTOR_MAX_STORED if max_stored is None else max_stored
+    stored = _stored_backgrounds(dest_dir)
+    if max_stored <= 0 or len(stored) <= max_stored:
+        return []
+    keep = {Path(p).name for p in keep}
+    stored.sort(key=lambda p: p.stat().st_mtime)
+    evicted = []
+    for p in stored[:len(stored) - max_stored]:
+        if p.name in keep:
+            continue
+        # Derivatives are keyed by content hash: hand-added backgrounds are not named by it
+        for derivative in image_composer.BG_CACHE_DIR.glob(f"{file_sha256(p)}_*"):
+            derivative.unlink(missing_ok=True)
+        p.unlink(missing_ok=True)
+        evicted.append(p.name)
+    gone = set(evicted)
+    for url in [u for u, e in ctx.index.items() if e.get("file") in gone]:
+        del ctx.index[url]
+    ctx.phash_index.discard(gone)
+    logger.info(f"Evicted {len(evicted)} least recently fetched backgrounds (collector.max_stored = {max_stored})")
+    return evicted
 
-async def _search_unsplash(keyword, max_images=5):
+async def _search_unsplash(session, keyword, max_images=5):
     """Search for image URLs from Unsplash API for a given keyword."""
     key_value = os.getenv("UNSPLASH_ACCESS_KEY", "")
     if not key_value:
@@ -75,43 +284,24 @@ async def _search_unsplash(keyword, max_images=5):
         "Authorization": f"Client-ID {key_value}"
     }
     api_timeout = aiohttp.ClientTimeout(total=20)
-    async with aiohttp.ClientSession(timeout=api_timeout) as session:
-        async with session.get(url, params=params, headers=headers) as resp:
-            if resp.status != 200:
-                error_text = await resp.text()
-                logger.warning(f"Failed to fetch Unsplash for {keyword}: status {resp.status}, error: {error_text[:200]}")
-                return []
-            json_data = await resp.json()
-            # Use 'raw' for highest quality, fallback to 'full'
-            image_urls = []
-            for photo in json_data.get('results', []):
-                if photo.get('urls'):
-                    # Try to get the highest quality available
-                    img_url = photo['urls'].get('raw') or photo['urls'].get('full') or photo['urls'].get('regular')
-                    if img_url:
-                        image_urls.append(img_url)
-            logger.info(f"Found {len(image_urls)} high-res images for keyword '{keyword}'")
-            return image_urls
-
-async def _search_images():
-    """Search images from Unsplash for all keywords."""
-    all_urls = []
-    semaphore = asyncio.Semaphore(2)
-    async def _bounded_search(keyword):
-        async with semaphore:
-            return await _search_unsplash(keyword)
-    
-    tasks = [_bounded_search(keyword) for keyword in KEYWORDS]
-    results = await asyncio.gather(*tasks, return_exceptions=True)
-    for unsplash_urls in results:
-        if isinstance(unsplash_urls, list):
-            all_urls.extend(unsplash_urls)
-    # Deduplicate URLs
-    all_urls = list(set(all_urls))
-    logger.info(f"Total unique high-res image URLs collected: {len(all_urls)}")
-    return all_urls
-
-async def _scrape_pinterest_images(board_url, max_images=15):
+    async with session.get(url, params=params, headers=headers, timeout=api_timeout) as resp:
+        if resp.status != 200:
+            error_text = await resp.text()
+            logger.warning(f"Failed to fetch Unsplash for {keyword}: status {resp.status}, error: {error_text[:200]}")
+            return []
+        json_data = await resp.json()
+        # Use 'raw' for highest quality, fallback to 'full'
+        image_urls = []
+        for photo in json_data.get('results', []):
+            if photo.get('urls'):
+                # Try to get the highest quality available
+                img_url = photo['urls'].get('raw') or photo['urls'].get('full') or photo['urls'].get('regular')
+                if img_url:
+                    image_urls.append(img_url)
+        logger.info(f"Found {len(image_urls)} high-res images for keyword '{keyword}'")
+        return image_urls
+
+async def _scrape_pinterest_images(session, board_url, max_images=15):
     """Scrape high-resolution image URLs from a Pinterest board."""
     headers = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
@@ -120,12 +310,11 @@ async def _scrape_pinterest_images(board_url, max_images=15):
     }
 
     timeout = aiohttp.ClientTimeout(total=30)
-    async with aiohttp.ClientSession(timeout=timeout, headers=headers) as session:
-        async with session.get(board_url) as resp:
-            if resp.status != 200:
-                logger.warning(f"Failed to fetch Pinterest board ({resp.status}): {board_url}")
-                return []
-            html = await resp.text()
+    async with session.get(board_url, headers=headers, timeout=timeout) as resp:
+        if resp.status != 200:
+            logger.warning(f"Failed to fetch Pinterest board ({resp.status}): {board_url}")
+            return []
+        html = await resp.text()
 
     soup = BeautifulSoup(html, "html.parser")
     image_urls = []
@@ -161,43 +350,154 @@ async def _scrape_pinterest_images(board_url, max_images=15):
     logger.info(f"Found {len(image_urls)} Pinterest images from {board_url}")
     return image_urls[:max_images]
 
-async def _collect_from_all_boards():
-    """Run scraping for multiple Pinterest boards concurrently."""
-    tasks = [_scrape_pinterest_images(url) for url in PINTEREST_URLS]
-    results = await asyncio.gather(*tasks, return_exceptions=True)
-    all_urls = []
-    for res in results:
-        if isinstance(res, list):
-            all_urls.extend(res)
-    all_urls = list(set(all_urls))
-
-    random.shuffle(all_urls)
-    all_urls = all_urls[:20]
-    logger.info(f"Collected {len(all_urls)} random Pinterest images.")
-    return all_urls
-
-def run_collect():
-    """Main entry point for Pinterest-based image collection."""
-    logger.info("Starting high-resolution background image collection...")
+class _UrlFeed:
+    """De-duplicating queue between URL producers (searches, boards) and download workers"""
 
-    # Get images from both sources
-    #unsplash_urls = asyncio.run(_search_images())
-    pinterest_urls = asyncio.run(_collect_from_all_boards())
+    def __init__(self):
+        self.queue = asyncio.Queue()
+        self.seen = set()
+
+    def put(self, urls, limit=None):
+        """Enqueue unseen URLs (at most limit of them); returns how many were added"""
+        added = 0
+        for u in urls:
+            u = u.strip()
+            if not u or u in self.seen:
+                continue
+            if limit is not None and added >= limit:
+                break
+            self.seen.add(u)
+            self.queue.put_nowait(u)
+            added += 1
+        return added
+
+async def _produce_unsplash(session, feed: _UrlFeed):
+    semaphore = asyncio.Semaphore(2)
+    async def _bounded_search(keyword):
+        async with semaphore:
+            try:
+                feed.put(await _search_unsplash(session, keyword))
+            except Exception as e:
+                logger.warning(f"Unsplash search failed for {keyword}: {e}")
     
-    # Combine both sources
-    #urls = unsplash_urls + pinterest_urls
-    urls = pinterest_urls
+    await asyncio.gather(*(_bounded_search(keyword) for keyword in KEYWORDS))
+
+async def _produce_pinterest(session, feed: _UrlFeed, max_images=None):
+    """Scrape all boards concurrently; each board's URLs are enqueued as soon as it is parsed"""
+    max_images = config.COLLECTOR_MAX_PINTEREST_IMAGES if max_images is None else max_images
+    remaining = [max_images]
+    async def _board(url):
+        try:
+            urls = await _scrape_pinterest_images(session, url)
+        except Exception as e:
+            logger.warning(f"Pinterest scrape failed for {url}: {e}")
+            return
+        remaining[0] -= feed.put(urls, limit=max(0, remaining[0]))
     
-    if not urls and IMAGES_LIST_FILE.exists():
-        with open(IMAGES_LIST_FILE, "r", encoding="utf-8") as fh:
-            urls = [l.strip() for l in fh if l.strip()]
+    await asyncio.gather(*(_board(url) for url in PINTEREST_URLS))
+    logger.info(f"Collected {max_images - remaining[0]} random Pinterest images.")
 
-    if not urls:
-        logger.warning("No image URLs found — skipping download.")
-        return
+async def _until_set(event):
+    while not event.is_set():
+        await asyncio.sleep(0.2)
 
-    asyncio.run(_run_download(urls, DEFAULT_DIR))
-    logger.info(f"Download complete. Check {DEFAULT_DIR} for {len(urls)} high-res images.")
+async def _collect(dest_dir: Path, sources=None, urls=None, on_background=None, stop=None):
+    """
+    Run the whole collection phase on one event loop and one pooled session.
+    Search/board producers feed a queue that download workers drain, so the
+    first downloads start as soon as the first results arrive. Explicit urls
+    (or images.txt, when the sources yield nothing) are downloaded as well.
+    on_background(path) is called for each newly stored background as soon as
+    it lands; setting the stop event (a threading.Event) cancels collection.
+    Afterwards the store is trimmed to collector.max_stored (see _evict).
+    Returns this run's background paths, in the order they landed.
+    """
+    sources = config.COLLECTOR_SOURCES if sources is None else sources
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    _reset_stats()
+    ctx = _DownloadContext(dest_dir)
+    if not ctx.phash_index.path.exists():
+        await asyncio.to_thread(ctx.phash_index.bootstrap, _stored_backgrounds(dest_dir))
+    
+    feed = _UrlFeed()
+    feed.put(urls or [])
+    paths = []
+    connector = aiohttp.TCPConnector(
+        limit=config.COLLECTOR_MAX_CONNECTIONS,
+        limit_per_host=config.COLLECTOR_MAX_PER_HOST,
+        ttl_dns_cache=300,
+    )
+    timeout = aiohttp.ClientTimeout(total=60)
+
+    async def _run():
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            async def _worker():
+                while True:
+                    url = await feed.queue.get()
+                    try:
+                        if url is None:
+                            return
+                        path = await _fetch(session, url, ctx)
+                        if path and path not in paths:
+                            # Mark as fetched now: orders the store by recency and drives eviction
+                            os.utime(path)
+                            paths.append(path)
+                            if on_background:
+                                on_background(path)
+                    except Exception as e:
+                        logger.warning(f"Giving up on {url}: {e}")
+                    finally:
+                        feed.queue.task_done()
+
+            workers = [asyncio.create_task(_worker()) for _ in range(config.COLLECTOR_DOWNLOAD_WORKERS)]
+            try:
+                producers = []
+                if "pinterest" in sources:
+                    producers.append(_produce_pinterest(session, feed))
+                if "unsplash" in sources:
+                    producers.append(_produce_unsplash(session, feed))
+                await asyncio.gather(*producers)
+                
+                if not feed.seen and IMAGES_LIST_FILE.exists():
+                    with open(IMAGES_LIST_FILE, "r", encoding="utf-8") as fh:
+                        feed.put(fh)
+                if not feed.seen:
+                    logger.warning("No image URLs found — skipping download.")
+                logger.info(f"Total unique image URLs collected: {len(feed.seen)}")
+                
+                for _ in workers:
+                    feed.queue.put_nowait(None)
+                await asyncio.gather(*workers)
+            finally:
+                for w in workers:
+                    w.cancel()
+    
+    if stop is None:
+        await _run()
+    else:
+        run_task = asyncio.create_task(_run())
+        stop_task = asyncio.create_task(_until_set(stop))
+        await asyncio.wait({run_task, stop_task}, return_when=asyncio.FIRST_COMPLETED)
+        stop_task.cancel()
+        if not run_task.done():
+            logger.info("Background collection cancelled")
+            run_task.cancel()
+        try:
+            await run_task
+        except asyncio.CancelledError:
+            pass
+    
+    _evict(dest_dir, ctx, keep=paths)
+    save_json_atomic(INDEX_FILE, ctx.index)
+    logger.info(f"Download stats: {DOWNLOAD_STATS}")
+    return paths
+
+def run_collect(on_background=None, stop=None):
+    """Main entry point for background image collection (see _collect for on_background/stop)."""
+    logger.info("Starting high-resolution background image collection...")
+    paths = asyncio.run(_collect(DEFAULT_DIR, on_background=on_background, stop=stop))
+    logger.info(f"Download complete. {len(paths)} unique high-res images in {DEFAULT_DIR}.")
+    return paths
 
 if __name__ == "__main__":
-    run_collect()
\ No newline at end of file
+    run_collect()
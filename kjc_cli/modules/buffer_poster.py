@@ -1,57 +1,149 @@
+import asyncio
+import json
 import requests
-from kjc_cli import config
+import time
+import uuid
+from kjc_cli import config, http_client, instrumentation, outbox
 from kjc_cli.logger import get_logger
-from tenacity import retry, wait_exponential, stop_after_attempt
+from kjc_cli.ratelimit import AdaptiveTokenBucket, parse_retry_after
+from kjc_cli.utils import file_sha256, guess_image_mime, save_json_atomic
+from tenacity import RetryError, retry, wait_exponential, stop_after_attempt
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
 import os
-import time
 
 logger = get_logger("buffer_poster")
 TOKEN = config.BUFFER_ACCESS_TOKEN
 BUFFER_CREATE_URL = "https://api.buffer.com/1/updates/create.json"
 BUFFER_UPLOAD_URL = "https://api.buffer.com/1/media/upload.json"
 
+MEDIA_CACHE_FILE = config.CACHE_DIR / "buffer_media.json"
+
 # Add your Threads profile ID here
 THREADS_PROFILE_ID = "YOUR_THREADS_PROFILE_ID"  # Replace with your actual profile ID
 
+class _MediaCache:
+    """
+    Persistent image content hash -> Buffer media ID map, so identical image
+    bytes (reused composed images, retries) are uploaded once per TTL.
+    """
+
+    def __init__(self, path=MEDIA_CACHE_FILE, ttl=config.BUFFER_MEDIA_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        try:
+            with open(path, "r", encoding="utf-8") as fh:
+                self.entries = json.load(fh)
+        except FileNotFoundError:
+            self.entries = {}
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable media cache {path}: {e}")
+            self.entries = {}
+
+    def get(self, image_path):
+        if self.ttl <= 0:
+            return None
+        entry = self.entries.get(file_sha256(image_path))
+        if entry and time.time() - entry["uploaded_at"] < self.ttl:
+            return entry["media_id"]
+        return None
+
+    def put(self, image_path, media_id):
+        if self.ttl <= 0 or not media_id:
+            return
+        self.entries[file_sha256(image_path)] = {"media_id": media_id, "uploaded_at": time.time()}
+        self._save()
+
+    def invalidate(self, image_path):
+        if self.entries.pop(file_sha256(image_path), None):
+            self._save()
+
+    def _save(self):
+        now = time.time()
+        self.entries = {k: v for k, v in self.entries.items() if now - v["uploaded_at"] < self.ttl}
+        save_json_atomic(self.path, self.entries)
+
+_media_cache = None
+
+def _get_media_cache():
+    global _media_cache
+    if _media_cache is None:
+        _media_cache = _MediaCache()
+    return _media_cache
+
+class _MultipartFile:
+    """
+    Single-file multipart/form-data body streamed from disk. requests sends
+    an iterable body chunk by chunk, and __len__ lets it set Content-Length.
+    """
+
+    def __init__(self, field, path, mime, chunk_size=64 * 1024):
+        self.path = path
+        self.chunk_size = chunk_size
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        filename = os.path.basename(path).replace('"', "%22")
+        self._head = (
+            f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: {mime}\r\n\r\n'
+        ).encode("utf-8")
+        self._tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+        self._size = os.path.getsize(path)
+
+    def __len__(self):
+        return len(self._head) + self._size + len(self._tail)
+
+    def __iter__(self):
+        yield self._head
+        with open(self.path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(self.chunk_size), b""):
+                yield chunk
+        yield self._tail
+
+def _upload_media(image_path):
+    """Single upload attempt; returns the Buffer media ID"""
+    try:
+        body = _MultipartFile("media", image_path, guess_image_mime(image_path))
+        headers = {"Authorization": f"Bearer {TOKEN}", "Content-Type": body.content_type}
+        response = http_client.post(BUFFER_UPLOAD_URL, headers=headers, data=body, timeout=30)
+        
+        response.raise_for_status()
+        media_data = response.json()
+        # Uploaded bytes count towards the posting function that needed them (sync or async path)
+        instrumentation.add("post_to_buffer_with_reply", bytes_out=instrumentation.file_size(image_path))
+        logger.info(f"Successfully uploaded media: {media_data.get('id')}")
+        return media_data['id']
+    
+    except Exception as e:
+        logger.error(f"Failed to upload media {image_path}: {str(e)}")
+        raise
+
 @retry(wait=wait_exponential(multiplier=1, min=2, max=10), stop=stop_after_attempt(3))
 def upload_media_to_buffer(image_path):
     """Upload media to Buffer and return media ID"""
     if not TOKEN:
         logger.warning("BUFFER_ACCESS_TOKEN not set — skipping media upload.")
         return None
-        
-    headers = {"Authorization": f"Bearer {TOKEN}"}
     
     # Check if file exists
     if not os.path.exists(image_path):
         logger.error(f"Image file not found: {image_path}")
         return None
     
-    try:
-        with open(image_path, 'rb') as image_file:
-            files = {'media': (os.path.basename(image_path), image_file)}
-            response = requests.post(BUFFER_UPLOAD_URL, headers=headers, files=files, timeout=30)
-        
-        response.raise_for_status()
-        media_data = response.json()
-        logger.info(f"Successfully uploaded media: {media_data.get('id')}")
-        return media_data['id']
-    
-    except Exception as e:
-        logger.error(f"Failed to upload media {image_path}: {str(e)}")
-        raise
+    cache = _get_media_cache()
+    media_id = cache.get(image_path)
+    if media_id:
+        logger.info(f"Reusing uploaded media {media_id} for {image_path}")
+        return media_id
+    media_id = _upload_media(image_path)
+    cache.put(image_path, media_id)
+    return media_id
 
 def create_product_reply_text(product):
     """Create formatted text for product reply"""
     return f"🛍️ {product['title']}\n💵 {product['price']}\n🔗 {product['link']}"
 
-@retry(wait=wait_exponential(multiplier=1, min=2, max=10), stop=stop_after_attempt(3))
-def create_buffer_post(text, media_id=None, reply_to_id=None):
-    """Generic function to create a Buffer post (main post or reply)"""
-    if not TOKEN:
-        logger.warning("BUFFER_ACCESS_TOKEN not set — skipping actual posting.")
-        return {"status": "skipped", "reason": "no-token"}
-    
+def _build_post_payload(text, media_id=None, reply_to_id=None):
     payload = {
         "text": text,
         "profile_ids": [THREADS_PROFILE_ID],
@@ -65,11 +157,14 @@ def create_buffer_post(text, media_id=None, reply_to_id=None):
     if reply_to_id:
         # Note: Buffer uses 'top_update_id' for Threads replies
         payload["top_update_id"] = reply_to_id
-    
+    return payload
+
+def _send_post(payload):
+    """Single create attempt; returns the API response JSON"""
     headers = {"Authorization": f"Bearer {TOKEN}"}
     
     try:
-        resp = requests.post(BUFFER_CREATE_URL, headers=headers, json=payload, timeout=20)
+        resp = http_client.post(BUFFER_CREATE_URL, headers=headers, json=payload, timeout=20)
         resp.raise_for_status()
         result = resp.json()
         return result
@@ -77,6 +172,35 @@ def create_buffer_post(text, media_id=None, reply_to_id=None):
         logger.error(f"Failed to create Buffer post: {str(e)}")
         raise
 
+@retry(wait=wait_exponential(multiplier=1, min=2, max=10), stop=stop_after_attempt(3))
+def create_buffer_post(text, media_id=None, reply_to_id=None):
+    """Generic function to create a Buffer post (main post or reply)"""
+    if not TOKEN:
+        logger.warning("BUFFER_ACCESS_TOKEN not set — skipping actual posting.")
+        return {"status": "skipped", "reason": "no-token"}
+    
+    return _send_post(_build_post_payload(text, media_id, reply_to_id))
+
+def _http_status(exc):
+    """HTTP status behind a (possibly tenacity-wrapped) requests error, else None"""
+    if isinstance(exc, RetryError):
+        exc = exc.last_attempt.exception()
+    response = getattr(exc, "response", None) if isinstance(exc, requests.HTTPError) else None
+    return response.status_code if response is not None else None
+
+def _never_sent(exc):
+    """True for a requests error raised before the request reached the server (connect failures)"""
+    if isinstance(exc, requests.ConnectTimeout):
+        return True
+    if isinstance(exc, requests.Timeout) or not isinstance(exc, requests.ConnectionError) or not exc.args:
+        return False
+    # Connection refused / DNS failure: MaxRetryError(reason=NewConnectionError); a dropped connection is a ProtocolError
+    return isinstance(getattr(exc.args[0], "reason", None), (NewConnectionError, ConnectTimeoutError))
+
+def _main_post_id(main_post_result):
+    return main_post_result.get('updates', [main_post_result])[0].get('id')
+
+@instrumentation.timed("post_to_buffer_with_reply", measure=lambda result, args, kwargs: {"items": int(result.get("status") != "skipped")})
 @retry(wait=wait_exponential(multiplier=1, min=2, max=10), stop=stop_after_attempt(3))
 def post_to_buffer_with_reply(post):
     """
@@ -88,25 +212,35 @@ def post_to_buffer_with_reply(post):
         logger.info(f"Would reply with product: {post['product']}")
         return {"status": "skipped", "reason": "no-token", "payload": post}
     
-    # Step 1: Upload image for main post
+    # Step 1: Upload image for main post (or reuse the cached media ID for the same bytes)
     media_id = None
+    cached = False
     if post.get("image_path"):
         logger.info(f"Uploading image: {post['image_path']}")
+        cached = os.path.exists(post["image_path"]) and _get_media_cache().get(post["image_path"]) is not None
         media_id = upload_media_to_buffer(post["image_path"])
     
     # Step 2: Create main post
     logger.info("Creating main post")
-    main_post_result = create_buffer_post(post["text"], media_id)
+    try:
+        main_post_result = create_buffer_post(post["text"], media_id)
+    except Exception as e:
+        status = _http_status(e)
+        # Timeouts and 5xx say nothing about the media ID; re-uploading then would only duplicate the upload
+        if not cached or status is None or not 400 <= status < 500:
+            raise
+        # Rejected with a cached media ID (e.g. expired on Buffer's side): upload again once
+        logger.warning(f"Main post with cached media {media_id} rejected ({status}), re-uploading {post['image_path']}")
+        _get_media_cache().invalidate(post["image_path"])
+        media_id = upload_media_to_buffer(post["image_path"])
+        main_post_result = create_buffer_post(post["text"], media_id)
     
     if "error" in main_post_result:
         raise Exception(f"Main post failed: {main_post_result['error']}")
     
-    main_post_id = main_post_result.get('updates', [main_post_result])[0].get('id')
+    main_post_id = _main_post_id(main_post_result)
     logger.info(f"Main post created with ID: {main_post_id}")
     
-    # Small delay to ensure main post is processed
-    time.sleep(3)
-    
     # Step 3: Create product reply
     logger.info("Creating product reply")
     product_reply_text = create_product_reply_text(post["product"])
@@ -127,27 +261,154 @@ def post_to_buffer_with_reply(post):
         "reply_post": reply_result
     }
 
+class _BufferEngine:
+    """
+    Concurrent posting engine. Requests go through one adaptive token bucket
+    per endpoint (upload, create); 429s and 5xx are retried with Retry-After /
+    exponential backoff. Creates are not idempotent: after a 5xx or a read
+    timeout the post may exist, so they are only retried on 429 and on errors
+    raised before the request was sent. Each post's reply is only sent once
+    its main post has returned an ID, independent posts run concurrently.
+    """
+
+    NON_IDEMPOTENT = {"create"}
+
+    def __init__(self, concurrency=None, rate_limits=None, max_attempts=None):
+        rate_limits = rate_limits or config.BUFFER_RATE_LIMITS
+        self.buckets = {
+            name: AdaptiveTokenBucket(float(lim.get("rate", 1.0)), float(lim.get("burst", 1)))
+            for name, lim in rate_limits.items()
+        }
+        self.max_attempts = max_attempts or config.BUFFER_MAX_ATTEMPTS
+        self.semaphore = asyncio.Semaphore(concurrency or config.BUFFER_CONCURRENCY)
+        self.media_cache = _get_media_cache()
+        # content digest -> in-flight upload task, so concurrent posts of one image upload it once
+        self._uploads = {}
+
+    async def media_id(self, image_path):
+        """Return (media_id, from_cache) for an image, uploading it only if its bytes are new"""
+        media_id = await asyncio.to_thread(self.media_cache.get, image_path)
+        if media_id:
+            logger.info(f"Reusing uploaded media {media_id} for {image_path}")
+            return media_id, True
+        digest = file_sha256(image_path)
+        task = self._uploads.get(digest)
+        if task is None:
+            logger.info(f"Uploading image: {image_path}")
+            task = asyncio.ensure_future(self.call("upload", _upload_media, image_path))
+            self._uploads[digest] = task
+        try:
+            media_id = await task
+        finally:
+            self._uploads.pop(digest, None)
+        self.media_cache.put(image_path, media_id)
+        return media_id, False
+
+    async def call(self, endpoint, fn, *args):
+        """Run a blocking request function under the endpoint's rate limit, retrying throttling/transient errors"""
+        bucket = self.buckets[endpoint]
+        idempotent = endpoint not in self.NON_IDEMPOTENT
+        for attempt in range(1, self.max_attempts + 1):
+            await bucket.acquire()
+            try:
+                result = await asyncio.to_thread(fn, *args)
+                bucket.succeeded()
+                return result
+            except requests.HTTPError as e:
+                status = e.response.status_code if e.response is not None else None
+                if attempt == self.max_attempts or not (status == 429 or (idempotent and status and status >= 500)):
+                    raise
+                delay = parse_retry_after(e.response.headers.get("Retry-After"), default=min(60, 2 ** attempt))
+                if status == 429:
+                    bucket.throttled(delay)
+                    logger.warning(f"Buffer {endpoint} throttled (429), rate now {bucket.rate:.2f}/s, retrying in {delay:.1f}s")
+                else:
+                    logger.warning(f"Buffer {endpoint} returned {status}, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_attempts or not (idempotent or _never_sent(e)):
+                    raise
+                delay = min(60, 2 ** attempt)
+                logger.warning(f"Buffer {endpoint} request failed ({e}), retrying in {delay}s")
+                await asyncio.sleep(delay)
+
+    # Same name as the sync path: one entry in the run report however posts are sent
+    @instrumentation.timed("post_to_buffer_with_reply")
+    async def post_with_reply(self, post):
+        """Async counterpart of post_to_buffer_with_reply"""
+        async with self.semaphore:
+            media_id = None
+            cached = False
+            image_path = post.get("image_path")
+            if image_path:
+                if os.path.exists(image_path):
+                    media_id, cached = await self.media_id(image_path)
+                else:
+                    logger.error(f"Image file not found: {image_path}")
+            
+            try:
+                main_post_result = await self.call("create", _send_post, _build_post_payload(post["text"], media_id))
+            except requests.HTTPError as e:
+                status = e.response.status_code if e.response is not None else None
+                if not cached or status is None or not 400 <= status < 500:
+                    raise
+                # Rejected with a cached media ID (e.g. expired on Buffer's side): upload again once
+                logger.warning(f"Main post with cached media {media_id} rejected ({status}), re-uploading {image_path}")
+                self.media_cache.invalidate(image_path)
+                media_id, _ = await self.media_id(image_path)
+                main_post_result = await self.call("create", _send_post, _build_post_payload(post["text"], media_id))
+            if "error" in main_post_result:
+                raise Exception(f"Main post failed: {main_post_result['error']}")
+            main_post_id = _main_post_id(main_post_result)
+            logger.info(f"Main post created with ID: {main_post_id}")
+            
+            # The reply depends on the main post's ID, so it is only sent after it
+            product_reply_text = create_product_reply_text(post["product"])
+            try:
+                reply_result = await self.call("create", _send_post, _build_post_payload(product_reply_text, reply_to_id=main_post_id))
+            except Exception as e:
+                reply_result = {"error": str(e)}
+            if "error" in reply_result:
+                logger.error(f"Reply post failed: {reply_result['error']}")
+                # Still return the main post result even if reply fails
+                return {"main_post": main_post_result, "reply_post": {"error": reply_result["error"]}}
+            
+            logger.info(f"Product reply created with ID: {reply_result.get('id')}")
+            return {"main_post": main_post_result, "reply_post": reply_result}
+
+    async def post_many(self, posts):
+        total = len(posts)
+        async def _one(i, p):
+            try:
+                logger.info(f"Posting {i}/{total}: {p['text'][:100]}...")
+                result = await self.post_with_reply(p)
+                logger.info(f"Posted {i}/{total} successfully")
+                return result
+            except Exception as e:
+                logger.exception(f"Posting failed for post {i}", exc_info=e)
+                return {"error": str(e), "post": p}
+        
+        return await asyncio.gather(*(_one(i, p) for i, p in enumerate(posts, 1)))
+
 def run_post_many(posts):
     logger.info(f"Posting {len(posts)} posts with product replies to profile {THREADS_PROFILE_ID}")
-    results = []
     
-    for i, p in enumerate(posts, 1):
-        try:
-            logger.info(f"Posting {i}/{len(posts)}: {p['text'][:100]}...")
-            result = post_to_buffer_with_reply(p)
-            logger.info(f"Posted {i}/{len(posts)} successfully")
-            results.append(result)
-            
-            # Add a small delay between post sets to avoid rate limiting
-            if i < len(posts):
-                time.sleep(5)  # Increased delay for the two-post sequence
-                
-        except Exception as e:
-            logger.exception(f"Posting failed for post {i}", exc_info=e)
-            results.append({"error": str(e), "post": p})
+    if not TOKEN:
+        results = [post_to_buffer_with_reply(p) for p in posts]
+    else:
+        results = asyncio.run(_BufferEngine().post_many(posts))
     
     # Summary
     success_count = sum(1 for r in results if "error" not in r)
     logger.info(f"Completed: {success_count}/{len(posts)} posts successful")
+    http_client.log_latency_stats()
     
-    return results
\ No newline at end of file
+    return results
+
+def drain_outbox():
+    """Post everything queued for Buffer in the outbox, resuming after the last acknowledged item"""
+    if not TOKEN:
+        # Nothing could be delivered: leave the queue untouched until a token is configured
+        logger.warning("BUFFER_ACCESS_TOKEN not set — leaving the Buffer outbox queued.")
+        return []
+    return outbox.drain("buffer", run_post_many)
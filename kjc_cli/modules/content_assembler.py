@@ -1,33 +1,84 @@
 import json
 from pathlib import Path
-from kjc_cli import config
+from kjc_cli import config, outbox, runs
 from kjc_cli.logger import get_logger
-from kjc_cli.utils import save_json
+from kjc_cli.modules.product_catalog import ProductCatalog
+from kjc_cli.utils import JsonlWriter, save_json_atomic
 import random
 
 logger = get_logger("content_assembler")
 OUT_FILE = config.DATA_DIR / "posts_payload.json"
+PAYLOAD_JSONL = config.DATA_DIR / "posts_payload.jsonl"
 
-def run_assemble(hooks, images, products):
+def iter_assemble(hooks, images, products, enqueue_batch=None, run_id=None):
     """
-    Combine hooks + composed images + products into posting payloads.
-    - rotates products if fewer than hooks
-    - returns list of dicts suitable for posting
+    Lazily combine hooks + composed images + products into posting payloads.
+    - hooks may be any iterable (e.g. a generator from an upstream stage)
+    - image i is paired with hook i (cycling when there are fewer images)
+    - see iter_assemble_pairs for products, the JSONL payload and the outbox
     """
-    logger.info("Assembling content for posts")
-    posts = []
     if not images:
         logger.warning("No composed images available")
-    for idx, hook in enumerate(hooks):
-        product = products[idx % len(products)] if products else {}
-        image = images[idx % len(images)] if images else ""
-        text = f"{hook}\n\nPrice: {product.get('price','')}\nShop: {product.get('link','')}"
-        post = {
-            "text": text,
-            "image_path": image,
-            "product": product
-        }
-        posts.append(post)
-    save_json(OUT_FILE, posts)
-    logger.info(f"Saved {len(posts)} posts payload to {OUT_FILE}")
+    pairs = ((hook, images[idx % len(images)] if images else "") for idx, hook in enumerate(hooks))
+    yield from iter_assemble_pairs(pairs, products, enqueue_batch, run_id)
+
+def iter_assemble_pairs(pairs, products, enqueue_batch=None, run_id=None):
+    """
+    Lazily build posts from (hook, image path) pairs.
+    - products is a list of product dicts or a ProductCatalog
+    - picks the best product per hook (category and price band named in the hook), rotating among matches
+    - each post is appended to PAYLOAD_JSONL as soon as it is built, so readers
+      (utils.follow_jsonl) can start before assembly finishes
+    - posts are enqueued into the durable outbox for each configured channel
+      every enqueue_batch posts (default OUTBOX_BATCH_SIZE); a post has been
+      enqueued by the time the post completing its batch is yielded
+    - outbox keys are scoped to run_id (a new ID per call when not given): a
+      resumed run does not enqueue a post twice, a later run with the same
+      post enqueues it again
+    """
+    logger.info("Assembling content for posts")
+    enqueue_batch = enqueue_batch or config.OUTBOX_BATCH_SIZE
+    run_id = run_id or runs.new_run_id()
+    catalog = products if isinstance(products, ProductCatalog) else ProductCatalog.from_records(products or [])
+    pending = []
+    count = 0
+    with JsonlWriter(
+        PAYLOAD_JSONL,
+        fsync=config.ASSEMBLER_FSYNC,
+        fsync_every=config.ASSEMBLER_FSYNC_EVERY,
+        keep_rotated=config.ASSEMBLER_KEEP_ROTATED,
+    ) as writer:
+        for hook, image in pairs:
+            product = catalog.pick(hook)
+            text = f"{hook}\n\nPrice: {product.get('price','')}\nShop: {product.get('link','')}"
+            post = {
+                "text": text,
+                "image_path": image,
+                "product": product
+            }
+            writer.write(post)
+            pending.append(post)
+            count += 1
+            if len(pending) >= enqueue_batch:
+                _enqueue(pending, run_id)
+                pending = []
+            yield post
+        if pending:
+            _enqueue(pending, run_id)
+    logger.info(f"Streamed {count} posts payload to {PAYLOAD_JSONL}")
+
+def _enqueue(posts, run_id):
+    for channel in config.OUTBOX_CHANNELS:
+        outbox.enqueue(channel, posts, scope=run_id)
+
+def run_assemble(hooks, images, products, run_id=None):
+    """
+    Combine hooks + composed images + products into posting payloads (see iter_assemble).
+    - returns list of dicts suitable for posting
+    - with assembler.payload_format "json", also writes the whole batch to OUT_FILE (atomically)
+    """
+    posts = list(iter_assemble(hooks, images, products, run_id=run_id))
+    if config.ASSEMBLER_PAYLOAD_FORMAT == "json":
+        save_json_atomic(OUT_FILE, posts)
+        logger.info(f"Saved {len(posts)} posts payload to {OUT_FILE}")
     return posts
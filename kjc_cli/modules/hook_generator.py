@@ -1,9 +1,13 @@
+import asyncio
+import hashlib
 import os
 import json
-import requests
+import re
+import time
 from datetime import datetime
-from kjc_cli import config
+from kjc_cli import config, hook_store, http_client, instrumentation
 from kjc_cli.logger import get_logger
+from kjc_cli.modules import hook_novelty
 from kjc_cli.utils import save_json
 
 
@@ -15,137 +19,307 @@ try:
 except Exception:
     genai = None
 
-OUT_JSON = config.HOOKS_DIR / f"hooks_{datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}.json"
+LLM_CACHE_DIR = config.CACHE_DIR / "llm"
 
-def _simple_generate(n=10):
+def _out_json():
+    # Per call, so a long-running scheduler writes one file per run
+    return config.HOOKS_DIR / f"hooks_{datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}.json"
+
+HOOK_TEMPLATES = [
+    "2025秋、周りと絶対被らない「モテスウェット」8選",
+    "1万円未満で買えちゃう「最強デート服」5選",
+    "迷ってそれ着とけば絶対勝てる「大人フーディー」6選",
+    "あ、センスあるなと2秒でバレる「最強アウター」7選",
+    "女子ウケ確定。「本当に着てほしいニット」はこれ8選",
+    "周りと被らない「最強コスパアウター」10選",
+    "迷ったらコレで勝てる「シンプルジャケット」5選",
+    "1万円以下で「センスある」って思われるスニーカー6選",
+    "2025秋、絶対外さない「黒パーカー」最強リスト7",
+    "女性が選ぶ「本当に着てほしいスウェット」5選",
+    "これ着とけばOK。「無敵の白ロンT」6選",
+    "2025秋、ガチで女性ウケする「カーディガン」5選",
+    "2秒で“オシャレ”とバレる「最強セットアップ」7選",
+    "1万円未満で無双する「高見えアウター」5選",
+    "2025秋、女子が二度見する「モテシャツ」8選",
+    "迷ったらコレ。女子ウケ確実な「スウェットパンツ」6選",
+    "周りと差がつく「最強フーディー」はこの5選",
+    "2025秋、絶対勝てる「デートコーデ」7パターン",
+    "周りと被らない「最強の黒」アイテム8選",
+    "2025秋、最強の「モテスニーカー」6選",
+    "1万円以下で揃う「大人の勝負服」5選",
+    "あ、清潔感ある。と思われる「白シャツ」最強リスト",
+    "周りと被らない「センス最強バッグ」7選",
+    "2025秋、女子が好きな「ゆるニット」8選",
+    "迷ったらコレ。失敗しない「黒パンツ」5選",
+    "ぶっちゃけ、女子は「ロゴ」より「無地」が好き。最強5選",
+    "2秒で勝てる「最強の香り（香水）」6選",
+    "2025秋、本気でモテる「大人ジャケット」5選",
+    "コスパ最強。「高見え」確定のアイテム7選",
+    "これが正解。女子ウケ「最強レイヤード」8選",
+    "そのパーカー、女子ウケ確定。",
+    "結局、女の子は'普通'の白Tが一番好き。",
+    "迷ったら、黒の「ちょいゆるスウェット」着とけばOK。",
+    "女子は「意外と」シンプルな時計を見てる。",
+    "その「とりあえず感」が、逆に最強。",
+    "2025秋、そのアウターが正解。",
+    "ぶっちゃけ、女子は「細すぎるパンツ」より、ちょいゆる派。",
+    "「センスあるな」って思われたいなら、コレ。",
+    "そのスニーカー、本気でモテるやつ。",
+    "結局、モテる奴は「白」の使い方がうまい。",
+    "「なんか雰囲気ある」って思われる人の共通点。",
+    "その服、「頼りになりそう」って思われるよ。",
+    "ぶっちゃけ、女子は「カバン」で男を判断する。",
+    "女子が「守ってあげたい」と思う服装、知ってる？",
+    "2025秋、これ着てたら「ガチ勢」確定。",
+    "ぶっちゃけ、モテるのに金は要らない。",
+    "その「清潔感」、最強の武器になる。",
+    "女子は「ギャップ」に弱い。最強フーディーがこれ。",
+    "2025秋、これさえあれば無双できる。",
+    "そのシンプルさ、2秒で「センスある」ってバレる。"
+]
+
+def _simple_generate(n=10, offset=0):
     hooks = []
-    templates = [
-        "2025秋、周りと絶対被らない「モテスウェット」8選",
-        "1万円未満で買えちゃう「最強デート服」5選",
-        "迷ってそれ着とけば絶対勝てる「大人フーディー」6選",
-        "あ、センスあるなと2秒でバレる「最強アウター」7選",
-        "女子ウケ確定。「本当に着てほしいニット」はこれ8選",
-        "周りと被らない「最強コスパアウター」10選",
-        "迷ったらコレで勝てる「シンプルジャケット」5選",
-        "1万円以下で「センスある」って思われるスニーカー6選",
-        "2025秋、絶対外さない「黒パーカー」最強リスト7",
-        "女性が選ぶ「本当に着てほしいスウェット」5選",
-        "これ着とけばOK。「無敵の白ロンT」6選",
-        "2025秋、ガチで女性ウケする「カーディガン」5選",
-        "2秒で“オシャレ”とバレる「最強セットアップ」7選",
-        "1万円未満で無双する「高見えアウター」5選",
-        "2025秋、女子が二度見する「モテシャツ」8選",
-        "迷ったらコレ。女子ウケ確実な「スウェットパンツ」6選",
-        "周りと差がつく「最強フーディー」はこの5選",
-        "2025秋、絶対勝てる「デートコーデ」7パターン",
-        "周りと被らない「最強の黒」アイテム8選",
-        "2025秋、最強の「モテスニーカー」6選",
-        "1万円以下で揃う「大人の勝負服」5選",
-        "あ、清潔感ある。と思われる「白シャツ」最強リスト",
-        "周りと被らない「センス最強バッグ」7選",
-        "2025秋、女子が好きな「ゆるニット」8選",
-        "迷ったらコレ。失敗しない「黒パンツ」5選",
-        "ぶっちゃけ、女子は「ロゴ」より「無地」が好き。最強5選",
-        "2秒で勝てる「最強の香り（香水）」6選",
-        "2025秋、本気でモテる「大人ジャケット」5選",
-        "コスパ最強。「高見え」確定のアイテム7選",
-        "これが正解。女子ウケ「最強レイヤード」8選",
-        "そのパーカー、女子ウケ確定。",
-        "結局、女の子は'普通'の白Tが一番好き。",
-        "迷ったら、黒の「ちょいゆるスウェット」着とけばOK。",
-        "女子は「意外と」シンプルな時計を見てる。",
-        "その「とりあえず感」が、逆に最強。",
-        "2025秋、そのアウターが正解。",
-        "ぶっちゃけ、女子は「細すぎるパンツ」より、ちょいゆる派。",
-        "「センスあるな」って思われたいなら、コレ。",
-        "そのスニーカー、本気でモテるやつ。",
-        "結局、モテる奴は「白」の使い方がうまい。",
-        "「なんか雰囲気ある」って思われる人の共通点。",
-        "その服、「頼りになりそう」って思われるよ。",
-        "ぶっちゃけ、女子は「カバン」で男を判断する。",
-        "女子が「守ってあげたい」と思う服装、知ってる？",
-        "2025秋、これ着てたら「ガチ勢」確定。",
-        "ぶっちゃけ、モテるのに金は要らない。",
-        "その「清潔感」、最強の武器になる。",
-        "女子は「ギャップ」に弱い。最強フーディーがこれ。",
-        "2025秋、これさえあれば無双できる。",
-        "そのシンプルさ、2秒で「センスある」ってバレる。"
-    ]
-    for i in range(n):
+    templates = HOOK_TEMPLATES
+    for i in range(offset, offset + n):
         hooks.append(templates[i % len(templates)].format(topic="stylish threads"))
     return hooks
 
 
-def _gemini_generate(n=10):
-    """Generate hooks using Gemini API directly"""
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={config.GEMINI_API_KEY}"
-    
-    prompt = f"Write {n} short (max 60 characters) marketing hooks that spark curiosity for fashion product posts. Provide ONLY a JSON array of strings, no other text."
+def _least_recent_templates(n, exclude=()):
+    """n templates, preferring ones not in exclude, the ones never stored or stored longest ago first (cycling if n is larger)"""
+    templates = _simple_generate(len(HOOK_TEMPLATES))
+    templates = [t for t in templates if t not in exclude] or templates
+    last = hook_store.last_used(templates)
+    # sorted() is stable: ties keep template order
+    ordered = sorted(templates, key=lambda t: last.get(t, 0.0))
+    return [ordered[i % len(ordered)] for i in range(n)]
+
+def _hook_prompt(n, category=None):
+    topic = f"{category} fashion products" if category else "fashion product posts"
+    return (
+        f"Write {n} short (max 60 characters) marketing hooks that spark curiosity for {topic}. "
+        "Provide ONLY a JSON array of strings, no other text."
+    )
+
+def _parse_hooks(text):
+    """Extract a list of hook strings from an LLM reply (JSON array, or one hook per line)"""
+    # Clean and parse the response
+    text = text.strip().replace('```json', '').replace('```', '').strip()
+    try:
+        arr = json.loads(text)
+        if isinstance(arr, list):
+            return [h for h in arr if isinstance(h, str)]
+    except json.JSONDecodeError:
+        pass
+    # Fallback parsing: one hook per line, without list numbering/bullets and quotes
+    lines = [re.sub(r'^(\d+[.)]|[-*•])\s*', '', line.strip()).strip(',').strip('"').strip("'") for line in text.splitlines() if line.strip()]
+    return [line for line in lines if len(line) > 10 and line not in ("[", "]")]
+
+def _gemini_request(prompt, temperature=None):
+    """Single Gemini generateContent call; returns the reply text"""
+    url = f"{config.GEMINI_API_BASE}/models/{config.HOOKS_GEMINI_MODEL}:generateContent?key={config.GEMINI_API_KEY}"
     
     payload = {
         "contents": [{
             "parts": [{"text": prompt}]
         }]
     }
+    if temperature is not None:
+        payload["generationConfig"] = {"temperature": temperature}
     
     headers = {
         'Content-Type': 'application/json'
     }
     
-    response = requests.post(url, json=payload, headers=headers)
+    response = http_client.post(url, json=payload, headers=headers, timeout=(10, 60))
     
     if response.status_code == 200:
         result = response.json()
-        text = result['candidates'][0]['content']['parts'][0]['text']
-        
-        # Clean and parse the response
-        text = text.strip().replace('```json', '').replace('```', '').strip()
-        try:
-            return json.loads(text)
-        except json.JSONDecodeError:
-            # Fallback parsing
-            lines = [line.strip().strip('"').strip("'") for line in text.splitlines() if line.strip()]
-            return [line for line in lines if len(line) > 10]
+        return result['candidates'][0]['content']['parts'][0]['text']
     else:
         raise Exception(f"Gemini API error: {response.status_code} - {response.text}")
-def run_generate(n=10):
-    logger.info("Generating hooks")
-    hooks = []
+
+def _openai_request(prompt, temperature=None):
+    """Single OpenAI chat completion call; returns the reply text"""
+    url = f"{config.OPENAI_API_BASE}/chat/completions"
+    payload = {
+        "model": config.HOOKS_OPENAI_MODEL,
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": 800,
+        "temperature": 0.8 if temperature is None else temperature,
+    }
+    headers = {"Authorization": f"Bearer {config.OPENAI_API_KEY}"}
     
-    # Try Gemini first
-    if config.GEMINI_API_KEY:
-        try:
-            hooks = _simple_generate(n)
-            #hooks = _gemini_generate(n)
-                
-        except Exception as e:
-            logger.exception("Gemini call failed, falling back to template generator")
-            hooks = _simple_generate(n)
+    response = http_client.post(url, json=payload, headers=headers, timeout=(10, 60))
     
-    # Fallback to OpenAI if Gemini not available
-    elif config.OPENAI_API_KEY and openai:
+    if response.status_code == 200:
+        return response.json()["choices"][0]["message"]["content"]
+    else:
+        raise Exception(f"OpenAI API error: {response.status_code} - {response.text}")
+
+def _gemini_generate(n=10):
+    """Generate hooks using Gemini API directly"""
+    return _parse_hooks(_gemini_request(_hook_prompt(n)))
+
+# provider -> (request function, model, whether an API key is configured)
+def _providers():
+    available = {
+        "gemini": (_gemini_request, config.HOOKS_GEMINI_MODEL, bool(config.GEMINI_API_KEY)),
+        "openai": (_openai_request, config.HOOKS_OPENAI_MODEL, bool(config.OPENAI_API_KEY)),
+    }
+    return [(name, *available[name][:2]) for name in config.HOOKS_PROVIDERS if name in available and available[name][2]]
+
+def _cache_path(model, prompt, n, temperature):
+    key = json.dumps([model, prompt, n, temperature], ensure_ascii=False)
+    return LLM_CACHE_DIR / f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}.json"
+
+def _cache_get(path):
+    try:
+        with open(path, "r", encoding="utf-8") as fh:
+            entry = json.load(fh)
+    except (FileNotFoundError, ValueError):
+        return None
+    if time.time() - entry.get("created_at", 0) > config.HOOKS_CACHE_TTL:
+        return None
+    return entry.get("hooks")
+
+def _valid_hooks(hooks):
+    """Drop non-strings, empties and over-long hooks; de-duplicate (whitespace/case-insensitive) keeping order"""
+    seen = set()
+    out = []
+    for h in hooks:
+        if not isinstance(h, str):
+            continue
+        h = " ".join(h.split())
+        key = h.casefold()
+        if not h or len(h) > config.HOOKS_MAX_CHARS or key in seen:
+            continue
+        seen.add(key)
+        out.append(h)
+    return out
+
+async def _generate_batch(prompt, n, semaphore):
+    """One prompt batch as [(hook, provider, model)]: a cached reply from any provider, else each provider in order; [] if all fail"""
+    temperature = config.HOOKS_TEMPERATURE
+    providers = _providers()
+    for name, _, model in providers:
+        cached = _cache_get(_cache_path(model, prompt, n, temperature))
+        if cached:
+            logger.info(f"Using cached {name} hooks for batch ({len(cached)} hooks)")
+            return [(h, name, model) for h in _valid_hooks(cached)]
+    for name, request, model in providers:
         try:
-            openai.api_key = config.OPENAI_API_KEY
-            prompt = f"Write {n} short (max 60 chars) marketing hooks that spark curiosity for fashion product posts. Provide as JSON array."
-            resp = openai.ChatCompletion.create(
-                model="gpt-4o-mini" if hasattr(openai, "ChatCompletion") else "gpt-4o-mini",
-                messages=[{"role":"user","content":prompt}],
-                max_tokens=400,
-                temperature=0.8
-            )
-            text = resp.choices[0].message.content
+            async with semaphore:
+                text = await asyncio.to_thread(request, prompt, temperature)
+            hooks = _valid_hooks(_parse_hooks(text))
+            if not hooks:
+                raise ValueError("reply contained no usable hooks")
+            save_json(_cache_path(model, prompt, n, temperature), {"created_at": time.time(), "provider": name, "model": model, "hooks": hooks})
+            return [(h, name, model) for h in hooks]
+        except Exception as e:
+            logger.warning(f"{name} hook batch failed, trying next provider: {e}")
+    return []
+
+async def _generate_llm(n, round_=0):
+    """Fetch ceil(n / batch_size) prompt batches concurrently (bounded by max_parallel) and merge them
+
+    round_ > 0 asks for replacements of rejected hooks, with prompts (and cache keys) distinct from earlier rounds.
+    Returns [(hook, provider, model)].
+    """
+    batch_size = max(1, config.HOOKS_BATCH_SIZE)
+    categories = config.HOOKS_CATEGORIES or [None]
+    semaphore = asyncio.Semaphore(config.HOOKS_MAX_PARALLEL)
+    batches = []
+    for i in range(-(-n // batch_size)):
+        size = min(batch_size, n - i * batch_size)
+        prompt = _hook_prompt(size, categories[i % len(categories)])
+        if i >= len(categories) or round_:
+            # Repeated category or retry round: make the prompt (and its cache key) distinct per batch
+            variation = f"{round_}-{i // len(categories) + 1}" if round_ else i // len(categories) + 1
+            prompt += f" Variation #{variation}: avoid the obvious phrasings."
+        batches.append((prompt, size))
+    results = await asyncio.gather(*(_generate_batch(p, size, semaphore) for p, size in batches))
+    merged, seen = [], set()
+    for batch in results:
+        for record in batch:
+            key = record[0].casefold()
+            if key not in seen:
+                seen.add(key)
+                merged.append(record)
+    return merged
+
+def _novel_hooks(n, index):
+    """Collect up to n (hook, source, model) records the novelty index accepts: LLM rounds first, then unused templates"""
+    records = []
+    rejected = 0
+    if _providers():
+        for round_ in range(1 + config.HOOKS_NOVELTY_MAX_ROUNDS):
+            missing = n - len(records)
+            if missing <= 0:
+                break
             try:
-                arr = json.loads(text)
-                if isinstance(arr, list):
-                    hooks = arr
+                candidates = asyncio.run(_generate_llm(missing, round_))
             except Exception:
-                hooks = [l.strip() for l in text.splitlines() if l.strip()]
-        except Exception as e:
-            logger.exception("OpenAI call failed, falling back to template generator")
-            hooks = _simple_generate(n)
-    else:
-        hooks = _simple_generate(n)
+                logger.exception("LLM hook generation failed, falling back to template generator")
+                break
+            for record in candidates:
+                if len(records) >= n:
+                    break
+                if index.accept(record[0]):
+                    records.append(record)
+                else:
+                    rejected += 1
+        logger.info(f"Generated {len(records)}/{n} novel hooks with LLM providers")
+    
+    # Templates: walk the whole pool once, starting after the ones used most recently
+    offset = len(index) % len(HOOK_TEMPLATES)
+    for h in _simple_generate(len(HOOK_TEMPLATES), offset):
+        if len(records) >= n:
+            break
+        if index.accept(h):
+            records.append((h, "template", None))
+        else:
+            rejected += 1
+    
+    index.flush()
+    if rejected:
+        logger.info(f"Rejected {rejected} hooks too similar to earlier ones (threshold {index.threshold})")
+    return records
+
+@instrumentation.timed("run_generate", measure=lambda hooks, args, kwargs: {"items": len(hooks)})
+def run_generate(n=10):
+    logger.info("Generating hooks")
+    records = []
+    hook_store.migrate_json_files()
     
-    save_json(OUT_JSON, hooks)
-    logger.info(f"Saved {len(hooks)} hooks to {OUT_JSON}")
-    return hooks
\ No newline at end of file
+    if config.HOOKS_NOVELTY_ENABLED:
+        records = _novel_hooks(n, hook_novelty.load_index())
+        if len(records) < n:
+            logger.warning(f"Only {len(records)}/{n} novel hooks available, reusing the least recently used templates")
+            reuse = _least_recent_templates(n - len(records), exclude={r[0] for r in records})
+            records += [(h, "template", None) for h in reuse]
+    
+    # LLM providers first (Gemini, then OpenAI as failover per batch)
+    elif _providers():
+        try:
+            records = asyncio.run(_generate_llm(n))[:n]
+            logger.info(f"Generated {len(records)}/{n} hooks with LLM providers")
+        except Exception:
+            logger.exception("LLM hook generation failed, falling back to template generator")
+            records = []
+    
+    # Fill any gap from the template generator
+    if len(records) < n and not config.HOOKS_NOVELTY_ENABLED:
+        existing = {r[0] for r in records}
+        fill = [h for h in _simple_generate(n) if h not in existing]
+        records = records + [(h, "template", None) for h in fill[:n - len(records)]]
+    
+    hooks = [r[0] for r in records]
+    hook_store.append(records)
+    logger.info(f"Stored {len(hooks)} hooks in {config.HOOKS_DB}")
+    if config.HOOKS_WRITE_JSON:
+        out = _out_json()
+        save_json(out, hooks)
+        logger.info(f"Saved {len(hooks)} hooks to {out}")
+    return hooks
@@ -0,0 +1,188 @@
+"""
+Novelty index over every hook ever generated.
+
+Hooks are Japanese marketing lines with no word boundaries, so similarity is
+measured on character n-grams (shingles). Each hook gets a MinHash signature
+whose slot-wise agreement estimates the Jaccard similarity of its shingle set;
+LSH banding buckets the signatures so a lookup only compares against the few
+hooks sharing a band instead of the whole history.
+
+Signatures are persisted append-only (packed uint32s plus a JSONL text file),
+so the index survives across runs without rereading the hook history. It is
+bootstrapped once from the hook store.
+"""
+
+import hashlib
+import json
+import random
+import re
+import unicodedata
+from array import array
+from pathlib import Path
+from kjc_cli import config, hook_store
+from kjc_cli.logger import get_logger
+
+logger = get_logger("hook_novelty")
+
+INDEX_DIR = config.CACHE_DIR / "hook_novelty"
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+
+_PRIME = (1 << 61) - 1
+_MASK32 = (1 << 32) - 1
+# Fixed seed: signatures must stay comparable with the ones already on disk
+_rng = random.Random(20250917)
+_PERMS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+# Whitespace, punctuation and symbols (quotes, brackets, emoji) carry no meaning for similarity
+_STRIP = re.compile(r"[\s\W_]+", re.UNICODE)
+
+def _normalize(text: str) -> str:
+    return _STRIP.sub("", unicodedata.normalize("NFKC", text).casefold())
+
+def shingles(text: str, k: int = config.HOOKS_NOVELTY_NGRAM):
+    text = _normalize(text)
+    if len(text) <= k:
+        return {text} if text else set()
+    return {text[i:i + k] for i in range(len(text) - k + 1)}
+
+def _shingle_hash(s: str) -> int:
+    return int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little")
+
+def signature(text: str):
+    """MinHash signature: per permutation, the minimum (a*x + b) mod p over all shingle hashes, folded to 32 bits"""
+    hashes = [_shingle_hash(s) for s in shingles(text)]
+    if not hashes:
+        return array("I", [_MASK32] * NUM_PERM)
+    return array("I", (min((a * x + b) % _PRIME for x in hashes) & _MASK32 for a, b in _PERMS))
+
+def similarity(sig_a, sig_b) -> float:
+    """Estimated Jaccard similarity: fraction of agreeing signature slots"""
+    return sum(x == y for x, y in zip(sig_a, sig_b)) / NUM_PERM
+
+class NoveltyIndex:
+    """Persistent MinHash/LSH index of hook texts"""
+
+    def __init__(self, directory: Path = INDEX_DIR, threshold: float = config.HOOKS_NOVELTY_THRESHOLD):
+        self.directory = Path(directory)
+        self.sig_path = self.directory / "signatures.bin"
+        self.text_path = self.directory / "hooks.jsonl"
+        self.threshold = threshold
+        self.signatures = array("I")
+        self.texts = []
+        self._buckets = [{} for _ in range(BANDS)]
+        self._pending = []
+        self._load()
+
+    def __len__(self):
+        return len(self.texts)
+
+    def _load(self):
+        if not (self.sig_path.exists() and self.text_path.exists()):
+            return
+        with open(self.text_path, "r", encoding="utf-8") as fh:
+            texts = []
+            for line in fh:
+                try:
+                    texts.append(json.loads(line))
+                except ValueError:
+                    # A torn last line from a crash ends the usable history
+                    break
+        sigs = array("I")
+        with open(self.sig_path, "rb") as fh:
+            sigs.frombytes(fh.read())
+        # The two files are appended separately; trust only records present in both
+        count = min(len(texts), len(sigs) // NUM_PERM)
+        for i in range(count):
+            self._index(sigs[i * NUM_PERM:(i + 1) * NUM_PERM], texts[i])
+        if count < len(texts) or count * NUM_PERM < len(sigs):
+            self._truncate(count)
+        logger.info(f"Loaded {count} hook signatures from {self.directory}")
+
+    def _truncate(self, count):
+        with open(self.sig_path, "r+b") as fh:
+            fh.truncate(count * NUM_PERM * self.signatures.itemsize)
+        with open(self.text_path, "w", encoding="utf-8") as fh:
+            fh.writelines(json.dumps(t, ensure_ascii=False) + "\n" for t in self.texts)
+
+    def _bands(self, sig):
+        for b in range(BANDS):
+            yield b, tuple(sig[b * ROWS:(b + 1) * ROWS])
+
+    def _index(self, sig, text):
+        idx = len(self.texts)
+        self.signatures.extend(sig)
+        self.texts.append(text)
+        for b, key in self._bands(sig):
+            self._buckets[b].setdefault(key, []).append(idx)
+
+    @property
+    def enabled(self):
+        return 0 < self.threshold <= 1
+
+    def nearest(self, text: str, sig=None):
+        """Return (similarity, hook) of the most similar indexed hook sharing an LSH band, or None"""
+        sig = sig if sig is not None else signature(text)
+        candidates = set()
+        for b, key in self._bands(sig):
+            candidates.update(self._buckets[b].get(key, ()))
+        best = None
+        for idx in candidates:
+            sim = similarity(sig, self.signatures[idx * NUM_PERM:(idx + 1) * NUM_PERM])
+            if best is None or sim > best[0]:
+                best = (sim, self.texts[idx])
+        return best
+
+    def is_novel(self, text: str, sig=None) -> bool:
+        if not self.enabled:
+            return True
+        match = self.nearest(text, sig)
+        return match is None or match[0] < self.threshold
+
+    def add(self, text: str, sig=None):
+        """Index a hook in memory; call flush() to persist everything added since the last flush"""
+        sig = sig if sig is not None else signature(text)
+        self._index(sig, text)
+        self._pending.append((sig, text))
+
+    def accept(self, text: str) -> bool:
+        """Add text if it is novel (against history and everything accepted so far); return whether it was"""
+        sig = signature(text)
+        if not self.is_novel(text, sig):
+            return False
+        self.add(text, sig)
+        return True
+
+    def flush(self):
+        if not self._pending:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Texts first: on a crash in between, _load drops the text without a signature
+        with open(self.text_path, "a", encoding="utf-8") as fh:
+            fh.writelines(json.dumps(t, ensure_ascii=False) + "\n" for _, t in self._pending)
+        with open(self.sig_path, "ab") as fh:
+            for sig, _ in self._pending:
+                sig.tofile(fh)
+        self._pending = []
+
+    def bootstrap(self, texts=None):
+        """Index every stored hook once, e.g. when the index does not exist yet"""
+        seen = set(self.texts)
+        for h in (texts if texts is not None else hook_store.iter_texts()):
+            if h.strip() and h not in seen:
+                seen.add(h)
+                self.add(h)
+        self.flush()
+        # Create the files even for an empty history so the scan is not repeated
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.text_path.touch()
+        self.sig_path.touch()
+        logger.info(f"Bootstrapped novelty index with {len(self)} hooks")
+
+def load_index():
+    """Open the persisted index, bootstrapping it from the hook store on first use"""
+    index = NoveltyIndex(INDEX_DIR)
+    if not index.text_path.exists():
+        index.bootstrap()
+    return index
@@ -1,9 +1,17 @@
-from PIL import Image, ImageDraw, ImageFont, ImageOps
+from PIL import Image, ImageChops, ImageDraw, ImageFont, ImageOps, ImageStat
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import lru_cache
+from io import BytesIO
 from pathlib import Path
+import hashlib
+import json
+import math
 import random
 import os
-from kjc_cli import config
+import time
+from kjc_cli import config, instrumentation
 from kjc_cli.logger import get_logger
+from kjc_cli.utils import file_sha256, save_json, save_json_atomic
 
 logger = get_logger("image_composer")
 
@@ -13,15 +21,37 @@ FONT_PATH = config.FONT_PATH
 FONT_SIZE = config.FONT_SIZE
 W = config.COMPOSED_WIDTH
 H = config.COMPOSED_HEIGHT
+COMPOSE_WORKERS = config.COMPOSE_WORKERS
+COMPOSE_CHUNKSIZE = config.COMPOSE_CHUNKSIZE
+OUTPUT_FORMAT = config.OUTPUT_FORMAT
+OUTPUT_CFG = config.IMAGE_OUTPUT_CFG
+ENCODER_REPORT_FILE = config.DATA_DIR / "reports" / "encoder_report.json"
+
+OUTPUT_FORMATS = {
+    "png": {"pil_format": "PNG", "ext": ".png", "mime": "image/png"},
+    "jpeg": {"pil_format": "JPEG", "ext": ".jpg", "mime": "image/jpeg"},
+    "webp": {"pil_format": "WEBP", "ext": ".webp", "mime": "image/webp"},
+}
+
+# Output name -> composition key of the item currently on disk (see _composition_key)
+MANIFEST_FILE = OUT_DIR / "manifest.json"
+
+# Normalized (pre-scaled) backgrounds, keyed by source content hash and target size
+BG_CACHE_DIR = config.CACHE_DIR / "backgrounds"
+
+# Font loaded once per pool worker by _init_compose_worker
+_WORKER_FONT = None
+
+BACKGROUND_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".gif"}
 
 def _get_backgrounds_sorted():
-    """Get all background images sorted by their number"""
-    imgs = list(BG_DIR.glob("*"))
+    """Get all background images, most recently fetched (or added) first"""
+    imgs = [p for p in BG_DIR.glob("*") if p.is_file() and p.suffix.lower() in BACKGROUND_SUFFIXES]
     if not imgs:
         raise FileNotFoundError(f"No background images in {BG_DIR}. Add some images or use images.txt.")
     
-    # Sort by filename to ensure consistent order
-    imgs.sort(key=lambda x: x.name)
+    # Stored files are named by content hash, so order by mtime (refreshed on every fetch); name breaks ties
+    imgs.sort(key=lambda x: (-x.stat().st_mtime, x.name))
     return imgs
 
 def _get_background_by_index(index):
@@ -33,34 +63,54 @@ def _get_background_by_index(index):
         # If we run out of backgrounds, cycle through them
         return imgs[index % len(imgs)]
 
-def _load_font(size=FONT_SIZE):
-    # Fonts that support both English and Japanese
-    bilingual_fonts = [
-        FONT_PATH,  # User configured font
-        # Noto Sans CJK - excellent for English + Japanese
-        "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
-        "/usr/share/fonts/opentype/noto/NotoSansCJK-Bold.ttc",
-        "/usr/share/fonts/opentype/noto/NotoSansJP-Regular.otf",
-        # Takao fonts - good Japanese support with English
-        "/usr/share/fonts/truetype/takao-gothic/TakaoGothic.ttf",
-        "/usr/share/fonts/truetype/takao-mincho/TakaoMincho.ttf",
-        # Windows fonts (if applicable)
-        "C:/Windows/Fonts/meiryo.ttc",
-        "C:/Windows/Fonts/msgothic.ttc",
-        # macOS fonts
-        "/System/Library/Fonts/ヒラギノ角ゴシック W4.ttc",
-    ]
-    
-    for font_path in bilingual_fonts:
+# Fonts that support both English and Japanese, in order of preference
+BILINGUAL_FONTS = [
+    FONT_PATH,  # User configured font
+    # Noto Sans CJK - excellent for English + Japanese
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Bold.ttc",
+    "/usr/share/fonts/opentype/noto/NotoSansJP-Regular.otf",
+    # Takao fonts - good Japanese support with English
+    "/usr/share/fonts/truetype/takao-gothic/TakaoGothic.ttf",
+    "/usr/share/fonts/truetype/takao-mincho/TakaoMincho.ttf",
+    # Windows fonts (if applicable)
+    "C:/Windows/Fonts/meiryo.ttc",
+    "C:/Windows/Fonts/msgothic.ttc",
+    # macOS fonts
+    "/System/Library/Fonts/ヒラギノ角ゴシック W4.ttc",
+]
+
+# Process-wide font registry: (path, size) -> font object
+_FONT_REGISTRY = {}
+# size -> (resolved font path or None for the default font, font object)
+_RESOLVED_FONTS = {}
+
+def _get_font(font_path, size):
+    """Open a font file once per process and reuse it for every image"""
+    key = (font_path, size)
+    font = _FONT_REGISTRY.get(key)
+    if font is None:
+        font = ImageFont.truetype(font_path, size)
+        _FONT_REGISTRY[key] = font
+    return font
+
+def _resolve_font(size=FONT_SIZE):
+    """Return (font_path, font) for the first usable bilingual font, cached per size"""
+    resolved = _RESOLVED_FONTS.get(size)
+    if resolved is not None:
+        return resolved
+    
+    for font_path in BILINGUAL_FONTS:
         try:
             if os.path.exists(font_path):
-                font = ImageFont.truetype(font_path, size)
+                font = _get_font(font_path, size)
                 # Test with both English and Japanese characters
                 test_text = "Abcテスト"
                 try:
                     bbox = font.getbbox(test_text)
                     logger.info(f"Loaded bilingual font: {os.path.basename(font_path)}")
-                    return font
+                    _RESOLVED_FONTS[size] = (font_path, font)
+                    return _RESOLVED_FONTS[size]
                 except Exception as test_error:
                     logger.debug(f"Font {font_path} failed test: {test_error}")
                     continue
@@ -71,11 +121,15 @@ def _load_font(size=FONT_SIZE):
     # Fallback to system default
     try:
         logger.warning("No bilingual fonts found, using system default")
-        return ImageFont.load_default()
+        _RESOLVED_FONTS[size] = (None, ImageFont.load_default())
+        return _RESOLVED_FONTS[size]
     except Exception:
         logger.error("Failed to load any font")
         raise
 
+def _load_font(size=FONT_SIZE):
+    return _resolve_font(size)[1]
+
 def _is_japanese_text(text):
     """Check if text contains Japanese characters"""
     for char in text:
@@ -87,58 +141,85 @@ def _is_japanese_text(text):
             return True
     return False
 
-def _draw_text_centered(img: Image.Image, text: str, font: ImageFont.FreeTypeFont):
-    draw = ImageDraw.Draw(img)
-    img_width, img_height = img.size
-    max_width = int(img_width * 0.65)
-    
+@lru_cache(maxsize=8192)
+def _glyph_width(font, char):
+    """Advance width of a single glyph (memoized per font)"""
+    return font.getlength(char)
+
+@lru_cache(maxsize=64)
+def _font_height(font):
+    bbox = font.getbbox("Hg")
+    return bbox[3] - bbox[1]
+
+def _text_width(font, text):
+    return sum(_glyph_width(font, c) for c in text)
+
+@lru_cache(maxsize=4096)
+def _layout_lines(text, font, max_width):
+    """
+    Wrap text to max_width and return (lines, line_widths).
+    Widths are summed from per-glyph advances, so wrapping is linear in the
+    text length; results are memoized per (text, font, max_width).
+    """
+    lines = []
+    widths = []
     # Choose wrapping method based on text content
     if _is_japanese_text(text):
         # Japanese text wrapping (character-based)
-        lines = []
         current_line = ""
+        current_w = 0
         for char in text:
-            test_line = current_line + char
-            if draw.textlength(test_line, font=font) <= max_width:
-                current_line = test_line
+            char_w = _glyph_width(font, char)
+            if current_w + char_w <= max_width:
+                current_line += char
+                current_w += char_w
             else:
                 if current_line:
                     lines.append(current_line)
+                    widths.append(current_w)
                 current_line = char
+                current_w = char_w
         if current_line:
             lines.append(current_line)
-        logger.debug("Used Japanese character-based wrapping")
+            widths.append(current_w)
     else:
         # English text wrapping (word-based)
-        lines = []
-        words = text.split()
+        space_w = _glyph_width(font, " ")
         line = ""
-        for w in words:
-            test = (line + " " + w).strip()
-            if draw.textlength(test, font=font) <= max_width:
-                line = test
+        line_w = 0
+        for w in text.split():
+            word_w = _text_width(font, w)
+            test_w = line_w + space_w + word_w if line else word_w
+            if test_w <= max_width or not line:
+                line = f"{line} {w}" if line else w
+                line_w = test_w
             else:
                 lines.append(line)
+                widths.append(line_w)
                 line = w
+                line_w = word_w
         if line:
             lines.append(line)
-        logger.debug("Used English word-based wrapping")
+            widths.append(line_w)
+    return tuple(lines), tuple(widths)
+
+def _draw_text_centered(img: Image.Image, text: str, font: ImageFont.FreeTypeFont):
+    draw = ImageDraw.Draw(img)
+    img_width, img_height = img.size
+    max_width = int(img_width * 0.65)
+    
+    lines, widths = _layout_lines(text, font, max_width)
     
     # Calculate line height and positioning (same for both languages)
     line_height_multiplier = 1.4
-    bbox = font.getbbox("Hg")
-    font_height = bbox[3] - bbox[1]
+    font_height = _font_height(font)
     line_spacing = int(font_height * (line_height_multiplier - 1))
     
     total_h = len(lines) * font_height + (len(lines) - 1) * line_spacing
     y_start = int((img_height - total_h) / 2)
     
-    # Calculate maximum line width for background rectangle
-    max_line_width = 0
-    for l in lines:
-        line_width = draw.textlength(l, font=font)
-        if line_width > max_line_width:
-            max_line_width = line_width
+    # Maximum line width for background rectangle
+    max_line_width = max(widths, default=0)
     
     # Add padding and draw background
     padding_x = 30
@@ -154,38 +235,93 @@ def _draw_text_centered(img: Image.Image, text: str, font: ImageFont.FreeTypeFon
     
     # Draw text
     y = y_start
-    for l in lines:
-        w_text = draw.textlength(l, font=font)
+    for l, w_text in zip(lines, widths):
         x = int((img_width - w_text) / 2)
         draw.text((x, y), l, fill=(255, 255, 255, 255), font=font)
         y += font_height + line_spacing
 
-def compose_image(bg_path: Path, hook_text: str, overlays: list = None, output_path: Path = None):
-    overlays = overlays or []
-    output_path = output_path or (OUT_DIR / (bg_path.stem + "_composed.png"))
-    OUT_DIR.mkdir(parents=True, exist_ok=True)
+def _output_format(fmt=None):
+    fmt = (fmt or OUTPUT_FORMAT).lower()
+    if fmt == "jpg":
+        fmt = "jpeg"
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format {fmt!r}; choose one of {sorted(OUTPUT_FORMATS)}")
+    return fmt
+
+def output_extension(fmt=None):
+    """File extension (with dot) for composed images in the given/configured format"""
+    return OUTPUT_FORMATS[_output_format(fmt)]["ext"]
+
+def output_mime(fmt=None):
+    """MIME type for composed images in the given/configured format"""
+    return OUTPUT_FORMATS[_output_format(fmt)]["mime"]
+
+def _encoder_options(fmt=None, cfg=None):
+    """Pillow save() keyword arguments for an output format"""
+    fmt = _output_format(fmt)
+    cfg = OUTPUT_CFG if cfg is None else cfg
+    if fmt == "jpeg":
+        return {
+            "quality": int(cfg.get("jpeg_quality", 90)),
+            "subsampling": cfg.get("jpeg_subsampling", "4:2:0"),
+            "progressive": bool(cfg.get("jpeg_progressive", True)),
+        }
+    if fmt == "webp":
+        return {
+            "quality": int(cfg.get("webp_quality", 85)),
+            "lossless": bool(cfg.get("webp_lossless", False)),
+            "method": int(cfg.get("webp_method", 4)),
+        }
+    return {"compress_level": int(cfg.get("png_compress_level", 6))}
+
+def _save_composed(im: Image.Image, dest, fmt=None, options=None):
+    """Encode a composed image; dest may be a path or a file object"""
+    fmt = _output_format(fmt)
+    options = _encoder_options(fmt) if options is None else options
+    # The composite is fully opaque: drop alpha (required for JPEG, smaller for PNG/WebP)
+    if im.mode != "RGB":
+        im = im.convert("RGB")
+    im.save(dest, format=OUTPUT_FORMATS[fmt]["pil_format"], **options)
+
+def _normalized_background(bg_path: Path):
+    """
+    Return the path of an RGB derivative of bg_path fitted to W x H.
+    The first use decodes the source (at reduced scale for JPEGs via draft mode)
+    and stores the result; later composes of the same content read the small copy.
+    """
+    cached = BG_CACHE_DIR / f"{file_sha256(bg_path)}_{W}x{H}.png"
+    if cached.exists():
+        return cached
     
+    BG_CACHE_DIR.mkdir(parents=True, exist_ok=True)
     with Image.open(bg_path) as im:
-        # Convert to RGB if needed (for JPEG compatibility)
+        orig_width, orig_height = im.size
+        # JPEG only: let libjpeg downscale by 1/2..1/8 while keeping at least W x H
+        im.draft("RGB", (W, H))
         if im.mode != 'RGB':
             im = im.convert('RGB')
-        
-        # Get original dimensions
-        orig_width, orig_height = im.size
-        
-        # Only resize if the image is smaller than target, or use original resolution
-        if orig_width < W or orig_height < H:
-            # Resize to at least target size while maintaining aspect ratio
-            im = ImageOps.fit(im, (W, H), Image.LANCZOS)
-            logger.info(f"Upscaled image from {orig_width}x{orig_height} to {W}x{H}")
-        else:
-            # Use original resolution if it's already high enough
-            logger.info(f"Using original resolution: {orig_width}x{orig_height}")
-        
+        im = ImageOps.fit(im, (W, H), Image.LANCZOS)
+        # Write to a temp name first: pool workers may normalize the same source concurrently
+        tmp = cached.with_name(f"{cached.stem}.{os.getpid()}.tmp")
+        im.save(tmp, format="PNG", compress_level=1)
+    os.replace(tmp, cached)
+    logger.info(f"Normalized background {bg_path.name} from {orig_width}x{orig_height} to {W}x{H}")
+    return cached
+
+@instrumentation.timed("compose_image", measure=lambda out, args, kwargs: {
+    "bytes_in": instrumentation.file_size(args[0] if args else kwargs.get("bg_path")),
+    "bytes_out": instrumentation.file_size(out),
+})
+def compose_image(bg_path: Path, hook_text: str, overlays: list = None, output_path: Path = None, font=None):
+    overlays = overlays or []
+    output_path = output_path or (OUT_DIR / (bg_path.stem + "_composed" + output_extension()))
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
+    
+    with Image.open(_normalized_background(bg_path)) as im:
         # Convert to RGBA for text overlay
         im = im.convert("RGBA")
         
-        font = _load_font()
+        font = font or _load_font()
         _draw_text_centered(im, hook_text, font)
         
         # paste overlays if any (centered)
@@ -198,34 +334,248 @@ def compose_image(bg_path: Path, hook_text: str, overlays: list = None, output_p
             except Exception as e:
                 logger.warning(f"Failed to apply overlay {ov}: {e}")
         
-        # Save with high quality
-        im.save(output_path, quality=95, optimize=True)
+        _save_composed(im, output_path)
     
     logger.info(f"Saved composed image {output_path}")
     return output_path
 
-def run_compose(hooks: list):
+def _init_compose_worker():
+    """Pool initializer: load the font once per worker process"""
+    global _WORKER_FONT
+    _WORKER_FONT = _load_font()
+
+def _compose_task(task):
+    """
+    Compose a single hook inside a pool worker.
+    Returns (index, output path or None, error message or None, compose_image
+    stats) so that one failing hook never aborts the rest of the batch, and the
+    worker's timings reach the parent's run report.
+    """
+    index, bg, hook, out = task
+    try:
+        p = compose_image(bg, hook, overlays=[], output_path=out, font=_WORKER_FONT)
+        return index, str(p), None, instrumentation.drain("compose_image")
+    except Exception as e:
+        logger.exception("Failed to compose image for hook: %s", hook)
+        return index, None, str(e), instrumentation.drain("compose_image")
+
+def _compose_workers(n_tasks, workers=None):
+    workers = COMPOSE_WORKERS if workers is None else workers
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return max(1, min(workers, n_tasks))
+
+def _load_manifest():
+    try:
+        with open(MANIFEST_FILE, "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable composition manifest {MANIFEST_FILE}: {e}")
+        return {}
+
+def _composition_key(hook: str, bg_path: Path, font_path, overlays: list = None):
+    """Hash of everything that determines a composed image's pixels and encoding"""
+    fmt = _output_format()
+    parts = {
+        "hook": hook,
+        "background": file_sha256(bg_path),
+        "font_path": font_path,
+        "font_size": FONT_SIZE,
+        "size": [W, H],
+        "overlays": [file_sha256(ov) for ov in (overlays or [])],
+        "format": fmt,
+        "encoder": _encoder_options(fmt),
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def run_compose(hooks: list, workers: int = None, backgrounds: list = None):
     """
-    Compose images for each hook. Uses background_1 for composed_1, background_2 for composed_2, etc.
+    Compose images for each hook. Uses background_1 for composed_1, background_2 for composed_2, etc.,
+    where backgrounds are this run's collected ones if given, else the store's most recently fetched.
+    Outputs whose composition key matches the manifest entry are reused as-is; only new or
+    changed items are rendered. With more than one worker the hooks are composed in a
+    process pool; results keep hook order.
     Returns list of composed image paths.
     """
     logger.info("Starting image composition for hooks")
-    composed = []
     
-    # Get all available backgrounds sorted
-    backgrounds = _get_backgrounds_sorted()
+    # This run's backgrounds, else all available ones, most recent first
+    backgrounds = [Path(p) for p in backgrounds or [] if Path(p).exists()] or _get_backgrounds_sorted()
     logger.info(f"Found {len(backgrounds)} background images")
     
+    manifest = _load_manifest()
+    font_path = _resolve_font()[0]
+    ext = output_extension()
+    outputs = {}
+    keys = {}
+    tasks = []
     for i, hook in enumerate(hooks):
-        try:
-            # Use background corresponding to the hook index
-            bg = _get_background_by_index(i)
-            out = OUT_DIR / f"composed_{i+1}.png"
-            
-            logger.info(f"Using {bg.name} for composed_{i+1}.png")
-            p = compose_image(bg, hook, overlays=[], output_path=out)
-            composed.append(str(p))
-        except Exception as e:
-            logger.exception("Failed to compose image for hook: %s", hook)
+        # Use background corresponding to the hook index (cycle if we run out)
+        bg = backgrounds[i % len(backgrounds)]
+        out = OUT_DIR / f"composed_{i+1}{ext}"
+        keys[i] = _composition_key(hook, bg, font_path)
+        entry = manifest.get(out.name) or {}
+        if entry.get("key") == keys[i] and out.exists():
+            outputs[i] = str(out)
+            continue
+        logger.info(f"Using {bg.name} for {out.name}")
+        tasks.append((i, bg, hook, out))
+    
+    if outputs:
+        logger.info(f"Reusing {len(outputs)} unchanged composed images")
+    
+    n_workers = _compose_workers(len(tasks), workers)
+    if not tasks:
+        results = []
+    elif n_workers == 1:
+        _init_compose_worker()
+        results = [_compose_task(t) for t in tasks]
+    else:
+        logger.info(f"Composing {len(tasks)} images with {n_workers} worker processes")
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_compose_worker) as pool:
+            # map() yields results in submission order, i.e. hook order
+            results = list(pool.map(_compose_task, tasks, chunksize=COMPOSE_CHUNKSIZE))
+    
+    for (i, bg, hook, out), (_, path, _, stats) in zip(tasks, results):
+        instrumentation.merge(stats)
+        if path:
+            outputs[i] = path
+            manifest[out.name] = {"key": keys[i], "hook": hook, "background": bg.name}
+        else:
+            manifest.pop(out.name, None)
+    if tasks:
+        save_json_atomic(MANIFEST_FILE, manifest)
+    
+    failed = len(tasks) - sum(1 for _, path, _, _ in results if path)
+    if failed:
+        logger.warning(f"{failed}/{len(tasks)} hooks failed to compose")
+    return [outputs[i] for i in sorted(outputs)]
+
+def iter_compose(items, background_for, workers: int = None, max_pending: int = None):
+    """
+    Streaming counterpart of run_compose for the pipeline executor.
+    items is an iterable of (index, hook), consumed lazily; background_for(index)
+    returns the background to use (it may block until one exists). Yields
+    (index, hook, composed path or None) as each image is ready, in completion
+    order. At most max_pending hooks are in the process pool at once, so a slow
+    pool stops pulling new hooks (back-pressure). Closing the generator
+    cancels queued work; the manifest is saved either way.
+    """
+    manifest = _load_manifest()
+    font_path = _resolve_font()[0]
+    ext = output_extension()
+    n_workers = _compose_workers(1 << 30, workers)
+    max_pending = max_pending or 2 * n_workers
+    pool = None
+    pending = {}
+    changed = False
+
+    def _finish(task, key, result):
+        nonlocal changed
+        i, bg, hook, out = task
+        _, path, _, stats = result
+        instrumentation.merge(stats)
+        if path:
+            manifest[out.name] = {"key": key, "hook": hook, "background": bg.name}
+        else:
+            manifest.pop(out.name, None)
+        changed = True
+        return i, hook, path
+
+    try:
+        for i, hook in items:
+            bg = background_for(i)
+            out = OUT_DIR / f"composed_{i+1}{ext}"
+            key = _composition_key(hook, bg, font_path)
+            entry = manifest.get(out.name) or {}
+            if entry.get("key") == key and out.exists():
+                yield i, hook, str(out)
+                continue
+            logger.info(f"Using {bg.name} for {out.name}")
+            task = (i, bg, hook, out)
+            if n_workers == 1:
+                if _WORKER_FONT is None:
+                    _init_compose_worker()
+                yield _finish(task, key, _compose_task(task))
+                continue
+            if pool is None:
+                logger.info(f"Composing with {n_workers} worker processes")
+                pool = ProcessPoolExecutor(max_workers=n_workers, initializer=_init_compose_worker)
+            pending[pool.submit(_compose_task, task)] = (task, key)
+            # Hand back finished images before pulling the next hook, which may block on the upstream stage
+            done, _ = wait(pending, timeout=0)
+            for fut in done:
+                yield _finish(*pending.pop(fut), fut.result())
+            while len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    yield _finish(*pending.pop(fut), fut.result())
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                yield _finish(*pending.pop(fut), fut.result())
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+        if changed:
+            save_json_atomic(MANIFEST_FILE, manifest)
+
+# Settings compared by encoder_report(); each entry is (label, format, options)
+ENCODER_CANDIDATES = [
+    ("png-optimize", "png", {"optimize": True}),
+    ("png-level1", "png", {"compress_level": 1}),
+    ("png-level6", "png", {"compress_level": 6}),
+    ("jpeg-q85-420", "jpeg", {"quality": 85, "subsampling": "4:2:0", "progressive": False}),
+    ("jpeg-q90-420-progressive", "jpeg", {"quality": 90, "subsampling": "4:2:0", "progressive": True}),
+    ("jpeg-q95-444", "jpeg", {"quality": 95, "subsampling": "4:4:4", "progressive": False}),
+    ("webp-q80-m4", "webp", {"quality": 80, "method": 4}),
+    ("webp-q90-m6", "webp", {"quality": 90, "method": 6}),
+    ("webp-lossless-m1", "webp", {"lossless": True, "method": 1}),
+]
+
+def _psnr(reference: Image.Image, encoded: Image.Image):
+    """Peak signal-to-noise ratio in dB (inf for a lossless round trip)"""
+    rms = ImageStat.Stat(ImageChops.difference(reference, encoded)).rms
+    mse = sum(r * r for r in rms) / len(rms)
+    return float("inf") if mse == 0 else 20 * math.log10(255 / math.sqrt(mse))
+
+def encoder_report(hook_text: str = "2025秋、周りと絶対被らない「モテスウェット」8選", bg_path: Path = None, repeats: int = 3):
+    """
+    Compose one sample image and encode it with every ENCODER_CANDIDATES setting,
+    reporting output size, best-of-N encode time and PSNR against the raw composite.
+    The report is written to data/reports/encoder_report.json and returned.
+    """
+    bg_path = bg_path or _get_backgrounds_sorted()[0]
+    with Image.open(_normalized_background(bg_path)) as im:
+        im = im.convert("RGBA")
+    _draw_text_centered(im, hook_text, _load_font())
+    reference = im.convert("RGB")
+    
+    rows = []
+    for label, fmt, options in ENCODER_CANDIDATES:
+        timings = []
+        for _ in range(max(1, repeats)):
+            buf = BytesIO()
+            start = time.perf_counter()
+            _save_composed(reference, buf, fmt, options)
+            timings.append(time.perf_counter() - start)
+        buf.seek(0)
+        with Image.open(buf) as decoded:
+            psnr = _psnr(reference, decoded.convert("RGB"))
+        rows.append({
+            "label": label,
+            "format": fmt,
+            "options": options,
+            "bytes": buf.getbuffer().nbytes,
+            "encode_ms": round(min(timings) * 1000, 1),
+            "psnr_db": None if math.isinf(psnr) else round(psnr, 2),
+            "lossless": math.isinf(psnr),
+        })
+        logger.info(f"{label}: {rows[-1]['bytes']} bytes, {rows[-1]['encode_ms']} ms, PSNR {rows[-1]['psnr_db'] or 'lossless'}")
     
-    return composed
\ No newline at end of file
+    report = {"background": str(bg_path), "width": W, "height": H, "results": rows}
+    save_json(ENCODER_REPORT_FILE, report)
+    logger.info(f"Saved encoder report to {ENCODER_REPORT_FILE}")
+    return report
@@ -0,0 +1,146 @@
+"""
+Perceptual-hash index for near-duplicate background detection.
+
+Each background gets a 64-bit difference hash (dHash) computed from a tiny
+grayscale thumbnail, so resized variants, light crops and re-encodes land a
+few bits apart. Hashes are kept in a BK-tree for Hamming-radius lookups and
+persisted as an append-only JSONL file, so the index survives across runs
+without rescanning BACKGROUND_DIR.
+"""
+
+import json
+import os
+from pathlib import Path
+from PIL import Image
+from kjc_cli import config
+from kjc_cli.logger import get_logger
+
+logger = get_logger("image_dedupe")
+
+INDEX_FILE = config.CACHE_DIR / "phash_index.jsonl"
+HASH_SIZE = 8
+
+def dhash(path: Path, hash_size: int = HASH_SIZE) -> int:
+    """Difference hash: compares horizontally adjacent pixels of a (hash_size+1) x hash_size thumbnail"""
+    with Image.open(path) as im:
+        # JPEG only: decode at 1/8 scale, the thumbnail needs a tiny fraction of the pixels
+        im.draft("L", (hash_size * 8, hash_size * 8))
+        small = im.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+class BKTree:
+    """Burkhard-Keller tree over integer hashes with Hamming distance as the metric"""
+
+    def __init__(self):
+        self._root = None  # node = [hash, key, {distance: child}]
+        self.size = 0
+
+    def add(self, value: int, key):
+        self.size += 1
+        if self._root is None:
+            self._root = [value, key, {}]
+            return
+        node = self._root
+        while True:
+            d = hamming(value, node[0])
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [value, key, {}]
+                return
+            node = child
+
+    def search(self, value: int, radius: int):
+        """Return [(distance, key)] for every stored hash within radius, closest first"""
+        found = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            d = hamming(value, node[0])
+            if d <= radius:
+                found.append((d, node[1]))
+            # Triangle inequality: only children at distance d±radius can match
+            for child_d, child in node[2].items():
+                if d - radius <= child_d <= d + radius:
+                    stack.append(child)
+        found.sort(key=lambda x: x[0])
+        return found
+
+class PHashIndex:
+    """Persistent dHash -> background file name index"""
+
+    def __init__(self, path: Path = INDEX_FILE, max_distance: int = config.PHASH_MAX_DISTANCE):
+        self.path = Path(path)
+        self.max_distance = max_distance
+        self.tree = BKTree()
+        self._load()
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        with open(self.path, "r", encoding="utf-8") as fh:
+            for line in fh:
+                try:
+                    rec = json.loads(line)
+                    self.tree.add(int(rec["h"], 16), rec["f"])
+                except Exception:
+                    # A torn last line from a crash is skipped, not fatal
+                    continue
+        logger.info(f"Loaded {self.tree.size} perceptual hashes from {self.path}")
+
+    @property
+    def enabled(self):
+        return self.max_distance >= 0
+
+    def find_near(self, value: int):
+        """Return (distance, file name) of the closest indexed image within max_distance, or None"""
+        if not self.enabled:
+            return None
+        matches = self.tree.search(value, self.max_distance)
+        return matches[0] if matches else None
+
+    def add(self, value: int, name: str):
+        self.tree.add(value, name)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as fh:
+            fh.write(json.dumps({"h": f"{value:016x}", "f": name}) + "\n")
+
+    def bootstrap(self, paths):
+        """Index existing backgrounds once, when the index file does not exist yet (it exists afterwards, even if empty)"""
+        for p in paths:
+            try:
+                self.add(dhash(p), Path(p).name)
+            except Exception as e:
+                logger.debug(f"Could not hash {p}: {e}")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.touch()
+
+    def discard(self, names):
+        """Drop the hashes of removed backgrounds: rewrites the file and rebuilds the tree"""
+        names = set(names)
+        if not names or not self.path.exists():
+            return
+        with open(self.path, "r", encoding="utf-8") as fh:
+            lines = [line for line in fh if line.strip()]
+        kept = []
+        for line in lines:
+            try:
+                if json.loads(line)["f"] in names:
+                    continue
+            except Exception:
+                continue
+            kept.append(line if line.endswith("\n") else line + "\n")
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as fh:
+            fh.writelines(kept)
+        os.replace(tmp, self.path)
+        self.tree = BKTree()
+        self._load()
@@ -0,0 +1,144 @@
+"""
+Header-only image sniffing for streamed downloads.
+
+StreamProbe is fed the first chunks of a transfer and identifies the format
+from its magic bytes and the pixel dimensions from the header (JPEG SOF,
+PNG IHDR, GIF logical screen, WebP VP8/VP8L/VP8X), so a download can be
+aborted before the body is transferred.
+"""
+
+import struct
+
+# How much of the stream we are willing to buffer looking for dimensions
+# (JPEG EXIF/ICC segments can push the SOF marker well past the first chunk)
+MAX_HEAD_BYTES = 512 * 1024
+
+EXTENSIONS = {"jpeg": ".jpg", "png": ".png", "gif": ".gif", "webp": ".webp"}
+
+# JPEG start-of-frame markers that carry the frame size (excludes DHT/JPG/DAC)
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+class InvalidImage(Exception):
+    """The stream is not an acceptable image"""
+
+def sniff_format(head: bytes):
+    """Return 'jpeg', 'png', 'gif' or 'webp' from magic bytes, or None"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+def _jpeg_size(head: bytes):
+    i = 2
+    n = len(head)
+    while i + 4 <= n:
+        if head[i] != 0xFF:
+            raise InvalidImage("corrupt JPEG marker stream")
+        marker = head[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:  # standalone markers
+            i += 2
+            continue
+        if marker in (0xD9, 0xDA):
+            raise InvalidImage("JPEG has no frame header before scan data")
+        seg_len = struct.unpack(">H", head[i + 2:i + 4])[0]
+        if marker in _SOF_MARKERS:
+            if i + 9 > n:
+                return None
+            h, w = struct.unpack(">HH", head[i + 5:i + 9])
+            return w, h
+        i += 2 + seg_len
+    return None
+
+def _webp_size(head: bytes):
+    if len(head) < 30:
+        return None
+    chunk = head[12:16]
+    if chunk == b"VP8 ":
+        w, h = struct.unpack("<HH", head[26:30])
+        return w & 0x3FFF, h & 0x3FFF
+    if chunk == b"VP8L":
+        bits = int.from_bytes(head[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        w = int.from_bytes(head[24:27], "little") + 1
+        h = int.from_bytes(head[27:30], "little") + 1
+        return w, h
+    raise InvalidImage(f"unknown WebP chunk {chunk!r}")
+
+def image_size(fmt: str, head: bytes):
+    """(width, height) parsed from the header bytes, or None if more bytes are needed"""
+    if fmt == "jpeg":
+        return _jpeg_size(head)
+    if fmt == "png":
+        if len(head) < 24:
+            return None
+        if head[12:16] != b"IHDR":
+            raise InvalidImage("PNG without IHDR")
+        return struct.unpack(">II", head[16:24])
+    if fmt == "gif":
+        if len(head) < 10:
+            return None
+        return struct.unpack("<HH", head[6:10])
+    if fmt == "webp":
+        return _webp_size(head)
+    return None
+
+def content_type_ok(content_type) -> bool:
+    """Reject responses the server itself labels as non-images (HTML error pages etc.)"""
+    if not content_type:
+        return True
+    content_type = content_type.split(";")[0].strip().lower()
+    return content_type.startswith("image/") or content_type in ("application/octet-stream", "binary/octet-stream")
+
+class StreamProbe:
+    """Incrementally validate the head of an image stream"""
+
+    def __init__(self, min_width: int = 0, min_height: int = 0):
+        self.min_width = min_width
+        self.min_height = min_height
+        self.format = None
+        self.size = None
+        self.done = False
+        self._head = b""
+
+    def feed(self, chunk: bytes):
+        """
+        Consume the next chunk. Raises InvalidImage as soon as the stream is
+        known to be unacceptable; sets done once format and size are verified.
+        """
+        if self.done:
+            return
+        self._head += chunk
+        if self.format is None:
+            if len(self._head) < 12:
+                return
+            self.format = sniff_format(self._head)
+            if self.format is None:
+                raise InvalidImage(f"not an image (starts with {self._head[:12]!r})")
+        self.size = image_size(self.format, self._head)
+        if self.size is None:
+            if len(self._head) >= MAX_HEAD_BYTES:
+                raise InvalidImage(f"no {self.format} dimensions within {MAX_HEAD_BYTES} bytes")
+            return
+        w, h = self.size
+        if w < self.min_width or h < self.min_height:
+            raise InvalidImage(f"{w}x{h} is below the {self.min_width}x{self.min_height} minimum")
+        self.done = True
+        self._head = b""
+
+    def finish(self):
+        """Call at end of stream: a stream that never validated is rejected"""
+        if not self.done:
+            raise InvalidImage("stream ended before the image header was complete")
+
+    @property
+    def extension(self):
+        return EXTENSIONS.get(self.format, ".jpg")
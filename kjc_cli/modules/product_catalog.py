@@ -0,0 +1,222 @@
+"""
+Product catalog on top of product_importer.
+
+Prices and URLs are normalized as vectorized column operations ("$19.99",
+"¥12,800", "１，９８０円" -> float; tracking parameters and fragments
+stripped from links), and categories are assigned from title keywords.
+The catalog keeps a price-sorted index per category plus a link -> row map,
+so picking a product for a hook is a couple of binary searches instead of
+a scan, however large the catalog. Products carry the time the product
+index last saw them added or changed; an update-time index serves fresh()
+and a second set of per-category indexes over recently updated products
+lets pick() prefer them.
+"""
+
+import re
+import time
+import unicodedata
+from itertools import islice
+import numpy as np
+import pandas as pd
+from kjc_cli import config
+from kjc_cli.logger import get_logger
+from kjc_cli.modules import product_importer
+
+logger = get_logger("product_catalog")
+
+ALL = "*"
+
+def normalize_prices(raw: pd.Series) -> pd.Series:
+    """Raw price strings -> float (NaN when unparseable)"""
+    # Fast path: plain numbers parse without any regex work
+    values = pd.to_numeric(raw, errors="coerce")
+    messy = values.isna() & (raw.fillna("").astype(str).str.len() > 0)
+    if messy.any():
+        values[messy] = _parse_prices(raw[messy])
+    return values
+
+def _parse_prices(raw: pd.Series) -> pd.Series:
+    s = raw.astype(str).str.normalize("NFKC")
+    # Thousands separators go first so "1,980" is not read as 1.980
+    s = s.str.replace(r"(?<=\d),(?=\d{3})", "", regex=True)
+    s = s.str.extract(r"(\d+(?:\.\d+)?)", expand=False)
+    return pd.to_numeric(s, errors="coerce")
+
+def normalize_links(raw: pd.Series) -> pd.Series:
+    """Trim, default protocol-relative links to https, drop utm_* parameters and #fragments"""
+    s = raw.fillna("").astype(str).str.strip()
+    s = s.str.replace(r"^//", "https://", regex=True)
+    s = s.str.replace(r"#.*$", "", regex=True)
+    s = s.str.replace(r"(?<=[?&])utm_[^&]*(&|$)", "", regex=True)
+    return s.str.replace(r"[?&]$", "", regex=True)
+
+def categorize(titles: pd.Series, categories=None) -> pd.Series:
+    """First category (in config order) whose keywords appear in each title, else an empty string"""
+    categories = config.CATALOG_CATEGORIES if categories is None else categories
+    titles = titles.fillna("").astype(str).str.normalize("NFKC")
+    out = pd.Series("", index=titles.index, dtype=object)
+    for name, keywords in reversed(list(categories.items())):
+        pattern = "|".join(re.escape(unicodedata.normalize("NFKC", k)) for k in keywords)
+        if pattern:
+            out = out.mask(titles.str.contains(pattern, case=False, regex=True), name)
+    return out
+
+def normalize_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Importer columns plus normalized link, price_value, category and updated_at (epoch seconds, NaN if unknown)"""
+    updated = pd.to_numeric(df["updated_at"], errors="coerce") if "updated_at" in df else np.nan
+    df = df.reindex(columns=product_importer.PRODUCT_COLUMNS).fillna("")
+    df["updated_at"] = updated
+    df["link"] = normalize_links(df["link"])
+    df["price_value"] = normalize_prices(df["price"])
+    df["category"] = categorize(df["title"])
+    return df
+
+_BAND = re.compile(r"(\d+(?:\.\d+)?)\s*(万|千)?\s*円\s*(未満|以下|以内|以上)?")
+_UNITS = {"万": 10000, "千": 1000, None: 1}
+
+def price_band(hook: str):
+    """(low, high) price bounds a hook asks for, e.g. "1万円以下" -> (0, 10000); None if it names no price"""
+    m = _BAND.search(unicodedata.normalize("NFKC", hook).replace(",", ""))
+    if not m:
+        return None
+    amount = float(m.group(1)) * _UNITS[m.group(2)]
+    if m.group(3) == "以上":
+        return (amount, np.inf)
+    if m.group(3) == "未満":
+        return (0.0, np.nextafter(amount, 0))
+    return (0.0, amount)
+
+def hook_category(hook: str, categories=None):
+    categories = config.CATALOG_CATEGORIES if categories is None else categories
+    text = unicodedata.normalize("NFKC", hook).casefold()
+    for name, keywords in categories.items():
+        if any(unicodedata.normalize("NFKC", k).casefold() in text for k in keywords):
+            return name
+    return None
+
+class ProductCatalog:
+    """Normalized products with price-sorted per-category indexes, plus the same over recently updated products"""
+
+    def __init__(self, df: pd.DataFrame, fresh_within: int = None):
+        df = df.reset_index(drop=True)
+        if "updated_at" not in df:
+            df["updated_at"] = np.nan
+        self.df = df
+        self._columns = {c: df[c].to_numpy() for c in (*product_importer.PRODUCT_COLUMNS, "category", "price_value", "updated_at")}
+        self.by_link = dict(zip(df["link"], df.index))
+        # Update-time index: row ids of products with a known update time, oldest first, and those times
+        updated = df["updated_at"].to_numpy(dtype=float)
+        known = np.flatnonzero(~np.isnan(updated))
+        order = np.argsort(updated[known], kind="stable")
+        self._by_updated = (known[order], updated[known][order])
+        fresh_within = config.CATALOG_FRESH_WITHIN if fresh_within is None else fresh_within
+        self.fresh_since = time.time() - fresh_within if fresh_within > 0 else None
+        # category -> (priced row ids sorted by price, their prices, all row ids); unpriced rows only match without a band
+        self._by_category = {}
+        self._fresh_by_category = {}
+        priced = df["price_value"].notna().to_numpy()
+        fresh = self.fresh(self.fresh_since) if self.fresh_since is not None else np.array([], dtype=int)
+        is_fresh = np.zeros(len(df), dtype=bool)
+        is_fresh[fresh] = True
+        for name, rows in df.groupby("category", sort=False).indices.items():
+            self._add_category(self._by_category, name, rows, priced)
+            if is_fresh[rows].any():
+                self._add_category(self._fresh_by_category, name, rows[is_fresh[rows]], priced)
+        self._add_category(self._by_category, ALL, np.arange(len(df)), priced)
+        if len(fresh):
+            self._add_category(self._fresh_by_category, ALL, np.sort(fresh), priced)
+        self._cursors = {}
+
+    def _add_category(self, index, name, rows, priced):
+        rows = np.asarray(rows)
+        prices = self.df["price_value"].to_numpy()[rows]
+        order = np.argsort(prices, kind="stable")
+        rows, prices = rows[order], prices[order]
+        keep = priced[rows]
+        index[name] = (rows[keep], prices[keep], rows)
+
+    @classmethod
+    def from_records(cls, products):
+        return cls.from_frame(pd.DataFrame(list(products), columns=product_importer.PRODUCT_COLUMNS))
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame):
+        return cls(normalize_frame(df))
+
+    @classmethod
+    def from_feed(cls, source: str = None):
+        """
+        Build from a feed, normalizing chunk by chunk so only the final columns
+        are held. Update times come from the product index (run_import_changes).
+        """
+        frames = []
+        updated = product_importer.updated_at_map(source)
+        products = product_importer.iter_products(source)
+        while True:
+            chunk = list(islice(products, config.PRODUCTS_CHUNKSIZE))
+            if not chunk:
+                break
+            chunk = pd.DataFrame(chunk)
+            # Keyed by the raw link, as the index stores it
+            chunk["updated_at"] = chunk["link"].map(updated) if len(updated) else np.nan
+            frames.append(normalize_frame(chunk))
+        df = pd.concat(frames, ignore_index=True) if frames else normalize_frame(pd.DataFrame())
+        logger.info(f"Built product catalog with {len(df)} products")
+        return cls(df)
+
+    def __len__(self):
+        return len(self.df)
+
+    def product(self, row):
+        rec = {c: values[row] for c, values in self._columns.items()}
+        for c in ("price_value", "updated_at"):
+            rec[c] = None if pd.isna(rec[c]) else float(rec[c])
+        return rec
+
+    def get(self, link):
+        row = self.by_link.get(link)
+        return None if row is None else self.product(row)
+
+    def fresh(self, since):
+        """Row ids of products updated at or after since (epoch seconds), newest first (one binary search)"""
+        rows, updated = self._by_updated
+        return rows[np.searchsorted(updated, since, side="left"):][::-1]
+
+    def in_band(self, category, low, high, index=None):
+        """Row ids in a category priced within [low, high], cheapest first (two binary searches)"""
+        index = self._by_category if index is None else index
+        rows, prices, _ = index[category] if category in index else index[ALL]
+        lo = np.searchsorted(prices, low, side="left")
+        hi = np.searchsorted(prices, high, side="right")
+        return rows[lo:hi]
+
+    def pick(self, hook: str):
+        """
+        Best product for a hook: same category and within the price band the
+        hook names, relaxing category, then band, when nothing matches. Each
+        step tries recently updated products (catalog.fresh_within) first.
+        Repeated picks for the same (category, band) rotate through the matches.
+        """
+        if not len(self.df):
+            return {}
+        category = hook_category(hook)
+        band = price_band(hook)
+        attempts = []
+        if category and band:
+            attempts.append((category, band))
+        if band:
+            attempts.append((ALL, band))
+        if category:
+            attempts.append((category, None))
+        attempts.append((ALL, None))
+        for cat, b in attempts:
+            for fresh, index in ((True, self._fresh_by_category), (False, self._by_category)):
+                if cat not in index:
+                    continue
+                rows = self.in_band(cat, *b, index=index) if b else index[cat][2]
+                if len(rows):
+                    key = (cat, b, fresh)
+                    cursor = self._cursors.get(key, 0)
+                    self._cursors[key] = cursor + 1
+                    return self.product(rows[cursor % len(rows)])
+        return {}
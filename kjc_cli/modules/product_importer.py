@@ -1,30 +1,238 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
 import pandas as pd
+from contextlib import closing
+from itertools import islice
 from pathlib import Path
 from kjc_cli import config
 from kjc_cli.logger import get_logger
+from kjc_cli.utils import file_sha256
 
 logger = get_logger("product_importer")
 
+# Optional: columnar cache of parsed feeds
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except Exception:
+    pa = pq = None
+
 # sample CSV path
 DEFAULT_CSV = Path("supplier_sample.csv")
 OUT_DIR = config.PRODUCTS_DIR
+CACHE_DIR = config.CACHE_DIR / "products"
+PRODUCT_COLUMNS = ["title", "price", "link", "image"]
 
-def run_import(source: str = None):
+def _cache_path(path: Path):
+    """Parquet cache file for this feed version: <path key>-<size/mtime key>.parquet"""
+    st = path.stat()
+    path_key = hashlib.sha1(str(path.resolve()).encode("utf-8")).hexdigest()[:16]
+    version_key = hashlib.sha1(f"{st.st_size}:{st.st_mtime_ns}".encode("utf-8")).hexdigest()[:16]
+    return CACHE_DIR / f"{path_key}-{version_key}.parquet"
+
+def _read_chunks(path: Path, chunksize: int):
+    """CSV chunks holding only PRODUCT_COLUMNS, all as str ("" for blanks and missing columns)"""
+    reader = pd.read_csv(
+        path,
+        usecols=lambda c: c in PRODUCT_COLUMNS,
+        dtype=str,
+        keep_default_na=False,
+        chunksize=chunksize,
+    )
+    with reader:
+        for chunk in reader:
+            yield chunk.reindex(columns=PRODUCT_COLUMNS, fill_value="")
+
+def _rows(columns):
+    """dicts from parallel column lists"""
+    for values in zip(*(columns[c] for c in PRODUCT_COLUMNS)):
+        yield dict(zip(PRODUCT_COLUMNS, values))
+
+def _iter_cached(cache: Path, chunksize: int):
+    for batch in pq.ParquetFile(cache).iter_batches(batch_size=chunksize, columns=PRODUCT_COLUMNS):
+        yield from _rows(batch.to_pydict())
+
+def iter_products(source: str = None, chunksize: int = None):
     """
-    Import products from CSV (expects columns: title, price, link, image)
+    Stream products from a CSV feed (columns: title, price, link, image) one
+    chunk at a time, so memory stays flat regardless of feed size. With
+    pyarrow installed, the first full pass also writes a Parquet cache that
+    later runs read instead of re-parsing the CSV.
     """
     path = Path(source) if source else DEFAULT_CSV
     if not path.exists():
         logger.warning(f"Product CSV {path} not found. Returning empty products list.")
-        return []
-    df = pd.read_csv(path)
-    products = []
-    for _, row in df.iterrows():
-        products.append({
-            "title": row.get("title", ""),
-            "price": row.get("price", ""),
-            "link": row.get("link", ""),
-            "image": row.get("image", "")
-        })
-    logger.info(f"Imported {len(products)} products from {path}")
+        return
+    chunksize = chunksize or config.PRODUCTS_CHUNKSIZE
+    cache = _cache_path(path) if pq is not None and config.PRODUCTS_COLUMNAR_CACHE else None
+    if cache is not None and cache.exists():
+        logger.info(f"Reading products from columnar cache {cache}")
+        yield from _iter_cached(cache, chunksize)
+        return
+
+    writer = None
+    tmp = cache.with_name(f"{cache.name}.{os.getpid()}.tmp") if cache is not None else None
+    completed = False
+    try:
+        for chunk in _read_chunks(path, chunksize):
+            if tmp is not None:
+                table = pa.Table.from_pandas(chunk, schema=pa.schema([(c, pa.string()) for c in PRODUCT_COLUMNS]), preserve_index=False)
+                if writer is None:
+                    tmp.parent.mkdir(parents=True, exist_ok=True)
+                    writer = pq.ParquetWriter(tmp, table.schema)
+                writer.write_table(table)
+            yield from _rows({c: chunk[c].tolist() for c in PRODUCT_COLUMNS})
+        completed = True
+    finally:
+        if writer is not None:
+            writer.close()
+            if completed:
+                # Older versions of this feed are superseded
+                for old in CACHE_DIR.glob(f"{cache.name.split('-')[0]}-*.parquet"):
+                    old.unlink(missing_ok=True)
+                os.replace(tmp, cache)
+            else:
+                # Consumer stopped early: a partial cache must not be reused
+                tmp.unlink(missing_ok=True)
+
+def run_import(source: str = None):
+    """
+    Import products from CSV (expects columns: title, price, link, image)
+    """
+    products = list(iter_products(source))
+    logger.info(f"Imported {len(products)} products from {Path(source) if source else DEFAULT_CSV}")
     return products
+
+
+# Persisted product index: per feed, link -> row hash of the last imported version
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    feed TEXT NOT NULL,
+    link TEXT NOT NULL,
+    row_hash TEXT NOT NULL,
+    title TEXT,
+    price TEXT,
+    image TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (feed, link)
+);
+CREATE TABLE IF NOT EXISTS feeds (
+    feed TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    imported_at REAL NOT NULL
+);
+"""
+
+def _connect_index(db_path=None):
+    db_path = db_path or config.PRODUCTS_INDEX_DB
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(INDEX_SCHEMA)
+    return conn
+
+def _row_hash(product):
+    return hashlib.sha1(json.dumps([product[c] for c in PRODUCT_COLUMNS], ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def _product(row):
+    title, price, link, image = row
+    return {"title": title, "price": price, "link": link, "image": image}
+
+def iter_changes(source: str = None, db_path=None):
+    """
+    Diff a feed against the persisted product index and yield ("added" |
+    "changed" | "removed", product). Products are keyed by link (rows
+    without one are ignored); the feed is staged in a temp table chunk by
+    chunk, so memory stays flat. The index is only updated once every
+    change has been consumed, so an interrupted run yields the same deltas
+    again. Feeds whose size/mtime, or else content hash, are unchanged
+    since the last import are skipped without parsing.
+    """
+    path = Path(source) if source else DEFAULT_CSV
+    if not path.exists():
+        logger.warning(f"Product CSV {path} not found. No product changes.")
+        return
+    feed = str(path.resolve())
+    st = path.stat()
+    chunksize = config.PRODUCTS_CHUNKSIZE
+    with closing(_connect_index(db_path)) as conn:
+        known = conn.execute("SELECT size, mtime_ns, sha256 FROM feeds WHERE feed = ?", (feed,)).fetchone()
+        if known and known[:2] == (st.st_size, st.st_mtime_ns):
+            logger.info(f"Product feed {path} unchanged (size/mtime), skipping")
+            return
+        digest = file_sha256(path)
+        if known and known[2] == digest:
+            with conn:
+                conn.execute("UPDATE feeds SET mtime_ns = ? WHERE feed = ?", (st.st_mtime_ns, feed))
+            logger.info(f"Product feed {path} unchanged (sha256), skipping")
+            return
+
+        conn.execute("CREATE TEMP TABLE staged (link TEXT PRIMARY KEY, row_hash TEXT, title TEXT, price TEXT, image TEXT)")
+        products = iter_products(path, chunksize)
+        while True:
+            chunk = list(islice(products, chunksize))
+            if not chunk:
+                break
+            # Checked before filtering: a chunk of link-less rows is not the end of the feed
+            batch = [p for p in chunk if p["link"]]
+            # Duplicate links within a feed: the last row wins
+            conn.executemany(
+                "INSERT OR REPLACE INTO staged (link, row_hash, title, price, image) VALUES (?, ?, ?, ?, ?)",
+                [(p["link"], _row_hash(p), p["title"], p["price"], p["image"]) for p in batch],
+            )
+
+        counts = {"added": 0, "changed": 0, "removed": 0}
+        queries = {
+            "added": "SELECT s.title, s.price, s.link, s.image FROM staged s "
+                     "LEFT JOIN products p ON p.feed = ? AND p.link = s.link WHERE p.link IS NULL",
+            "changed": "SELECT s.title, s.price, s.link, s.image FROM staged s "
+                       "JOIN products p ON p.feed = ? AND p.link = s.link WHERE p.row_hash != s.row_hash",
+            "removed": "SELECT p.title, p.price, p.link, p.image FROM products p "
+                       "LEFT JOIN staged s ON s.link = p.link WHERE p.feed = ? AND s.link IS NULL",
+        }
+        for kind, query in queries.items():
+            cursor = conn.execute(query, (feed,))
+            while True:
+                rows = cursor.fetchmany(chunksize)
+                if not rows:
+                    break
+                counts[kind] += len(rows)
+                for row in rows:
+                    yield kind, _product(row)
+
+        now = time.time()
+        with conn:
+            conn.execute("DELETE FROM products WHERE feed = ? AND link NOT IN (SELECT link FROM staged)", (feed,))
+            conn.execute(
+                "INSERT OR REPLACE INTO products (feed, link, row_hash, title, price, image, updated_at) "
+                "SELECT ?, s.link, s.row_hash, s.title, s.price, s.image, ? FROM staged s "
+                "LEFT JOIN products p ON p.feed = ? AND p.link = s.link "
+                "WHERE p.link IS NULL OR p.row_hash != s.row_hash",
+                (feed, now, feed),
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO feeds (feed, size, mtime_ns, sha256, imported_at) VALUES (?, ?, ?, ?, ?)",
+                (feed, st.st_size, st.st_mtime_ns, digest, now),
+            )
+            conn.execute("DROP TABLE staged")
+        logger.info(f"Product feed {path}: {counts['added']} added, {counts['changed']} changed, {counts['removed']} removed")
+
+def updated_at_map(source: str = None, db_path=None) -> pd.Series:
+    """link -> when the product index last saw the product added or changed (empty if the feed was never diffed)"""
+    path = Path(source) if source else DEFAULT_CSV
+    db_path = db_path or config.PRODUCTS_INDEX_DB
+    if not db_path.exists():
+        return pd.Series(dtype=float)
+    with closing(_connect_index(db_path)) as conn:
+        df = pd.read_sql_query("SELECT link, updated_at FROM products WHERE feed = ?", conn, params=(str(path.resolve()),))
+    return pd.Series(df["updated_at"].to_numpy(), index=df["link"].to_numpy(), dtype=float)
+
+def run_import_changes(source: str = None):
+    """Products added or changed since the last import of this feed (what assembly and posting need to act on)"""
+    return [product for kind, product in iter_changes(source) if kind != "removed"]
@@ -1,6 +1,7 @@
-import requests
-from kjc_cli import config
+import asyncio
+from kjc_cli import config, http_client, outbox
 from kjc_cli.logger import get_logger
+from kjc_cli.ratelimit import AsyncTokenBucket
 from tenacity import retry, wait_exponential, stop_after_attempt
 import os
 import time
@@ -19,20 +20,23 @@ def create_product_reply_text(product):
     return f"🛍️ {product['title']}\n💵 {product['price']}\n🔗 {product['link']}"
 
 @retry(wait=wait_exponential(multiplier=1, min=2, max=10), stop=stop_after_attempt(3))
-def post_to_zapier(webhook_url, text, image_urls=None, product=None):
+def post_to_zapier(webhook_url, text, image_urls=None, product=None, idempotency_key=None):
     """
     Post to Threads via Zapier webhook.
     image_urls: List of publicly accessible image URLs
     product: Product info for reply (if needed)
+    idempotency_key: Stable key the Zap can use to drop re-deliveries (outbox items)
     """
     payload = {"text": text}
     if image_urls:
         payload["image_urls"] = image_urls
     if product:
         payload["product"] = product
+    if idempotency_key:
+        payload["idempotency_key"] = idempotency_key
 
     try:
-        response = requests.post(webhook_url, json=payload, timeout=20)
+        response = http_client.post(webhook_url, json=payload, timeout=20)
         response.raise_for_status()
         logger.info(f"Successfully posted to Zapier: {response.text}")
         return response.json()
@@ -58,7 +62,7 @@ def post_to_threads_with_reply(post, threads_id):
         reply_text = create_product_reply_text(product)
         text += f"\n\n{reply_text}"
 
-    return post_to_zapier(webhook_url, text, image_urls, product)
+    return post_to_zapier(webhook_url, text, image_urls, product, post.get("idempotency_key"))
 
 def run_post_many(posts, threads_id):
     """
@@ -86,6 +90,7 @@ def run_post_many(posts, threads_id):
 
     success_count = sum(1 for r in results if "error" not in r)
     logger.info(f"Completed: {success_count}/{len(posts)} posts successful for {threads_id}")
+    http_client.log_latency_stats()
 
     return results
 
@@ -98,3 +103,59 @@ def run_post_many_to_all_threads(posts):
     for threads_id, webhook_url in THREADS_WEBHOOKS.items():
         all_results[threads_id] = run_post_many(posts, threads_id)
     return all_results
+
+def _latency_summary(latencies_ms, wall_s):
+    ordered = sorted(latencies_ms)
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered), 1) if ordered else None,
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))], 1) if ordered else None,
+        "max_ms": round(ordered[-1], 1) if ordered else None,
+        "wall_s": round(wall_s, 2),
+    }
+
+async def _fan_out_account(posts, threads_id, semaphore):
+    """Post to one webhook in order, paced by its own token bucket"""
+    bucket = AsyncTokenBucket(config.ZAPIER_WEBHOOK_RATE, config.ZAPIER_WEBHOOK_BURST)
+    results = []
+    latencies = []
+    started = time.perf_counter()
+    for i, p in enumerate(posts, 1):
+        await bucket.acquire()
+        async with semaphore:
+            t0 = time.perf_counter()
+            try:
+                logger.info(f"[{threads_id}] Posting {i}/{len(posts)}: {p['text'][:100]}...")
+                results.append(await asyncio.to_thread(post_to_threads_with_reply, p, threads_id))
+            except Exception as e:
+                logger.exception(f"[{threads_id}] Posting failed for post {i}", exc_info=e)
+                results.append({"error": str(e), "post": p})
+            latencies.append((time.perf_counter() - t0) * 1000)
+    
+    success_count = sum(1 for r in results if "error" not in r)
+    logger.info(f"Completed: {success_count}/{len(posts)} posts successful for {threads_id}")
+    return {"results": results, "latency": _latency_summary(latencies, time.perf_counter() - started)}
+
+async def _fan_out(posts, webhooks):
+    semaphore = asyncio.Semaphore(config.ZAPIER_MAX_CONCURRENCY)
+    threads_ids = list(webhooks)
+    outcomes = await asyncio.gather(*(_fan_out_account(posts, tid, semaphore) for tid in threads_ids))
+    return dict(zip(threads_ids, outcomes))
+
+def run_fan_out(posts):
+    """
+    Post to all configured Threads IDs concurrently.
+    Each webhook gets its own rate limit (zapier.webhook_rate) and posts in
+    order; zapier.max_concurrency caps requests in flight across accounts.
+    Returns {threads_id: {"results": [...], "latency": {...}}}.
+    """
+    logger.info(f"Fanning out {len(posts)} posts to {len(THREADS_WEBHOOKS)} Threads accounts")
+    started = time.perf_counter()
+    all_results = asyncio.run(_fan_out(posts, THREADS_WEBHOOKS))
+    logger.info(f"Fan-out finished in {time.perf_counter() - started:.1f}s")
+    http_client.log_latency_stats()
+    return all_results
+
+def drain_outbox(threads_id):
+    """Post everything queued for a Threads ID (channel zapier:<threads_id>) in the outbox"""
+    return outbox.drain(f"zapier:{threads_id}", lambda posts: run_post_many(posts, threads_id))
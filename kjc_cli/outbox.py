@@ -0,0 +1,171 @@
+"""
+Durable posting outbox backed by SQLite.
+
+content_assembler enqueues each post once per channel ("buffer",
+"zapier:<THREADS_ID>"), keyed by an idempotency key derived from the
+channel, payload and the run that enqueued it, so re-enqueueing the same
+batch within a run (a resume) is a no-op while a later run with identical
+content enqueues (and posts) it again. Posters
+drain their channel in batches: items are marked inflight (committed)
+before they are sent and done/failed after, one commit per batch. Items
+left inflight by a crash are picked up again once their claim is older
+than OUTBOX_LEASE_SECONDS, i.e. delivery is at-least-once and resumes from
+the last acknowledged item, while concurrent drains never take over each
+other's live batches. Sends that were skipped rather than delivered (no
+credentials, dry run) leave the item pending.
+"""
+
+import hashlib
+import json
+import sqlite3
+import time
+from contextlib import closing
+from kjc_cli import config
+from kjc_cli.logger import get_logger
+
+logger = get_logger("outbox")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    idempotency_key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    UNIQUE (channel, idempotency_key)
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_channel_status ON outbox (channel, status, id);
+"""
+
+def _connect(db_path=None):
+    db_path = db_path or config.OUTBOX_DB
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+def idempotency_key(channel, payload, scope=None):
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    prefix = f"{channel}\n{scope}" if scope else channel
+    return hashlib.sha256(f"{prefix}\n{canonical}".encode("utf-8")).hexdigest()
+
+def enqueue(channel, payloads, db_path=None, scope=None):
+    """
+    Add payloads to a channel in one transaction; payloads already queued
+    under the same scope (e.g. a run ID) are ignored. Returns the number added.
+    """
+    now = time.time()
+    rows = [
+        (channel, idempotency_key(channel, p, scope), json.dumps(p, ensure_ascii=False, default=str), now, now)
+        for p in payloads
+    ]
+    with closing(_connect(db_path)) as conn, conn:
+        before = conn.total_changes
+        conn.executemany(
+            "INSERT OR IGNORE INTO outbox (channel, idempotency_key, payload, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+        added = conn.total_changes - before
+    logger.info(f"Enqueued {added}/{len(rows)} items to outbox channel {channel}")
+    return added
+
+# Results of sends that did not happen (e.g. {"status": "skipped", "reason": "no-token"})
+SKIPPED_STATUSES = ("skipped", "dry-run")
+
+def delivered(result):
+    """True for a result that reports a positive send (not an error, not a skipped/dry-run send)"""
+    if not isinstance(result, dict):
+        return result is not None
+    return "error" not in result and result.get("status") not in SKIPPED_STATUSES
+
+def _claim(conn, channel, limit, after_id=0, lease_seconds=None):
+    """
+    Mark the next batch inflight and return it. Items another drain left
+    inflight are only taken over once their claim is older than the lease.
+    """
+    lease_seconds = config.OUTBOX_LEASE_SECONDS if lease_seconds is None else lease_seconds
+    now = time.time()
+    # BEGIN IMMEDIATE: concurrent drains serialize here, so a row is claimed by one of them
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute(
+            "SELECT id, idempotency_key, payload FROM outbox "
+            "WHERE channel = ? AND id > ? AND (status = 'pending' OR (status = 'inflight' AND updated_at < ?)) "
+            "ORDER BY id LIMIT ?",
+            (channel, after_id, now - lease_seconds, limit),
+        ).fetchall()
+        conn.executemany(
+            "UPDATE outbox SET status = 'inflight', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+            [(now, row[0]) for row in rows],
+        )
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return rows
+
+def drain(channel, send_batch, batch_size=None, max_attempts=None, db_path=None):
+    """
+    Deliver a channel's pending items. send_batch(payloads) must return one
+    result per payload (a dict with an "error" key marks a failed send, one
+    with a "skipped"/"dry-run" status a send that did not happen); each
+    payload carries its "idempotency_key". Only delivered items are marked
+    done. Failed items go back to pending until max_attempts, then are
+    parked as failed; skipped items go back to pending without using up an
+    attempt. Returns the results of this drain, in queue order.
+    """
+    batch_size = batch_size or config.OUTBOX_BATCH_SIZE
+    max_attempts = max_attempts or config.OUTBOX_MAX_ATTEMPTS
+    results = []
+    last_id = 0
+    with closing(_connect(db_path)) as conn:
+        while True:
+            # Claim strictly after the previous batch, so items that failed in this drain wait for the next one
+            rows = _claim(conn, channel, batch_size, after_id=last_id)
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            payloads = [{**json.loads(payload), "idempotency_key": key} for _, key, payload in rows]
+            batch_results = send_batch(payloads)
+            
+            now = time.time()
+            done, failed, skipped = [], [], []
+            for (row_id, _, _), result in zip(rows, batch_results):
+                if isinstance(result, dict) and "error" in result:
+                    failed.append((max_attempts, str(result["error"]), now, row_id))
+                elif delivered(result):
+                    done.append((json.dumps(result, ensure_ascii=False, default=str), now, row_id))
+                else:
+                    skipped.append((now, row_id))
+            with conn:
+                conn.executemany("UPDATE outbox SET status = 'done', result = ?, last_error = NULL, updated_at = ? WHERE id = ?", done)
+                conn.executemany(
+                    "UPDATE outbox SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                    "last_error = ?, updated_at = ? WHERE id = ?",
+                    failed,
+                )
+                conn.executemany("UPDATE outbox SET status = 'pending', attempts = attempts - 1, updated_at = ? WHERE id = ?", skipped)
+            results.extend(batch_results)
+            logger.info(f"Outbox {channel}: {len(done)} sent, {len(failed)} failed, {len(skipped)} skipped in batch of {len(rows)}")
+    return results
+
+def stats(channel=None, db_path=None):
+    """Item counts per (channel, status)"""
+    with closing(_connect(db_path)) as conn:
+        query = "SELECT channel, status, COUNT(*) FROM outbox"
+        params = ()
+        if channel:
+            query += " WHERE channel = ?"
+            params = (channel,)
+        rows = conn.execute(query + " GROUP BY channel, status", params).fetchall()
+    out = {}
+    for ch, status, n in rows:
+        out.setdefault(ch, {})[status] = n
+    return out
@@ -3,6 +3,12 @@ Pipeline orchestrator for KJC Threads Automation
 This module holds the main workflow logic (used by both CLI and scheduler)
 """
 
+import json
+import queue
+import threading
+from contextlib import closing
+from pathlib import Path
+from kjc_cli import config, instrumentation, outbox, runs
 from kjc_cli.logger import get_logger
 from kjc_cli.modules import (
     background_collector,
@@ -14,22 +20,390 @@ from kjc_cli.modules import (
     zapier_poster,
     monitor,
 )
+from kjc_cli.modules.product_catalog import ProductCatalog
 
 logger = get_logger("pipeline")
 
-def run_pipeline():
-    """Run the full pipeline once"""
-    logger.info("Starting full run of KJC Threads Automation pipeline")
+# Cancel events of runs in progress, so the scheduler can stop them on shutdown
+_ACTIVE_RUNS = set()
+
+def run_pipeline(run_id=None, resume_latest=False):
+    """
+    Run the full pipeline once, checkpointing each stage's outputs under RUNS_DIR/<run-id>.
+    run_id resumes that run; resume_latest (used by the scheduler) resumes the newest
+    incomplete run if there is one worth resuming, else starts a new run.
+    """
+    if run_id is None and resume_latest:
+        run_id = runs.latest_incomplete()
+    checkpoint = runs.RunCheckpoint.load(run_id) if run_id else runs.RunCheckpoint.create()
+    instrumentation.reset()
+    try:
+        if config.PIPELINE_MODE == "sequential":
+            return run_pipeline_sequential(checkpoint)
+        return run_pipeline_streaming(checkpoint)
+    finally:
+        instrumentation.write_report(
+            checkpoint.run_id,
+            attempt=checkpoint.data["attempts"],
+            mode=config.PIPELINE_MODE,
+            status=checkpoint.data["status"],
+            error=checkpoint.data["error"],
+        )
+
+def _collect_backgrounds(checkpoint, **kwargs):
+    if checkpoint.is_done("collect"):
+        logger.info("Backgrounds already collected in this run, skipping collection")
+        return
+    paths = background_collector.run_collect(**kwargs)
+    stop = kwargs.get("stop")
+    if stop is not None and stop.is_set():
+        raise PipelineCancelled()
+    checkpoint.complete_stage("collect", backgrounds=[str(p) for p in paths])
+
+def _generate_hooks(checkpoint):
+    if checkpoint.is_done("generate"):
+        hooks = checkpoint.stage("generate")["hooks"]
+        logger.info(f"Reusing {len(hooks)} hooks generated earlier in this run")
+        return hooks
+    hooks = hook_generator.run_generate()
+    checkpoint.complete_stage("generate", hooks=hooks)
+    return hooks
+
+def run_pipeline_sequential(checkpoint):
+    """Run the stages one after another, each on the previous stage's complete output"""
+    logger.info(f"Starting full run {checkpoint.run_id} of KJC Threads Automation pipeline")
     try:
-        background_collector.run_collect()
-        hooks = hook_generator.run_generate()
+        with instrumentation.stage("collect") as span:
+            if not checkpoint.is_done("collect"):
+                _collect_backgrounds(checkpoint)
+                span["bytes_in"] = background_collector.DOWNLOAD_STATS.get("bytes_downloaded", 0)
+            backgrounds = checkpoint.stage("collect").get("backgrounds", [])
+            span["items"] = len(backgrounds)
+            span["bytes_out"] = sum(instrumentation.file_size(p) for p in backgrounds)
+        with instrumentation.stage("generate") as span:
+            hooks = _generate_hooks(checkpoint)
+            span["items"] = len(hooks)
+            span["bytes_out"] = sum(len(h.encode("utf-8")) for h in hooks)
         # products = product_importer.run_import()
-        composed_images = image_composer.run_compose(hooks)
-        # posts = content_assembler.run_assemble(hooks, composed_images, products)
+        if not checkpoint.is_done("compose"):
+            with instrumentation.stage("compose") as span:
+                # run_compose reuses every image already composed (manifest keys), so a resumed run only renders the rest
+                composed_images = image_composer.run_compose(hooks, backgrounds=checkpoint.stage("collect").get("backgrounds"))
+                checkpoint.complete_stage("compose", images=composed_images)
+                span["items"] = len(composed_images)
+                span["bytes_in"] = sum(len(h.encode("utf-8")) for h in hooks)
+                span["bytes_out"] = sum(instrumentation.file_size(p) for p in composed_images)
+        # posts = content_assembler.run_assemble(hooks, composed_images, products, run_id=checkpoint.run_id)
         #buffer_poster.run_post_many(posts)
         #zapier_poster.run_post_many(posts)
-        monitor.log_event("Full run completed", status="SUCCESS")
+        checkpoint.finish("completed")
+        monitor.log_event(f"Full run {checkpoint.run_id} completed", status="SUCCESS")
         logger.info("Full run completed successfully.")
     except Exception as e:
-        monitor.log_event(f"Run failed: {e}", status="ERROR")
+        checkpoint.finish("failed", str(e))
+        monitor.log_event(f"Run {checkpoint.run_id} failed: {e}", status="ERROR")
         logger.exception("Pipeline failed")
+
+def cancel_running():
+    """Ask every streaming run in progress to stop (stages finish their current item and exit)"""
+    for cancel in list(_ACTIVE_RUNS):
+        cancel.set()
+
+class PipelineCancelled(Exception):
+    pass
+
+class _Channel:
+    """
+    Bounded queue between two stages; put() blocks when full (back-pressure)
+    and both ends honour cancellation. size(item) gives an item's bytes,
+    summed in .bytes (the producer's bytes out, the consumer's bytes in).
+    """
+
+    _DONE = object()
+
+    def __init__(self, maxsize, cancel: threading.Event, size=None):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.cancel = cancel
+        self.size = size
+        self.bytes = 0
+
+    def put(self, item):
+        while True:
+            if self.cancel.is_set():
+                raise PipelineCancelled()
+            try:
+                self.queue.put(item, timeout=0.2)
+                if self.size is not None and item is not self._DONE:
+                    self.bytes += self.size(item)
+                return
+            except queue.Full:
+                continue
+
+    def close(self):
+        try:
+            self.put(self._DONE)
+        except PipelineCancelled:
+            pass
+
+    def __iter__(self):
+        while True:
+            if self.cancel.is_set():
+                raise PipelineCancelled()
+            try:
+                item = self.queue.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            if item is self._DONE:
+                return
+            yield item
+
+class _BackgroundPool:
+    """
+    Backgrounds available to the compose stage: this run's backgrounds, each
+    added as the collector lands it (or those a resumed run already recorded).
+    get(i) blocks until a background for hook i exists or collection has
+    finished; a run that collected nothing falls back to the stored ones,
+    most recently fetched first.
+    """
+
+    def __init__(self, cancel: threading.Event, paths=None):
+        self.paths = [Path(p) for p in paths or [] if Path(p).exists()]
+        self.closed = False
+        self.cancel = cancel
+        self.bytes = 0
+        self._cond = threading.Condition()
+
+    def add(self, path):
+        with self._cond:
+            if path not in self.paths:
+                self.paths.append(path)
+                self.bytes += instrumentation.file_size(path)
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            if not self.paths:
+                try:
+                    self.paths = image_composer._get_backgrounds_sorted()
+                except FileNotFoundError:
+                    pass
+            self.closed = True
+            self._cond.notify_all()
+
+    def get(self, i):
+        with self._cond:
+            while len(self.paths) <= i and not self.closed:
+                if self.cancel.is_set():
+                    raise PipelineCancelled()
+                self._cond.wait(timeout=0.2)
+            if not self.paths:
+                raise FileNotFoundError(f"No background images in {image_composer.BG_DIR}. Add some images or use images.txt.")
+            return self.paths[i % len(self.paths)]
+
+def _drain_channel(channel):
+    if channel == "buffer":
+        return buffer_poster.drain_outbox()
+    if channel.startswith("zapier:"):
+        return zapier_poster.drain_outbox(channel.split(":", 1)[1])
+    logger.warning(f"No poster for outbox channel {channel}")
+    return []
+
+class StreamingPipeline:
+    """
+    Stage-overlapped run: collect and generate start together; each hook is
+    composed as soon as it and a background exist; each composed image is
+    assembled (and, when enabled, posted from the outbox) as soon as it is
+    ready. Stages run in threads connected by bounded queues. The first
+    failing stage cancels the others, and the error is re-raised by run().
+    Completed stages and items are recorded in the run checkpoint and
+    skipped when the run is resumed.
+    """
+
+    def __init__(self, checkpoint, cancel: threading.Event = None):
+        self.checkpoint = checkpoint
+        self.cancel = cancel or threading.Event()
+        self.errors = []
+        self.threads = []
+        size = config.PIPELINE_QUEUE_SIZE
+        self.backgrounds = _BackgroundPool(self.cancel, checkpoint.stage("collect").get("backgrounds"))
+        self.hooks = _Channel(size, self.cancel, size=lambda item: len(item[1].encode("utf-8")))
+        self.composed = _Channel(size, self.cancel, size=lambda item: instrumentation.file_size(item[2]))
+        self.posts = _Channel(size, self.cancel, size=lambda post: len(json.dumps(post, ensure_ascii=False, default=str).encode("utf-8")))
+        self.stats = {"backgrounds": 0, "hooks": 0, "composed": 0, "posts": 0, "posted": 0}
+        # Bytes a stage moves besides its channels (e.g. collect's downloads), added to its span
+        self.extra_bytes = {}
+
+    # Stage -> the stats counter reported as its item count
+    _STAGE_ITEMS = {"collect": "backgrounds", "generate": "hooks", "compose": "composed", "assemble": "posts", "post": "posted"}
+
+    def _stage(self, name, fn, *outputs, inputs=()):
+        """
+        Run fn in a thread under an instrumentation span: its items are the
+        stage's stats counter, its bytes in/out what it read from inputs and
+        wrote to outputs (channels or the background pool).
+        """
+        def _run():
+            try:
+                with instrumentation.stage(name) as span:
+                    try:
+                        fn()
+                    finally:
+                        extra_in, extra_out = self.extra_bytes.get(name, (0, 0))
+                        span["items"] = self.stats.get(self._STAGE_ITEMS.get(name), 0)
+                        span["bytes_in"] = extra_in + sum(c.bytes for c in inputs)
+                        span["bytes_out"] = extra_out + sum(c.bytes for c in outputs)
+                logger.info(f"Stage {name} finished")
+            except PipelineCancelled:
+                logger.info(f"Stage {name} cancelled")
+            except BaseException as e:
+                logger.exception(f"Stage {name} failed")
+                self.errors.append(e)
+                self.cancel.set()
+            finally:
+                for out in outputs:
+                    out.close()
+        t = threading.Thread(target=_run, name=f"pipeline-{name}", daemon=True)
+        self.threads.append(t)
+        t.start()
+
+    def _collect(self):
+        def _landed(path):
+            self.stats["backgrounds"] += 1
+            self.backgrounds.add(path)
+        if self.checkpoint.is_done("collect"):
+            return _collect_backgrounds(self.checkpoint)
+        try:
+            _collect_backgrounds(self.checkpoint, on_background=_landed, stop=self.cancel)
+        finally:
+            self.extra_bytes["collect"] = (background_collector.DOWNLOAD_STATS.get("bytes_downloaded", 0), 0)
+
+    def _generate(self):
+        for i, hook in enumerate(_generate_hooks(self.checkpoint)):
+            self.hooks.put((i, hook))
+            self.stats["hooks"] += 1
+
+    def _compose(self):
+        done = self.checkpoint.items("compose")
+
+        def _todo():
+            for i, hook in self.hooks:
+                if i in done and Path(done[i]).exists():
+                    self.composed.put((i, hook, done[i]))
+                    continue
+                yield i, hook
+
+        stream = image_composer.iter_compose(
+            _todo(),
+            self.backgrounds.get,
+            workers=config.PIPELINE_COMPOSE_WORKERS or None,
+            max_pending=config.PIPELINE_QUEUE_SIZE,
+        )
+        # closing(): the generator's own cleanup (process pool, manifest) runs even when this stage is cancelled
+        with closing(stream):
+            for i, hook, path in stream:
+                if path:
+                    self.checkpoint.record_item("compose", i, path)
+                    self.composed.put((i, hook, path))
+                    self.stats["composed"] += 1
+        self.checkpoint.complete_stage("compose")
+
+    def _assemble(self):
+        done = self.checkpoint.items("assemble")
+        order = []
+
+        def _pairs():
+            for i, hook, path in self.composed:
+                # Already assembled (and enqueued into the outbox) before the run was interrupted
+                if i in done:
+                    continue
+                order.append(i)
+                yield hook, path
+
+        # Diff the feed into the product index first: the catalog's update times (what pick() prefers fresh products by) come from it
+        for _ in product_importer.iter_changes():
+            pass
+        products = ProductCatalog.from_feed()
+        # One outbox enqueue per post: a post recorded as assembled is always already in the outbox
+        stream = content_assembler.iter_assemble_pairs(_pairs(), products, enqueue_batch=1, run_id=self.checkpoint.run_id)
+        with closing(stream):
+            for n, post in enumerate(stream):
+                self.checkpoint.record_item("assemble", order[n], post["text"])
+                self.posts.put(post)
+                self.stats["posts"] += 1
+        self.checkpoint.complete_stage("assemble")
+
+    def _post(self):
+        batch = 0
+        for _ in self.posts:
+            batch += 1
+            if batch >= config.PIPELINE_POST_BATCH:
+                self._drain()
+                batch = 0
+        # Final drain also delivers posts a previous attempt of this run enqueued but did not post
+        self._drain()
+        self.checkpoint.complete_stage("post")
+
+    def _drain(self):
+        for channel in config.OUTBOX_CHANNELS:
+            self.stats["posted"] += sum(1 for r in _drain_channel(channel) if outbox.delivered(r))
+
+    def _sink(self, channel):
+        def _run():
+            for _ in channel:
+                pass
+        return _run
+
+    def run(self):
+        # Collection only feeds the background pool; closing it unblocks compose once collection ends
+        self._stage("collect", self._collect, self.backgrounds)
+        self._stage("generate", self._generate, self.hooks)
+        self._stage("compose", self._compose, self.composed, inputs=(self.hooks,))
+        if config.PIPELINE_ASSEMBLE:
+            self._stage("assemble", self._assemble, self.posts, inputs=(self.composed,))
+            if config.PIPELINE_POST:
+                self._stage("post", self._post, inputs=(self.posts,))
+            else:
+                self._stage("posts-sink", self._sink(self.posts), inputs=(self.posts,))
+        else:
+            self._stage("composed-sink", self._sink(self.composed), inputs=(self.composed,))
+        try:
+            for t in self.threads:
+                # Short joins keep the main thread responsive to Ctrl-C
+                while t.is_alive():
+                    t.join(timeout=0.5)
+        except KeyboardInterrupt:
+            logger.warning("Interrupted, cancelling pipeline stages")
+            self.cancel.set()
+            for t in self.threads:
+                t.join()
+            raise
+        if self.errors:
+            raise self.errors[0]
+        if self.cancel.is_set():
+            raise PipelineCancelled()
+        return self.stats
+
+def run_pipeline_streaming(checkpoint):
+    """Run the full pipeline once with overlapping stages (see StreamingPipeline)"""
+    logger.info(f"Starting full run {checkpoint.run_id} of KJC Threads Automation pipeline (streaming)")
+    pipeline = StreamingPipeline(checkpoint)
+    _ACTIVE_RUNS.add(pipeline.cancel)
+    try:
+        stats = pipeline.run()
+        checkpoint.finish("completed")
+        monitor.log_event(f"Full run {checkpoint.run_id} completed", status="SUCCESS")
+        logger.info(f"Full run completed successfully: {stats}")
+    except PipelineCancelled:
+        checkpoint.finish("cancelled")
+        monitor.log_event(f"Run {checkpoint.run_id} cancelled", status="ERROR")
+        logger.warning(f"Pipeline cancelled; resume with: python main.py resume {checkpoint.run_id}")
+    except KeyboardInterrupt:
+        checkpoint.finish("cancelled")
+        logger.warning(f"Pipeline interrupted; resume with: python main.py resume {checkpoint.run_id}")
+        raise
+    except Exception as e:
+        checkpoint.finish("failed", str(e))
+        monitor.log_event(f"Run {checkpoint.run_id} failed: {e}", status="ERROR")
+        logger.exception(f"Pipeline failed; resume with: python main.py resume {checkpoint.run_id}")
+    finally:
+        _ACTIVE_RUNS.discard(pipeline.cancel)
@@ -0,0 +1,107 @@
+"""
+Asyncio rate limiting primitives shared by the collectors and posters.
+"""
+
+import asyncio
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+class AsyncTokenBucket:
+    """
+    Token bucket refilled at `rate` tokens/second up to `capacity`.
+    acquire() may overdraw the bucket; the caller then sleeps until the debt
+    is repaid, so requests larger than the capacity (e.g. big byte chunks)
+    are still shaped to the average rate. A rate <= 0 disables limiting.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(self.rate, 1))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1):
+        if self.rate <= 0 and self._paused_until <= time.monotonic():
+            return
+        async with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._paused_until - now)
+            if self.rate > 0:
+                self._refill(now)
+                self._tokens -= tokens
+                if self._tokens < 0:
+                    wait = max(wait, -self._tokens / self.rate)
+        if wait:
+            await asyncio.sleep(wait)
+
+    def penalize(self, seconds: float):
+        """Hold every acquirer for `seconds` (e.g. after a 429 with Retry-After)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+class AsyncWeightedSemaphore:
+    """Semaphore over a budget of units (e.g. bytes in flight) rather than slots"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._in_use = 0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self, amount: int):
+        """Reserve amount units (capped at the limit so one large item can always proceed)"""
+        if self.limit <= 0:
+            return 0
+        amount = min(amount, self.limit)
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._in_use + amount <= self.limit)
+            self._in_use += amount
+        return amount
+
+    async def release(self, amount: int):
+        if self.limit <= 0 or not amount:
+            return
+        async with self._cond:
+            self._in_use -= amount
+            self._cond.notify_all()
+
+class AdaptiveTokenBucket(AsyncTokenBucket):
+    """
+    Token bucket that backs off when the server pushes back: throttled()
+    halves the rate (down to min_rate) and pauses for Retry-After, and every
+    succeeded() call recovers a little of the configured rate (AIMD).
+    """
+
+    def __init__(self, rate: float, capacity: float = None, min_rate: float = None, recovery: float = 0.05):
+        super().__init__(rate, capacity)
+        self.base_rate = self.rate
+        self.min_rate = min_rate if min_rate is not None else self.rate / 16
+        self.recovery = recovery
+
+    def throttled(self, retry_after: float = None):
+        if self.rate > 0:
+            self.rate = max(self.min_rate, self.rate / 2)
+        if retry_after:
+            self.penalize(retry_after)
+
+    def succeeded(self):
+        if 0 < self.rate < self.base_rate:
+            self.rate = min(self.base_rate, self.rate + self.base_rate * self.recovery)
+
+def parse_retry_after(value, default: float = None):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)"""
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except Exception:
+        return default
@@ -0,0 +1,140 @@
+"""
+Run IDs and per-run checkpoint manifests.
+
+Every pipeline run gets an ID and a manifest at RUNS_DIR/<run-id>/manifest.json
+recording each stage's completed outputs (stored backgrounds, the generated
+hooks, composed images and assembled posts per hook index). A resumed run
+skips finished stages and items and continues from the last completed item.
+The manifest is rewritten atomically after every recorded item, so a crash
+loses at most the item in progress.
+"""
+
+import json
+import secrets
+import threading
+import time
+from datetime import datetime
+from kjc_cli import config
+from kjc_cli.logger import get_logger
+from kjc_cli.utils import save_json_atomic
+
+logger = get_logger("runs")
+
+STAGES = ("collect", "generate", "compose", "assemble", "post")
+
+def new_run_id():
+    return f"{datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}-{secrets.token_hex(3)}"
+
+def _manifest_path(run_id):
+    return config.RUNS_DIR / run_id / "manifest.json"
+
+def _read(path):
+    with open(path, "r", encoding="utf-8") as fh:
+        return json.load(fh)
+
+class RunCheckpoint:
+    """A run's manifest: status, attempts and per-stage progress"""
+
+    def __init__(self, data):
+        self.data = data
+        self._lock = threading.Lock()
+
+    @property
+    def run_id(self):
+        return self.data["run_id"]
+
+    @property
+    def path(self):
+        return _manifest_path(self.run_id)
+
+    @classmethod
+    def create(cls):
+        now = time.time()
+        cp = cls({
+            "run_id": new_run_id(),
+            "status": "running",
+            "attempts": 1,
+            "created_at": now,
+            "updated_at": now,
+            "error": None,
+            "stages": {name: {"done": False} for name in STAGES},
+        })
+        cp.save()
+        logger.info(f"Started run {cp.run_id}")
+        return cp
+
+    @classmethod
+    def load(cls, run_id):
+        """Open an existing run for resuming; raises FileNotFoundError for unknown IDs"""
+        cp = cls(_read(_manifest_path(run_id)))
+        cp.data["attempts"] = cp.data.get("attempts", 1) + 1
+        cp.data["status"] = "running"
+        cp.save()
+        logger.info(f"Resuming run {run_id} (attempt {cp.data['attempts']}, done: {cp.done_stages()})")
+        return cp
+
+    def save(self):
+        self.data["updated_at"] = time.time()
+        save_json_atomic(self.path, self.data)
+
+    def stage(self, name):
+        return self.data["stages"].setdefault(name, {"done": False})
+
+    def done_stages(self):
+        return [name for name, s in self.data["stages"].items() if s.get("done")]
+
+    def is_done(self, name):
+        return bool(self.stage(name).get("done"))
+
+    def complete_stage(self, name, **outputs):
+        with self._lock:
+            self.stage(name).update(outputs, done=True)
+            self.save()
+
+    def items(self, name):
+        """index (int) -> recorded output for a per-item stage"""
+        return {int(k): v for k, v in self.stage(name).get("items", {}).items()}
+
+    def record_item(self, name, index, output):
+        with self._lock:
+            self.stage(name).setdefault("items", {})[str(index)] = output
+            self.save()
+
+    def finish(self, status, error=None):
+        with self._lock:
+            self.data["status"] = status
+            self.data["error"] = error
+            self.save()
+        logger.info(f"Run {self.run_id} {status}")
+
+def list_runs():
+    """Manifests of all runs, newest first"""
+    runs = []
+    for path in config.RUNS_DIR.glob("*/manifest.json"):
+        try:
+            runs.append(_read(path))
+        except Exception as e:
+            logger.debug(f"Skipping unreadable run manifest {path}: {e}")
+    runs.sort(key=lambda r: r.get("created_at", 0), reverse=True)
+    return runs
+
+def latest_incomplete():
+    """
+    ID of the newest run if it did not complete and is still worth resuming:
+    created within RUNS_RESUME_WINDOW seconds and tried fewer than
+    RUNS_MAX_ATTEMPTS times; a stale or exhausted one is marked abandoned.
+    Only the newest run is considered: a later run supersedes earlier ones.
+    """
+    now = time.time()
+    for data in list_runs():
+        if data.get("status") == "abandoned":
+            continue
+        if data.get("status") == "completed":
+            return None
+        too_old = now - data.get("created_at", 0) > config.RUNS_RESUME_WINDOW
+        exhausted = data.get("attempts", 1) >= config.RUNS_MAX_ATTEMPTS
+        if too_old or exhausted:
+            RunCheckpoint(data).finish("abandoned", data.get("error"))
+            return None
+        return data["run_id"]
+    return None
@@ -8,9 +8,10 @@ from kjc_cli.logger import get_logger
 logger = get_logger("scheduler")
 
 class Scheduler:
-    def __init__(self, job_func):
-        """Accepts a callable (like run_pipeline) to execute on schedule"""
+    def __init__(self, job_func, cancel_func=None):
+        """Accepts a callable (like run_pipeline) to execute on schedule, and optionally one that stops a running job"""
         self.job_func = job_func
+        self.cancel_func = cancel_func
         self.scheduler = BackgroundScheduler()
 
         # Parse cron string (minute hour day month dow)
@@ -37,7 +38,12 @@ class Scheduler:
     def wait_forever(self):
         def _handle(sig, frame):
             logger.info("Shutting down scheduler gracefully...")
-            self.scheduler.shutdown(wait=False)
+            if self.cancel_func:
+                # Let a running job stop its stages and clean up before exiting
+                self.cancel_func()
+                self.scheduler.shutdown(wait=True)
+            else:
+                self.scheduler.shutdown(wait=False)
             raise SystemExit(0)
         signal.signal(signal.SIGINT, _handle)
         signal.signal(signal.SIGTERM, _handle)
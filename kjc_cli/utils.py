@@ -1,4 +1,8 @@
+import hashlib
 import json
+import os
+import time
+from datetime import datetime
 from pathlib import Path
 from kjc_cli import config
 
@@ -6,3 +10,125 @@ def save_json(dest: Path, obj):
     dest.parent.mkdir(parents=True, exist_ok=True)
     with open(dest, "w", encoding="utf-8") as fh:
         json.dump(obj, fh, ensure_ascii=False, indent=2)
+
+def save_json_atomic(dest: Path, obj, fsync=True):
+    """Compact save_json: written to a temp file in the same directory, then renamed over dest, so readers never see a partial file"""
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dest.with_name(f"{dest.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(obj, fh, ensure_ascii=False, separators=(",", ":"))
+            if fsync:
+                fh.flush()
+                os.fsync(fh.fileno())
+        os.replace(tmp, dest)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+class JsonlWriter:
+    """
+    Append-only JSONL writer. Each record is one write() of a complete line,
+    flushed immediately so concurrent readers see it; fsync policy is
+    "always" (every line), "batch" (every fsync_every lines and on close)
+    or "never". With rotate=True an existing file is first renamed to
+    <stem>.<timestamp><suffix> (keeping the newest keep_rotated of those), so
+    each writer starts a fresh file.
+    """
+
+    def __init__(self, path: Path, fsync="batch", fsync_every=50, rotate=True, keep_rotated=5):
+        self.path = Path(path)
+        self.fsync = fsync
+        self.fsync_every = max(1, fsync_every)
+        self.count = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if rotate:
+            self._rotate(keep_rotated)
+        self._fh = open(self.path, "a", encoding="utf-8")
+
+    def _rotate(self, keep):
+        if self.path.exists() and self.path.stat().st_size:
+            stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+            os.replace(self.path, self.path.with_name(f"{self.path.stem}.{stamp}{self.path.suffix}"))
+        rotated = sorted(self.path.parent.glob(f"{self.path.stem}.*{self.path.suffix}"))
+        for old in rotated[:max(0, len(rotated) - keep)]:
+            old.unlink(missing_ok=True)
+
+    def write(self, record):
+        self._fh.write(json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=str) + "\n")
+        self._fh.flush()
+        self.count += 1
+        if self.fsync == "always" or (self.fsync == "batch" and self.count % self.fsync_every == 0):
+            os.fsync(self._fh.fileno())
+
+    def close(self):
+        if self._fh.closed:
+            return
+        self._fh.flush()
+        if self.fsync != "never":
+            os.fsync(self._fh.fileno())
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def read_jsonl(path: Path, offset=0):
+    """Complete records from byte offset on, plus the offset to resume from; a partially written last line is left for the next call"""
+    records = []
+    try:
+        fh = open(path, "rb")
+    except FileNotFoundError:
+        return records, offset
+    with fh:
+        fh.seek(offset)
+        for line in fh:
+            if not line.endswith(b"\n"):
+                break
+            offset += len(line)
+            if line.strip():
+                records.append(json.loads(line))
+    return records, offset
+
+def follow_jsonl(path: Path, is_done, poll_interval=0.2):
+    """Yield records as a JsonlWriter appends them, until is_done() and everything written has been read"""
+    offset = 0
+    while True:
+        done = is_done()
+        records, offset = read_jsonl(path, offset)
+        yield from records
+        if done and not records:
+            return
+        if not records:
+            time.sleep(poll_interval)
+
+IMAGE_MIME_TYPES = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".webp": "image/webp",
+    ".gif": "image/gif",
+}
+
+def guess_image_mime(path):
+    """MIME type for an image path, based on its extension"""
+    return IMAGE_MIME_TYPES.get(Path(path).suffix.lower(), "application/octet-stream")
+
+# (path, mtime_ns, size) -> hex digest, so unchanged files are hashed once per process
+_DIGEST_MEMO = {}
+
+def file_sha256(path: Path, chunk_size=1 << 20):
+    """Return the sha256 hex digest of a file's contents"""
+    path = Path(path)
+    st = path.stat()
+    key = (str(path), st.st_mtime_ns, st.st_size)
+    digest = _DIGEST_MEMO.get(key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(chunk_size), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        _DIGEST_MEMO[key] = digest
+    return digest
@@ -1,23 +1,52 @@
 #!/usr/bin/env python3
 import typer
-from kjc_cli import config as cfg
+from functools import partial
+from kjc_cli import config as cfg, instrumentation
 from kjc_cli.logger import get_logger
 from kjc_cli.scheduler import Scheduler
-from kjc_cli.pipeline import run_pipeline  # 👈 new import
+from kjc_cli.pipeline import cancel_running, run_pipeline  # 👈 new import
 
 app = typer.Typer()
 logger = get_logger("main")
 
 @app.command()
-def run_all():
+def run_all(profile: bool = typer.Option(False, "--profile", help="Profile every pipeline thread with cProfile and write data/reports/profile_<time>.prof")):
     """Run the full automation pipeline once"""
-    run_pipeline()
+    if not profile:
+        run_pipeline()
+        return
+    instrumentation.enable_profiling()
+    try:
+        with instrumentation.profiled():
+            run_pipeline()
+    finally:
+        path = instrumentation.write_profile()
+        if path:
+            typer.echo(f"Profile written to {path} (inspect with: python -m pstats {path})")
+
+@app.command()
+def resume(run_id: str):
+    """Resume an interrupted or failed run from its last completed item"""
+    if not (cfg.RUNS_DIR / run_id / "manifest.json").exists():
+        typer.echo(f"Unknown run {run_id}; runs are in {cfg.RUNS_DIR}")
+        raise typer.Exit(1)
+    run_pipeline(run_id=run_id)
+
+@app.command()
+def encoder_report():
+    """Compare PNG/JPEG/WebP encoder settings on a sample composed image"""
+    from kjc_cli.modules import image_composer
+    report = image_composer.encoder_report()
+    for row in report["results"]:
+        psnr = row["psnr_db"] if row["psnr_db"] is not None else "lossless"
+        typer.echo(f"{row['label']:<28} {row['bytes']:>10} bytes {row['encode_ms']:>8} ms  PSNR {psnr}")
 
 @app.command()
 def schedule():
     """Start the cron-based scheduler"""
     logger.info("Starting scheduler...")
-    s = Scheduler(run_pipeline)   # pass function reference
+    # Each scheduled run first resumes the newest incomplete run, if any
+    s = Scheduler(partial(run_pipeline, resume_latest=True), cancel_func=cancel_running)   # pass function reference
     s.start()
     s.wait_forever()
 
@@ -0,0 +1,40 @@
+"""
+background_collector._evict: which stored backgrounds go, and that the
+composer's normalized copies go with them.
+"""
+
+import os
+from types import SimpleNamespace
+
+from kjc_cli.modules import background_collector, image_composer
+from kjc_cli.utils import file_sha256
+
+
+class _Discarded:
+    def __init__(self):
+        self.names = set()
+
+    def discard(self, names):
+        self.names |= set(names)
+
+
+def test_evicts_oldest_backgrounds_and_their_derivatives(monkeypatch, tmp_path):
+    store, cache = tmp_path / "backgrounds", tmp_path / "cache"
+    store.mkdir()
+    cache.mkdir()
+    monkeypatch.setattr(image_composer, "BG_CACHE_DIR", cache)
+    for age, name in enumerate(["newest.jpg", "older.png", "oldest.gif"]):
+        path = store / name
+        path.write_bytes(name.encode("utf-8"))
+        os.utime(path, (1_000_000 - age, 1_000_000 - age))
+        (cache / f"{file_sha256(path)}_1080x1350.png").write_bytes(b"normalized")
+    newest = store / "newest.jpg"
+    ctx = SimpleNamespace(index={"https://img/gif": {"file": "oldest.gif"}}, phash_index=_Discarded())
+
+    evicted = background_collector._evict(store, ctx, keep=[], max_stored=1)
+
+    assert sorted(evicted) == ["older.png", "oldest.gif"]
+    assert [p.name for p in background_collector._stored_backgrounds(store)] == ["newest.jpg"]
+    assert [p.name for p in cache.iterdir()] == [f"{file_sha256(newest)}_1080x1350.png"]
+    assert ctx.index == {}
+    assert ctx.phash_index.names == {"older.png", "oldest.gif"}
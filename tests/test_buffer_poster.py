@@ -0,0 +1,66 @@
+"""
+buffer_poster._BufferEngine.call retry policy: creates are only retried
+when the post cannot exist yet (429, connect failures).
+"""
+
+import asyncio
+
+import pytest
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+from kjc_cli.modules import buffer_poster
+
+
+def _http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    response.headers["Retry-After"] = "0"
+    return requests.HTTPError(f"{status}", response=response)
+
+
+def _refused():
+    return requests.ConnectionError(MaxRetryError(None, "/1/updates/create.json", NewConnectionError(None, "refused")))
+
+
+def _calls(endpoint, *errors):
+    """Number of attempts call() makes when the first attempts raise errors (then the request succeeds)"""
+    engine = buffer_poster._BufferEngine(
+        concurrency=1,
+        rate_limits={"create": {"rate": 100, "burst": 10}, "upload": {"rate": 100, "burst": 10}},
+        max_attempts=3,
+    )
+    attempts = []
+
+    def send():
+        attempts.append(1)
+        if len(attempts) <= len(errors):
+            raise errors[len(attempts) - 1]
+        return {"id": "update-1"}
+
+    try:
+        asyncio.run(engine.call(endpoint, send))
+    except (requests.HTTPError, requests.ConnectionError, requests.Timeout):
+        pass
+    return len(attempts)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    real_sleep = asyncio.sleep
+    monkeypatch.setattr(buffer_poster.asyncio, "sleep", lambda delay: real_sleep(0))
+
+
+@pytest.mark.parametrize("error", [requests.ReadTimeout("read"), _http_error(503), requests.ConnectionError("aborted")])
+def test_create_is_not_retried_once_it_may_have_been_sent(error):
+    assert _calls("create", error) == 1
+
+
+@pytest.mark.parametrize("error", [_http_error(429), requests.ConnectTimeout("connect"), _refused()])
+def test_create_is_retried_when_nothing_was_sent(error):
+    assert _calls("create", error) == 2
+
+
+@pytest.mark.parametrize("error", [requests.ReadTimeout("read"), _http_error(503)])
+def test_upload_retries_transient_errors(error):
+    assert _calls("upload", error) == 2
@@ -0,0 +1,175 @@
+"""
+hook_generator against a local stub of the Gemini and OpenAI APIs
+(GEMINI_API_BASE / OPENAI_API_BASE point at it): batching, the reply
+cache, failover on 429/5xx and the template fallback.
+"""
+
+import asyncio
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import pytest
+
+from kjc_cli import config, hook_store
+from kjc_cli.modules import hook_generator, hook_novelty
+
+
+class StubLLM:
+    """
+    Both providers on one server. status[provider] is the HTTP status to
+    answer with (200 = a JSON array of as many hooks as the prompt asks for);
+    every request is recorded as (provider, prompt).
+    """
+
+    def __init__(self, delay=0.0):
+        self.status = {"gemini": 200, "openai": 200}
+        self.delay = delay
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._served = 0
+
+    def reply(self, provider, prompt):
+        with self._lock:
+            self.requests.append((provider, prompt))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            status = self.status[provider]
+            if status != 200:
+                return status, {"error": {"code": status}}
+            n = int(re.search(r"Write (\d+) ", prompt).group(1))
+            with self._lock:
+                start = self._served
+                self._served += n
+            text = json.dumps([f"{provider} stub hook number {start + i}" for i in range(n)])
+            if provider == "gemini":
+                return 200, {"candidates": [{"content": {"parts": [{"text": text}]}}]}
+            return 200, {"choices": [{"message": {"content": text}}]}
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def count(self, provider):
+        return sum(1 for p, _ in self.requests if p == provider)
+
+
+@pytest.fixture
+def llm(monkeypatch, tmp_path):
+    stub = StubLLM()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            path = urlsplit(self.path).path
+            if path.startswith("/gemini/"):
+                status, payload = stub.reply("gemini", body["contents"][0]["parts"][0]["text"])
+            else:
+                status, payload = stub.reply("openai", body["messages"][0]["content"])
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    monkeypatch.setattr(config, "GEMINI_API_BASE", f"{base}/gemini")
+    monkeypatch.setattr(config, "OPENAI_API_BASE", f"{base}/openai")
+    monkeypatch.setattr(config, "GEMINI_API_KEY", "test-key")
+    monkeypatch.setattr(config, "OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(config, "HOOKS_PROVIDERS", ["gemini", "openai"])
+    monkeypatch.setattr(config, "HOOKS_BATCH_SIZE", 5)
+    monkeypatch.setattr(config, "HOOKS_MAX_PARALLEL", 4)
+    monkeypatch.setattr(config, "HOOKS_CATEGORIES", [])
+    monkeypatch.setattr(config, "HOOKS_DB", tmp_path / "hooks.sqlite3")
+    monkeypatch.setattr(config, "HOOKS_DIR", tmp_path / "hooks")
+    monkeypatch.setattr(config, "HOOKS_WRITE_JSON", False)
+    monkeypatch.setattr(config, "HOOKS_NOVELTY_ENABLED", False)
+    monkeypatch.setattr(hook_generator, "LLM_CACHE_DIR", tmp_path / "llm")
+    monkeypatch.setattr(hook_novelty, "INDEX_DIR", tmp_path / "novelty")
+    (tmp_path / "hooks").mkdir()
+    try:
+        yield stub
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_batches_are_fetched_concurrently_and_merged(llm):
+    llm.delay = 0.3
+    hooks = hook_generator.run_generate(12)
+
+    assert len(hooks) == 12
+    assert len(set(hooks)) == 12
+    # ceil(12 / 5) batches, all answered by the first provider
+    assert llm.count("gemini") == 3
+    assert llm.count("openai") == 0
+    assert len({prompt for _, prompt in llm.requests}) == 3
+    assert llm.max_in_flight > 1
+    assert {r["source"] for r in hook_store.recent(20)} == {"gemini"}
+
+
+def test_cached_replies_skip_the_network(llm):
+    first = asyncio.run(hook_generator._generate_llm(10))
+    requests_made = len(llm.requests)
+    second = asyncio.run(hook_generator._generate_llm(10))
+
+    assert requests_made == 2
+    assert len(llm.requests) == requests_made
+    assert second == first
+
+
+@pytest.mark.parametrize("status", [429, 500])
+def test_failover_to_next_provider(llm, status):
+    llm.status["gemini"] = status
+    records = asyncio.run(hook_generator._generate_llm(10))
+
+    assert len(records) == 10
+    assert {source for _, source, _ in records} == {"openai"}
+    assert llm.count("gemini") == 2
+    assert llm.count("openai") == 2
+
+
+def test_failed_replies_are_not_cached(llm):
+    llm.status["gemini"] = 500
+    llm.status["openai"] = 500
+    assert asyncio.run(hook_generator._generate_llm(5)) == []
+
+    llm.status["gemini"] = 200
+    records = asyncio.run(hook_generator._generate_llm(5))
+    assert {source for _, source, _ in records} == {"gemini"}
+
+
+def test_falls_back_to_templates_when_every_provider_fails(llm):
+    llm.status["gemini"] = 503
+    llm.status["openai"] = 429
+    hooks = hook_generator.run_generate(5)
+
+    assert len(hooks) == 5
+    assert all(h in hook_generator.HOOK_TEMPLATES for h in hooks)
+    assert llm.count("gemini") == 1
+    assert llm.count("openai") == 1
+    assert {r["source"] for r in hook_store.recent(10)} == {"template"}
+
+
+def test_novelty_path_falls_back_to_templates(llm, monkeypatch):
+    monkeypatch.setattr(config, "HOOKS_NOVELTY_ENABLED", True)
+    monkeypatch.setattr(config, "HOOKS_NOVELTY_MAX_ROUNDS", 0)
+    llm.status["gemini"] = 500
+    llm.status["openai"] = 500
+
+    assert len(hook_generator.run_generate(5)) == 5
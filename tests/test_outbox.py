@@ -0,0 +1,23 @@
+"""
+outbox enqueue dedupe: per run, not forever.
+"""
+
+from kjc_cli import outbox
+
+
+def _send_all(payloads):
+    return [{"status": "sent"} for _ in payloads]
+
+
+def test_same_run_dedupes_and_later_run_enqueues_again(tmp_path):
+    db = tmp_path / "outbox.sqlite3"
+    posts = [{"text": "hook one"}, {"text": "hook two"}]
+
+    assert outbox.enqueue("buffer", posts, db_path=db, scope="run-1") == 2
+    # A resumed run re-enqueues what it already queued
+    assert outbox.enqueue("buffer", posts, db_path=db, scope="run-1") == 0
+    assert len(outbox.drain("buffer", _send_all, db_path=db)) == 2
+
+    assert outbox.enqueue("buffer", posts, db_path=db, scope="run-2") == 2
+    assert outbox.stats("buffer", db_path=db) == {"buffer": {"done": 2, "pending": 2}}
+    assert outbox.idempotency_key("buffer", posts[0], "run-1") != outbox.idempotency_key("buffer", posts[0], "run-2")
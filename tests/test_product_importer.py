@@ -0,0 +1,77 @@
+"""
+product_importer.iter_changes against feeds written to a temp dir: the
+added / changed / removed diff, what the persisted index keeps, and the
+update times ProductCatalog reads back from it.
+"""
+
+import sqlite3
+
+import pytest
+
+from kjc_cli import config
+from kjc_cli.modules import product_importer
+from kjc_cli.modules.product_catalog import ProductCatalog
+
+
+@pytest.fixture
+def feed(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "PRODUCTS_INDEX_DB", tmp_path / "products.sqlite3")
+    monkeypatch.setattr(config, "PRODUCTS_CHUNKSIZE", 2)
+    monkeypatch.setattr(config, "PRODUCTS_COLUMNAR_CACHE", False)
+    monkeypatch.setattr(product_importer, "CACHE_DIR", tmp_path / "cache")
+    path = tmp_path / "feed.csv"
+
+    def write(*rows):
+        lines = ["title,price,link,image"] + [",".join(row) for row in rows]
+        path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        return str(path)
+
+    return write
+
+
+def _diff(source):
+    return sorted((kind, p["link"]) for kind, p in product_importer.iter_changes(source))
+
+
+def test_link_less_chunk_does_not_end_the_feed(feed):
+    # chunksize 2: the second chunk holds only rows without a link
+    rows = [
+        ("A", "1.00", "https://shop/a", "a.jpg"),
+        ("A2", "2.00", "https://shop/a2", "a2.jpg"),
+        ("no link", "3.00", "", "b.jpg"),
+        ("no link either", "4.00", "", "c.jpg"),
+        ("D", "5.00", "https://shop/d", "d.jpg"),
+    ]
+    source = feed(*rows)
+    assert _diff(source) == [("added", "https://shop/a"), ("added", "https://shop/a2"), ("added", "https://shop/d")]
+
+    # D is still indexed: an edit to it is a change, not an add after a removal
+    source = feed(*rows[:4], ("D", "15.00", "https://shop/d", "d.jpg"))
+    assert _diff(source) == [("changed", "https://shop/d")]
+    assert set(product_importer.updated_at_map(source).index) == {"https://shop/a", "https://shop/a2", "https://shop/d"}
+
+
+def test_removed_products_leave_the_index(feed):
+    source = feed(("A", "1.00", "https://shop/a", "a.jpg"), ("B", "2.00", "https://shop/b", "b.jpg"))
+    assert len(_diff(source)) == 2
+
+    source = feed(("A", "1.00", "https://shop/a", "a.jpg"))
+    assert _diff(source) == [("removed", "https://shop/b")]
+    assert list(product_importer.updated_at_map(source).index) == ["https://shop/a"]
+
+
+def test_catalog_prefers_recently_changed_products(feed, monkeypatch):
+    monkeypatch.setattr(config, "CATALOG_CATEGORIES", {"bag": ["bag"]})
+    monkeypatch.setattr(config, "CATALOG_FRESH_WITHIN", 3600)
+    rows = [("Tote bag", "1000", "https://shop/tote", "t.jpg"), ("Canvas bag", "1200", "https://shop/canvas", "c.jpg")]
+    list(product_importer.iter_changes(feed(*rows)))
+    # Both were last seen changing a day ago
+    with sqlite3.connect(config.PRODUCTS_INDEX_DB) as conn:
+        conn.execute("UPDATE products SET updated_at = updated_at - 86400")
+    catalog = ProductCatalog.from_feed(feed(*rows))
+    assert not len(catalog.fresh(catalog.fresh_since))
+
+    source = feed(rows[0], ("Canvas bag", "11200", "https://shop/canvas", "c.jpg"))
+    assert _diff(source) == [("changed", "https://shop/canvas")]
+    catalog = ProductCatalog.from_feed(source)
+    assert [catalog.pick("a bag for the weekend")["link"] for _ in range(3)] == ["https://shop/canvas"] * 3